@@ -29,6 +29,10 @@ setup(
     ],
     scripts=[
         'bin/somewe-tagger',
+        'bin/somewe-convert-model',
+        'bin/somewe-server',
+        'bin/somewe-tagger-multifile',
+        'bin/somewe-bench',
     ],
     url="https://github.com/tsproisl/SoMeWeTa",
     download_url='https://github.com/tsproisl/SoMeWeTa/archive/v%s.tar.gz' % version["__version__"],
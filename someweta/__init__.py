@@ -1,3 +1,4 @@
+from someweta import async_tagger
 from someweta import averaged_structured_perceptron
 from someweta import tagger
 
@@ -5,3 +6,4 @@ from .version import __version__
 
 AveragedStructuredPerceptron = averaged_structured_perceptron.AveragedStructuredPerceptron
 ASPTagger = tagger.ASPTagger
+AsyncTagger = async_tagger.AsyncTagger
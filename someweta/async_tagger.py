@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import asyncio
+import concurrent.futures
+import functools
+import html
+import multiprocessing
+
+
+def _tag_sentences(asptagger, sentences):
+    """Tag a list of sentences as a batch and return a list of tagged
+    sentences.
+
+    """
+    return list(asptagger.tag_many(sentences, len(sentences)))
+
+
+def _init_worker(asptagger):
+    global _worker_tagger
+    _worker_tagger = asptagger
+
+
+def _tag_in_worker(sentences):
+    return _tag_sentences(_worker_tagger, sentences)
+
+
+class AsyncTagger:
+    """An asyncio interface to an ASPTagger. Concurrent calls of
+    tag_sentence etc. are collected into micro-batches that are
+    tagged in a worker thread (or in `processes` worker processes),
+    i.e. the event loop is never blocked by tagging.
+
+    A batch is started when a worker is idle and either the pending
+    calls contain `max_batch_size` sentences or the oldest pending
+    call has waited for `max_latency` seconds. While all workers are
+    busy, calls are collected for the next batch; the waiting time of
+    a call is thus bounded by the time it takes to tag a batch.
+
+    Use as an asynchronous context manager or call close() when done:
+
+        async with AsyncTagger(asptagger) as tagger:
+            tagged = await tagger.tag_sentence(["Ein", "Satz", "."])
+
+    """
+    def __init__(self, asptagger, max_batch_size=64, max_latency=0.005, processes=None):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        if processes is None:
+            # the tagger is not thread-safe
+            self.workers = 1
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.tag_batch = functools.partial(_tag_sentences, asptagger)
+        else:
+            # a tagger with a memory-mapped model is sent to the
+            # workers as a reference to the model file
+            try:
+                context = multiprocessing.get_context("fork")
+            except ValueError:
+                context = multiprocessing.get_context()
+            self.workers = processes
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(asptagger,))
+            self.tag_batch = _tag_in_worker
+        self.batches = 0
+        self._pending = []
+        self._pending_size = 0
+        self._running = 0
+        self._timer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Wait for running batches and shut down the workers."""
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def tag_sentences(self, sentences):
+        """Tag a list of sentences (lists of tokens) and return a list
+        of tagged sentences (lists of tuples).
+
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sentences, future))
+        self._pending_size += len(sentences)
+        self._schedule()
+        return await future
+
+    async def tag_sentence(self, sentence):
+        """Tag a sentence (cf. ASPTagger.tag_sentence)."""
+        tagged = await self.tag_sentences([sentence])
+        return tagged[0]
+
+    async def tag_xml_sentence(self, sentence):
+        """Tag a sentence that contains XML tags in addition to the word
+        tokens (cf. ASPTagger.tag_xml_sentence).
+
+        """
+        word_indexes = [i for i, line in enumerate(sentence) if not (line.startswith("<") and line.endswith(">"))]
+        tagged = await self.tag_sentence([html.unescape(sentence[i]) for i in word_indexes])
+        tags = {i: t[1:] for i, t in zip(word_indexes, tagged)}
+        return [(x,) + tags.get(idx, ()) for idx, x in enumerate(sentence)]
+
+    def _schedule(self):
+        if not self._pending or self._running >= self.workers:
+            # a finishing batch calls _schedule again
+            return
+        if self._pending_size >= self.max_batch_size:
+            self._start_batch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_latency, self._start_batch)
+
+    def _start_batch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending or self._running >= self.workers:
+            return
+        batch, size = [], 0
+        while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch_size):
+            sentences, future = self._pending.pop(0)
+            batch.append((sentences, future))
+            size += len(sentences)
+        self._pending_size -= size
+        self._running += 1
+        self.batches += 1
+        try:
+            task = asyncio.get_running_loop().run_in_executor(self.executor, self.tag_batch, [s for sentences, future in batch for s in sentences])
+        except RuntimeError as e:
+            # the executor has been shut down
+            self._running -= 1
+            for sentences, future in batch:
+                future.set_exception(e)
+            return
+        task.add_done_callback(functools.partial(self._finish_batch, batch))
+
+    def _finish_batch(self, batch, task):
+        self._running -= 1
+        if task.cancelled():
+            # e.g. the executor has been shut down
+            for sentences, future in batch:
+                future.cancel()
+        elif task.exception() is not None:
+            for sentences, future in batch:
+                if not future.done():
+                    future.set_exception(task.exception())
+        else:
+            results = task.result()
+            start = 0
+            for sentences, future in batch:
+                if not future.done():
+                    future.set_result(results[start:start + len(sentences)])
+                start += len(sentences)
+        # the pending calls have waited for this batch
+        if self._pending:
+            self._start_batch()
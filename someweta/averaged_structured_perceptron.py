@@ -3,15 +3,80 @@
 import collections
 import itertools
 import logging
+import multiprocessing
 import operator
 import random
 
 import numpy as np
 
 from someweta import utils
+from someweta.feature_index import FeatureIndex, HashedFeatureIndex
 
 Beam = collections.namedtuple("Beam", ["tags", "weight_sum", "features", "previous"])
 
+# greedy: best tag for every token given the previous decisions; fast but less accurate
+# beam: beam search with beam_size hypotheses; the default
+# viterbi: exact search over the second-order history (requires beam_history=2)
+DECODERS = ("greedy", "beam", "viterbi")
+
+
+class SparseAccumulator:
+    """A sparse matrix with `n_cols` columns to which values are added.
+    The non-zero entries are stored as sorted flat indexes (row *
+    n_cols + col) and their values, i.e. 16 bytes per entry. New
+    values are appended to a log that is merged into the sorted
+    entries when it has grown as large as them (or larger than
+    `log_size`), so the amortized costs of an addition are
+    logarithmic.
+
+    """
+    def __init__(self, n_cols, log_size=1 << 20):
+        self.n_cols = n_cols
+        self.log_size = log_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0)
+        self._log_keys = []
+        self._log_values = []
+        self._log_length = 0
+
+    def __len__(self):
+        self._compact()
+        return len(self.keys)
+
+    def add(self, rows, col, value):
+        """Add `value` to the entries (row, col) for every row in `rows`."""
+        keys = np.asarray(rows, dtype=np.int64) * self.n_cols + col
+        self._log_keys.append(keys)
+        self._log_values.append(np.full(len(keys), value, dtype=np.float64))
+        self._log_length += len(keys)
+        if self._log_length >= max(self.log_size, len(self.keys)):
+            self._compact()
+
+    def add_entries(self, rows, cols, values):
+        """Add values[i] to the entry (rows[i], cols[i]) for every i."""
+        self._log_keys.append(np.asarray(rows, dtype=np.int64) * self.n_cols + cols)
+        self._log_values.append(np.asarray(values, dtype=np.float64))
+        self._log_length += len(rows)
+        self._compact()
+
+    def entries(self):
+        """Return rows, columns and values of the non-zero entries."""
+        self._compact()
+        rows, cols = np.divmod(self.keys, self.n_cols)
+        return rows, cols, self.values
+
+    def _compact(self):
+        if self._log_length == 0:
+            return
+        keys = np.concatenate([self.keys] + self._log_keys)
+        values = np.concatenate([self.values] + self._log_values)
+        self._log_keys, self._log_values, self._log_length = [], [], 0
+        keys, inverse = np.unique(keys, return_inverse=True)
+        values = np.bincount(inverse.reshape(-1), weights=values, minlength=len(keys))
+        nonzero = values != 0
+        self.keys = keys[nonzero]
+        self.values = values[nonzero]
+
 
 class AveragedStructuredPerceptron:
     """An averaged structured perceptron.
@@ -23,90 +88,317 @@ class AveragedStructuredPerceptron:
     and Roark (2004) suggested the early update strategy.
 
     """
-    def __init__(self, beam_size, beam_history, iterations, latent_features, prior_weights=None, ignore_target=None):
+    def __init__(self, beam_size, beam_history, iterations, latent_features, prior_weights=None, ignore_target=None, hash_bits=None, batch_size=256, decoder="beam", train_parallel=1):
+        if decoder not in DECODERS:
+            raise ValueError("Unknown decoder '%s', use one of %s" % (decoder, ", ".join(DECODERS)))
+        if decoder == "viterbi" and beam_history != 2:
+            raise ValueError("The Viterbi decoder requires beam_history=2")
         self.beam_size = beam_size
         self.beam_history = beam_history
         self.iterations = iterations
         self.latent_features = latent_features
-        self.prior_weights = prior_weights
         self.ignore_target = ignore_target
+        # number of sentences that are decoded together in predict
+        self.batch_size = batch_size
+        # decoder used by predict; training always uses beam search
+        self.decoder = decoder
+        # number of worker processes for training by iterative
+        # parameter mixing; 1 means regular (sequential) training
+        self.train_parallel = train_parallel
+        # original values of the rows modified by _update (only
+        # recorded in the worker processes of parallel training)
+        self._original_rows = None
+        # profiling.Profiler that records the stages of tagging (only
+        # set by Profiler.instrument)
+        self.profiler = None
         # self.weights = collections.defaultdict(lambda: collections.defaultdict(float))
         # self.weights_c = collections.defaultdict(lambda: collections.defaultdict(float))
         self.target_mapping = {}
         self.reverse_mapping = None
         self.target_size = 0
         self.ignore_target_mapping = None
-        self.weights = {}
-        self.weights_c = {}
+        # Features are mapped to rows of the weight matrices. The
+        # matrices may have more rows than there are features (spare
+        # capacity for features added during training). Prior weights
+        # share the feature index with the weights. If hash_bits is
+        # given, features are hashed into a matrix of fixed size.
+        if hash_bits is None:
+            self.feature_index = FeatureIndex()
+        else:
+            self.feature_index = HashedFeatureIndex(hash_bits)
+        self.weights = np.zeros((0, 0))
+        # Scale factors of the rows of quantised integer weights (cf.
+        # model_io.quantize): the weights of row i are weights[i] *
+        # weight_scales[i]. None for float weights.
+        self.weight_scales = None
+        # Sums of the updates weighted by the counter, for averaging.
+        # They are only needed during training and are stored
+        # sparsely, as most features occur with few targets.
+        self.weights_c = None
+        self.prior_weights = None
+        if prior_weights is not None:
+            features = list(prior_weights.keys())
+            self._set_prior_weights(features, np.array([prior_weights[feat] for feat in features]))
 
     def fit(self, X, y, lengths):
         """"""
-        targets = collections.Counter(y)
-        former_target_size = self.target_size
+        self.fit_ids([np.array(self.feature_index.intern(features), dtype=np.intp) for features in X], y, lengths)
+
+    def fit_ids(self, X, y, lengths):
+        """Like fit, but X contains an array of feature ids (rows of the
+        weight matrix, cf. feature_index) for every token instead of a
+        list of feature strings.
+
+        """
+        self._set_targets(collections.Counter(y))
+        y = [self.target_mapping.get(target, self.ignore_target_mapping) for target in y]
+        self._reserve(len(self.feature_index))
+        self.weights_c = SparseAccumulator(self.target_size)
+        ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
+        if self.train_parallel > 1:
+            counter = self._fit_parallel(X, y, ranges)
+        else:
+            counter = 0
+            for it in range(self.iterations):
+                counter, total, incorrect, early_update = self._train_epoch(X, y, ranges, counter)
+                correct = total - incorrect
+                logging.info("Iteration %d: %d/%d = %.2f%% (%d early update)" % (it, correct, total, (correct / total) * 100, early_update))
+        self._average(counter)
+
+    def fit_stream(self, corpus, targets):
+        """Train on a corpus that is read sentence by sentence in every
+        iteration, e.g. from disk, instead of being held in memory.
+
+        `corpus` is a function that returns an iterable over the
+        sentences of the corpus as (X, y) pairs, where X contains the
+        static features and y the targets of the tokens of a
+        sentence. It is called once per iteration and is responsible
+        for shuffling the sentences. The latent features of a
+        sentence are requested with start=0, i.e. latent_features
+        has to refer to the sentence that has been yielded last.
+        `targets` counts the targets of the corpus.
+
+        """
+        self._set_targets(targets)
+        self._reserve(len(self.feature_index))
+        self.weights_c = SparseAccumulator(self.target_size)
+        counter = 0
+        for it in range(self.iterations):
+            total, incorrect, early_update = 0, 0, 0
+            for X, y in corpus():
+                X = [np.array(self.feature_index.intern(features), dtype=np.intp) for features in X]
+                self._reserve(len(self.feature_index))
+                y = [self.target_mapping.get(target, self.ignore_target_mapping) for target in y]
+                counter, erroneous, early = self._train_sentence(X, 0, y, counter)
+                incorrect += erroneous
+                early_update += early
+                total += 1
+            correct = total - incorrect
+            logging.info("Iteration %d: %d/%d = %.2f%% (%d early update)" % (it, correct, total, (correct / total) * 100, early_update))
+        self._average(counter)
+
+    def _set_targets(self, targets):
+        """Add the targets counted in `targets` to the target mapping
+        (more frequent targets get lower indexes).
+
+        """
         for target, freq in reversed(targets.most_common()):
             if target not in self.target_mapping and target != self.ignore_target:
                 self.target_mapping[target] = self.target_size
                 self.target_size += 1
         if self.ignore_target is not None:
             self.ignore_target_mapping = self.target_size
-        y = [self.target_mapping.get(target, self.ignore_target_mapping) for target in y]
-        if self.target_size > former_target_size and self.prior_weights is not None:
-            for feat in self.prior_weights:
-                self.prior_weights[feat].resize((self.target_size,))
+
+    def _average(self, counter):
+        """Replace the weights by the averaged weights at the end of
+        training.
+
+        """
+        n_features = len(self.feature_index)
+        self.weights = self.weights[:n_features]
+        rows, cols, values = self.weights_c.entries()
+        self.weights[rows, cols] -= values / counter
+        self.weights_c = None
+        if self.prior_weights is not None:
+            self.weights += self.prior_weights[:n_features]
+            # the prior is part of the weights now; scoring must not
+            # add it a second time
+            self.prior_weights = None
+
+    def _train_epoch(self, X, y, ranges, counter):
+        """Make one pass over the sentences given by `ranges` and shuffle
+        them afterwards. Return the updated counter, the number of
+        sentences, the number of incorrectly predicted sentences and
+        the number of early updates.
+
+        """
+        total, incorrect, early_update = 0, 0, 0
+        for start, length in ranges:
+            counter, erroneous, early = self._train_sentence(X[start:start + length], start, y[start:start + length], counter)
+            incorrect += erroneous
+            early_update += early
+            total += 1
+        # random.seed(it)
+        random.shuffle(ranges)
+        return counter, total, incorrect, early_update
+
+    def _train_sentence(self, X, start, y, counter):
+        """Decode a sentence and update the weights if the prediction is
+        wrong. Return the updated counter and whether the prediction
+        was wrong and whether it was an early update.
+
+        """
+        predicted, features = self._beam_search(X, start, y)
+        assert type(predicted) == type(y)
+        early_update = len(predicted) != len(y)
+        if self.ignore_target is not None:
+            erroneous = any(p != g and g != self.ignore_target_mapping for p, g in zip(predicted, y))
+        else:
+            erroneous = predicted != y
+        if erroneous:
+            self._update(y, predicted, features, counter)
+        counter += len(predicted)
+        return counter, erroneous, early_update
+
+    def _fit_parallel(self, X, y, ranges):
+        """Train by iterative parameter mixing (McDonald et al. 2010):
+        The training data are split into `train_parallel` shards. In
+        every iteration, each shard is trained for one epoch in a
+        separate process, starting from the current weights, averaging
+        counters and counter. The results are mixed uniformly, i.e.
+        the new weights are the mean of the weights of the shards.
+        Return the mixed counter.
+
+        The worker processes are forked and inherit the model and the
+        training data; they only send back the rows that they have
+        modified.
+
+        """
+        global _parallel_training
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            raise ValueError("Parallel training requires the 'fork' start method") from None
+        n_shards = min(self.train_parallel, len(ranges))
+        random.shuffle(ranges)
+        div, mod = divmod(len(ranges), n_shards)
+        shards = [ranges[i * div + min(i, mod):(i + 1) * div + min(i + 1, mod)] for i in range(n_shards)]
         counter = 0
-        ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
         for it in range(self.iterations):
-            total, incorrect, early_update = 0, 0, 0
-            for start, length in ranges:
-                local_X = X[start:start + length]
-                local_y = y[start:start + length]
-                predicted, features = self._beam_search(local_X, start, local_y)
-                assert type(predicted) == type(y)
-                if len(predicted) != len(local_y):
-                    early_update += 1
-                if self.ignore_target is not None:
-                    erroneous = any(p != g and g != self.ignore_target_mapping for p, g in zip(predicted, local_y))
-                else:
-                    erroneous = predicted != local_y
-                if erroneous:
-                    incorrect += 1
-                    self._update(local_y, predicted, features, counter)
-                counter += len(predicted)
-                total += 1
-            # random.seed(it)
-            random.shuffle(ranges)
+            # the workers inherit the state of the random number
+            # generator; seed them individually so that they do not
+            # shuffle their shards identically
+            seeds = [random.randrange(2**32) for i in range(n_shards)]
+            _parallel_training = (self, X, y, shards)
+            try:
+                with context.Pool(processes=n_shards) as pool:
+                    results = pool.map(_train_shard, [(i, counter, seeds[i]) for i in range(n_shards)])
+            finally:
+                _parallel_training = None
+            counter_sum, total, incorrect, early_update = self._mix_shards(results, shards)
+            counter = counter_sum / n_shards
             correct = total - incorrect
             logging.info("Iteration %d: %d/%d = %.2f%% (%d early update)" % (it, correct, total, (correct / total) * 100, early_update))
-        for feat in self.weights:
-            self.weights[feat] -= self.weights_c[feat] / counter
-        if self.prior_weights is not None:
-            for feat in self.prior_weights:
-                if feat not in self.weights:
-                    self.weights[feat] = self.prior_weights[feat]
-                else:
-                    self.weights[feat] += self.prior_weights[feat]
+        return counter
+
+    def _mix_shards(self, results, shards):
+        """Mix the results of the shards of one iteration of parallel
+        training (cf. _train_shard) into the weights and averaging
+        sums and update `shards` with the reshuffled shards. Return
+        the sum of the counters and the statistics of the iteration.
+
+        """
+        n_shards = len(results)
+        # all workers started from the same features; the ids of their
+        # new features start here
+        n_known = len(self.feature_index)
+        total, incorrect, early_update = 0, 0, 0
+        counter_sum = 0
+        for i, (shard, shard_counter, shard_total, shard_incorrect, shard_early_update, rows, weights, new_features, new_weights, c_rows, c_cols, c_values) in enumerate(results):
+            # the worker has shuffled its shard for the next iteration
+            shards[i] = shard
+            counter_sum += shard_counter
+            total += shard_total
+            incorrect += shard_incorrect
+            early_update += shard_early_update
+            self.weights[rows] += weights / n_shards
+            if len(new_features) > 0:
+                ids = np.array(self.feature_index.intern(new_features), dtype=np.intp)
+                self._reserve(len(self.feature_index))
+                self.weights[ids] += new_weights / n_shards
+                # map the worker's ids of new features to ours
+                new = c_rows >= n_known
+                c_rows[new] = ids[c_rows[new] - n_known]
+            self.weights_c.add_entries(c_rows, c_cols, c_values / n_shards)
+        return counter_sum, total, incorrect, early_update
+
+    def _train_shard(self, X, y, ranges, counter):
+        """Train one epoch on a shard in a worker process (cf.
+        _fit_parallel) and return the counter, the statistics of the
+        epoch, the modified rows of the weights (the differences for
+        rows of features that were known before and the full rows of
+        new features) and the entries that have been added to the
+        averaging sums. Features that are new in this worker have
+        ids starting at the number of known features.
+
+        """
+        n_known = len(self.feature_index)
+        self._original_rows = {}
+        self.weights_c = SparseAccumulator(self.target_size)
+        counter, total, incorrect, early_update = self._train_epoch(X, y, ranges, counter)
+        # rows of new features are sent in full
+        rows = np.array(sorted(r for r in self._original_rows if r < n_known), dtype=np.intp)
+        if len(rows) > 0:
+            original_weights = np.array([self._original_rows[r] for r in rows])
+        else:
+            original_weights = np.zeros((0, self.target_size))
+        weights = self.weights[rows] - original_weights
+        n_features = len(self.feature_index)
+        new_features = self.feature_index.features[n_known:n_features] if n_features > n_known else []
+        return (counter, total, incorrect, early_update, rows, weights, new_features, self.weights[n_known:n_features]) + self.weights_c.entries()
 
     def predict(self, X, lengths):
         """"""
         if self.reverse_mapping is None:
             self.reverse_mapping = {v: k for k, v in self.target_mapping.items()}
         ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
-        for start, length in ranges:
-            local_X = X[start:start + length]
-            predicted, features = self._beam_search(local_X, start)
-            predicted = [self.reverse_mapping[p] for p in predicted]
-            yield predicted
+        for batch_start in range(0, len(ranges), self.batch_size):
+            batch = ranges[batch_start:batch_start + self.batch_size]
+            static_weights = [self._static_weights(X[start:start + length]) for start, length in batch]
+            starts = [start for start, length in batch]
+            for predicted in self._decode(static_weights, starts):
+                yield [self.reverse_mapping[p] for p in predicted]
+
+    def _static_weights(self, X):
+        """Return the static weights of the tokens of a sentence as rows
+        of a matrix. `X` contains the list of static features of every
+        token.
+
+        """
+        return self._sum_weights([self.feature_index.lookup(features) for features in X])
+
+    def _decode(self, static_weights, starts):
+        """Decode a batch of sentences with the selected decoder.
+        `static_weights` contains a matrix of static weights for every
+        sentence.
+
+        """
+        if self.decoder == "greedy":
+            return self._greedy_search(static_weights, starts)
+        elif self.decoder == "viterbi":
+            cache = {}
+            return [self._viterbi_search(weights, start, cache) for weights, start in zip(static_weights, starts)]
+        elif len(static_weights) == 1:
+            # a single sentence is decoded faster without the overhead
+            # of the batched decoder
+            return [self._beam_search(None, starts[0], static_weights=static_weights[0])[0]]
+        else:
+            return self._batch_beam_search(static_weights, starts)
 
     def score(self, X, y, lengths):
         """"""
-        if self.reverse_mapping is None:
-            self.reverse_mapping = {v: k for k, v in self.target_mapping.items()}
         predicted = []
-        ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
-        for start, length in ranges:
-            local_X = X[start:start + length]
-            local_pred, features = self._beam_search(local_X, start)
-            local_pred = [self.reverse_mapping[p] for p in local_pred]
+        for local_pred in self.predict(X, lengths):
             predicted.extend(local_pred)
         accuracy = utils.evaluate(y, predicted, self.ignore_target)
         coarse_accuracy = None
@@ -116,6 +408,52 @@ class AveragedStructuredPerceptron:
             coarse_accuracy = utils.evaluate(coarse_y, coarse_predicted, self.ignore_target)
         return accuracy, coarse_accuracy
 
+    def _lookup(self, features):
+        """Map feature strings to row indexes; unknown features are
+        skipped.
+
+        """
+        return np.array(self.feature_index.lookup(features), dtype=np.intp)
+
+    def _set_prior_weights(self, features, weights, hash_bits=None):
+        """Use `weights` as prior weights. `features` are the feature
+        strings of the rows of `weights` or None if the prior model
+        uses feature hashing with `hash_bits` bits.
+
+        """
+        if features is None:
+            if self.feature_index.hash_bits not in (None, hash_bits):
+                logging.warning("The prior model uses %d hash bits, ignoring the requested %d hash bits." % (hash_bits, self.feature_index.hash_bits))
+            self.feature_index = HashedFeatureIndex(hash_bits)
+            self.prior_weights = weights
+        elif self.feature_index.hash_bits is not None:
+            self.prior_weights = np.zeros((len(self.feature_index), weights.shape[1]))
+            np.add.at(self.prior_weights, self.feature_index.lookup(features), weights)
+        else:
+            self.feature_index = FeatureIndex(features)
+            self.prior_weights = weights
+
+    def _reserve(self, n_features):
+        """Make sure that the weight matrices have at least `n_features`
+        rows and `target_size` columns.
+
+        """
+        if self.weight_scales is not None:
+            # training updates the weights as floats
+            self.weights = self.weights * self.weight_scales[:, None].astype(np.float64)
+            self.weight_scales = None
+        for name in ("weights", "prior_weights"):
+            old = getattr(self, name)
+            if old is None:
+                continue
+            rows, cols = old.shape
+            if rows >= n_features and cols == self.target_size:
+                continue
+            new_rows = max(n_features, 2 * rows) if rows < n_features else rows
+            new = np.zeros((new_rows, self.target_size))
+            new[:old.shape[0], :old.shape[1]] = old
+            setattr(self, name, new)
+
     @staticmethod
     def _extract_feature_sequence(beam):
         """"""
@@ -125,16 +463,27 @@ class AveragedStructuredPerceptron:
             beam = beam.previous
         return sequence[::-1]
 
-    def _beam_search(self, X, start, y=None):
-        """"""
+    def _beam_search(self, X, start, y=None, static_weights=None):
+        """Beam search over a sentence. `X` contains the static feature
+        ids of every token. For decoding without training, the static
+        weights of the tokens can be given instead (and X is None).
+
+        """
         beams = [Beam([], 0, [], None)]
         gold_tags = []
-        for i, static_features in enumerate(X):
+        for i in range(len(X) if static_weights is None else len(static_weights)):
             agenda = {}
-            weight_sum = self._predict_static(static_features)
+            if static_weights is None:
+                static_features = X[i]
+                weight_sum = self._predict_static(static_features)
+            else:
+                static_features = None
+                weight_sum = static_weights[i]
+            if self.profiler is not None:
+                self.profiler.count("beam size", len(beams))
             for beam in beams:
                 latent_features = self.latent_features(start, beam.tags, i)
-                features = static_features + latent_features
+                features = (static_features, latent_features)
                 for prediction, weight in self._predict_latent(latent_features, weight_sum):
                     tags = beam.tags + [prediction]
                     history = tuple(tags[-self.beam_history:])
@@ -142,6 +491,8 @@ class AveragedStructuredPerceptron:
                     in_agenda = agenda.get(history)
                     if in_agenda is None or new_weight_sum > in_agenda.weight_sum:
                         agenda[history] = Beam(tags, new_weight_sum, features, beam)
+            if self.profiler is not None:
+                self.profiler.count("agenda size", len(agenda))
             beams = sorted(agenda.values(), key=operator.attrgetter("weight_sum"), reverse=True)[:self.beam_size]
             if y is not None:
                 gold_tags.append(y[i])
@@ -153,100 +504,271 @@ class AveragedStructuredPerceptron:
                     break
         return beams[0].tags, self._extract_feature_sequence(beams[0])
 
-    def _predict_static(self, features):
+    def _batch_beam_search(self, static_weights, starts):
+        """Beam search over a batch of sentences. All hypotheses of all
+        sentences are advanced together, i.e. the scores for one
+        position are computed with a few matrix operations instead of
+        one _predict_latent call per hypothesis. The result is the
+        same as calling _beam_search for every sentence (including the
+        handling of ties).
+
+        """
+        n_targets = self.target_size
+        k = min(self.beam_size, n_targets)
+        lengths = [len(weights) for weights in static_weights]
+        results = [[] for weights in static_weights]
+        token_offsets = [0] + list(itertools.accumulate(lengths))
+        static_weights = np.concatenate(static_weights) if len(static_weights) > 0 else np.zeros((0, n_targets))
+        # hypotheses of the active sentences, grouped by sentence and
+        # in beam order
+        hyp_sentence = [s for s, length in enumerate(lengths) if length > 0]
+        hyp_tags = [[] for s in hyp_sentence]
+        hyp_weight = np.zeros(len(hyp_sentence))
+        for i in range(max(lengths, default=0)):
+            latent_ids = [self.feature_index.lookup(self.latent_features(starts[s], tags, i)) for s, tags in zip(hyp_sentence, hyp_tags)]
+            weights = self._sum_weights(latent_ids)
+            weights += static_weights[[token_offsets[s] + i for s in hyp_sentence]]
+            predictions = self._top_k(weights, k)
+            # candidates in the order in which _beam_search visits them
+            cand_hyp = np.repeat(np.arange(len(hyp_sentence)), k)
+            cand_pred = predictions.ravel()
+            cand_weight = hyp_weight[cand_hyp] + np.take_along_axis(weights, predictions, axis=1).ravel()
+            # candidates with the same history compete for one slot in
+            # the agenda; the history of a candidate is the history
+            # prefix of its hypothesis plus the prediction
+            prefixes = {}
+            hyp_prefix = np.array([prefixes.setdefault((s, tuple(tags[len(tags) - self.beam_history + 1:])), len(prefixes)) for s, tags in zip(hyp_sentence, hyp_tags)])
+            keys = hyp_prefix[cand_hyp] * n_targets + cand_pred
+            # agenda entries are ordered by the first occurrence of
+            # their history; the best candidate wins, earlier ones on ties
+            unique_keys, first = np.unique(keys, return_index=True)
+            order = np.lexsort((np.arange(len(keys)), -cand_weight, keys))
+            best = order[np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])]
+            entry_sentence = np.asarray(hyp_sentence)[cand_hyp[best]]
+            if self.profiler is not None:
+                n_sentences = len(set(hyp_sentence))
+                self.profiler.count("beam size", len(hyp_sentence), n_sentences)
+                self.profiler.count("agenda size", len(best), n_sentences)
+            entry_weight = cand_weight[best]
+            # stable sort by weight within each sentence and prune
+            order = np.lexsort((first, -entry_weight, entry_sentence))
+            group_start = np.flatnonzero(np.r_[True, entry_sentence[order][1:] != entry_sentence[order][:-1]])
+            rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+            survivors = best[order[rank < self.beam_size]]
+            new_sentence, new_tags, new_weight = [], [], []
+            for c in survivors:
+                s = hyp_sentence[cand_hyp[c]]
+                tags = hyp_tags[cand_hyp[c]] + [cand_pred[c]]
+                if lengths[s] == i + 1:
+                    # the first surviving hypothesis is the best one
+                    if len(results[s]) == 0:
+                        results[s] = tags
+                    continue
+                new_sentence.append(s)
+                new_tags.append(tags)
+                new_weight.append(cand_weight[c])
+            hyp_sentence, hyp_tags, hyp_weight = new_sentence, new_tags, np.array(new_weight)
+        return results
+
+    def _greedy_search(self, static_weights, starts):
+        """Greedy decoding of a batch of sentences: Every token gets the
+        highest scoring tag given the tags of the preceding tokens.
+        This is equivalent to a beam search with beam size 1 (apart
+        from the handling of ties) but avoids its bookkeeping.
+
+        """
+        lengths = [len(weights) for weights in static_weights]
+        results = [[] for weights in static_weights]
+        token_offsets = [0] + list(itertools.accumulate(lengths))
+        static_weights = np.concatenate(static_weights) if len(static_weights) > 0 else np.zeros((0, self.target_size))
+        for i in range(max(lengths, default=0)):
+            active = [s for s, length in enumerate(lengths) if length > i]
+            latent_ids = [self.feature_index.lookup(self.latent_features(starts[s], results[s], i)) for s in active]
+            weights = self._sum_weights(latent_ids)
+            weights += static_weights[[token_offsets[s] + i for s in active]]
+            for s, prediction in zip(active, weights.argmax(axis=1)):
+                results[s].append(prediction)
+        return results
+
+    def _viterbi_search(self, static_weights, start, cache):
+        """Exact second-order Viterbi decoding of a sentence. The state
+        is the same as the history used by beam search, i.e. the tags
+        of the two preceding tokens. This assumes (like the
+        recombination of hypotheses in beam search) that the latent
+        features only depend on these two tags. `cache` is passed on
+        to _latent_weight_tensor.
+
+        """
+        if len(static_weights) == 0:
+            return []
+        # best[t1, t]: score of the best sequence whose last two tags are t1 and t
+        best = self._latent_weight_tensor(start, 0, cache)[0] + static_weights[0]
+        backpointers = []
+        for i in range(1, len(static_weights)):
+            # scores[t2, t1, t] for extending (t2, t1) with tag t
+            scores = self._latent_weight_tensor(start, i, cache)
+            scores += best[:, :, None]
+            scores += static_weights[i]
+            backpointer = scores.argmax(axis=0)
+            backpointers.append(backpointer)
+            best = np.take_along_axis(scores, backpointer[None], axis=0)[0]
+        t1, t = np.unravel_index(best.argmax(), best.shape)
+        tags = [t]
+        for i in range(len(backpointers) - 1, -1, -1):
+            if i > 0:
+                t1, t = backpointers[i][t1, t], t1
+            else:
+                t = t1
+            tags.append(t)
+        return tags[::-1]
+
+    def _latent_weight_tensor(self, start, i, cache):
+        """Return the latent weights for position `i` for every history:
+        An array of shape (T, T, T) where the first two dimensions are
+        the tags of the two preceding tokens (length 1 for missing
+        tokens at the beginning of the sentence, i.e. (1, 1, T) for i =
+        0 and (1, T, T) for i = 1). `cache` is a dictionary that
+        persists for one batch of sentences and can be used by more
+        efficient implementations in subclasses.
+
+        """
+        n2 = self.target_size if i >= 2 else 1
+        n1 = self.target_size if i >= 1 else 1
+        histories = [(t2, t1) for t2 in range(n2) for t1 in range(n1)]
+        # tags before the history do not influence the latent features
+        padding = [0] * max(i - 2, 0)
+        latent_ids = [self.feature_index.lookup(self.latent_features(start, padding + [t2, t1][2 - min(i, 2):], i)) for t2, t1 in histories]
+        return self._sum_weights(latent_ids).reshape((n2, n1, self.target_size))
+
+    def _sum_weights(self, id_lists):
+        """Return the sums of the weights (and prior weights) for every
+        list of row indexes in `id_lists`.
+
+        """
+        weights = self._sum_rows(self.weights, id_lists, self.weight_scales)
+        if self.prior_weights is not None:
+            weights += self._sum_rows(self.prior_weights, id_lists)
+        return weights
+
+    @staticmethod
+    def _sum_rows(matrix, id_lists, scales=None):
+        """Return the sums matrix[ids].sum(axis=0) for every list of row
+        indexes in `id_lists` as rows of a new matrix. The rows are
+        added in the same order as in matrix[ids].sum(axis=0), so the
+        results are identical. If `matrix` is quantised, the rows are
+        gathered in its integer type and multiplied by their `scales`.
+
+        """
+        sums = np.zeros((len(id_lists), matrix.shape[1]))
+        lengths = np.fromiter(map(len, id_lists), dtype=np.intp, count=len(id_lists))
+        width = lengths.max(initial=0)
+        if width == 0:
+            return sums
+        mask = np.arange(width) < lengths[:, None]
+        ids = np.zeros(mask.shape, dtype=np.intp)
+        ids[mask] = np.fromiter(itertools.chain.from_iterable(id_lists), dtype=np.intp, count=lengths.sum())
+        for j in range(width):
+            rows = mask[:, j]
+            complete = rows.all()
+            column = ids[:, j] if complete else ids[rows, j]
+            if scales is None:
+                values = matrix[column]
+            else:
+                values = matrix[column] * scales[column, None]
+            if complete:
+                sums += values
+            else:
+                sums[rows] += values
+        return sums
+
+    @staticmethod
+    def _top_k(weights, k):
+        """Return the indexes of the `k` largest values in every row of
+        `weights` in descending order. The result is the same as
+        np.argsort(row)[-k:][::-1] for every row: Rows are pruned
+        with argpartition and only rows with ties among the k + 1
+        largest values are sorted completely.
+
+        """
+        n_cols = weights.shape[1]
+        if k >= n_cols:
+            return np.argsort(weights, axis=1)[:, ::-1]
+        candidates = np.argpartition(weights, n_cols - k - 1, axis=1)[:, n_cols - k - 1:]
+        values = np.take_along_axis(weights, candidates, axis=1)
+        order = np.argsort(values, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        top = candidates[:, :0:-1]
+        ties = np.any(values[:, 1:] == values[:, :-1], axis=1)
+        if ties.any():
+            top[ties] = np.argsort(weights[ties], axis=1)[:, :-k - 1:-1]
+        return top
+
+    def _row_sum(self, ids):
+        """Return the sum of the rows `ids` of the weight matrix. Quantised
+        rows are summed in their integer type, weighted by their scale
+        factors.
+
+        """
+        if self.weight_scales is None:
+            return self.weights[ids].sum(axis=0, dtype=np.float64)
+        return np.dot(self.weight_scales[ids].astype(np.float64), self.weights[ids])
+
+    def _predict_static(self, ids):
         """"""
-        weight_sum = np.zeros(self.target_size)
-        weight_sum += np.sum([self.weights[feat] for feat in features if feat in self.weights], axis=0)
+        weight_sum = self._row_sum(ids)
         if self.prior_weights is not None:
-            weight_sum += np.sum([self.prior_weights[feat] for feat in features if feat in self.prior_weights], axis=0)
+            weight_sum += self.prior_weights[ids].sum(axis=0, dtype=np.float64)
         return weight_sum
 
     def _predict_latent(self, features, static_weights):
         """"""
-        weight_sum = np.sum([self.weights[feat] for feat in features if feat in self.weights], axis=0)
+        ids = self._lookup(features)
+        weight_sum = self._row_sum(ids)
         if self.prior_weights is not None:
-            weight_sum += np.sum([self.prior_weights[feat] for feat in features if feat in self.prior_weights], axis=0)
+            weight_sum += self.prior_weights[ids].sum(axis=0, dtype=np.float64)
         weight_sum += static_weights
         predictions = np.argsort(weight_sum)[-self.beam_size:]
         return reversed(list(zip(predictions, weight_sum[predictions])))
 
     def _update(self, y, predicted, features, counter):
         """"""
-        for feature_set, true_cls, predicted_cls in zip(features, y, predicted):
+        for (static_ids, latent_features), true_cls, predicted_cls in zip(features, y, predicted):
             if true_cls != predicted_cls:
                 if self.ignore_target is not None and true_cls == self.ignore_target_mapping:
                     continue
-                for feat in feature_set:
-                    if feat not in self.weights:
-                        self.weights[feat] = np.zeros(self.target_size)
-                        self.weights_c[feat] = np.zeros(self.target_size)
-                    self.weights[feat][true_cls] += 1
-                    self.weights_c[feat][true_cls] += counter
-                    self.weights[feat][predicted_cls] -= 1
-                    self.weights_c[feat][predicted_cls] -= counter
+                ids = np.concatenate((static_ids, self.feature_index.intern(latent_features))).astype(np.intp)
+                self._reserve(len(self.feature_index))
+                if self._original_rows is not None:
+                    self._save_original_rows(ids)
+                np.add.at(self.weights, (ids, true_cls), 1)
+                self.weights_c.add(ids, true_cls, counter)
+                np.add.at(self.weights, (ids, predicted_cls), -1)
+                self.weights_c.add(ids, predicted_cls, -counter)
             counter += 1
 
-# def train_by_iterative_parameter_mixing(training_data, iterations=10, beam_size=5, n_shards=5):
-#     """Iterative parameter mixing was first described by McDonald et al.
-#     (2010).
-
-#     """
-#     weights = collections.defaultdict(lambda: collections.defaultdict(float))
-#     weights_c = collections.defaultdict(lambda: collections.defaultdict(float))
-#     counter = 0
-#     random.seed(42)
-#     random.shuffle(training_data)
-#     div, mod = divmod(len(training_data), n_shards)
-#     shards = [training_data[i * div + min(i, mod):(i + 1) * div + min(i + 1, mod)] for i in range(n_shards)]
-#     for it in range(iterations):
-#         ipm = functools.partial(ipm_iteration, it=it, beam_size=beam_size, w=weights, wc=weights_c, c=counter)
-#         results = map(ipm, shards)
-#         weights = collections.defaultdict(lambda: collections.defaultdict(float))
-#         weights_c = collections.defaultdict(lambda: collections.defaultdict(float))
-#         counter, correct, total, early_update = 0, 0, 0, 0
-#         for w, wc, c, cor, tot, earl_upd in results:
-#             for feat in w:
-#                 for cls, weight in w[feat].items():
-#                     weights[feat][cls] += weight / n_shards
-#             for feat in wc:
-#                 for cls, weight in wc[feat].items():
-#                         weights_c[feat][cls] += weight / n_shards
-#             counter += c / n_shards
-#             correct += cor
-#             total += tot
-#             early_update += earl_upd
-#         logging.info("Iteration %d: %d/%d = %.2f%% (%d early update)" % (it, correct, total, (correct / total) * 100, early_update))
-#     # return weights - weights_c / counter
-#     for feat in weights:
-#         for cls in weights[feat]:
-#             weights[feat][cls] -= weights_c[feat][cls] / counter
-#     return weights
-
-
-# def ipm_iteration(training_data, it, beam_size, w, wc, c):
-#     """"""
-#     weights = collections.defaultdict(lambda: collections.defaultdict(float))
-#     weights_c = collections.defaultdict(lambda: collections.defaultdict(float))
-#     counter = c
-#     random.seed(it)
-#     random.shuffle(training_data)
-#     for feat in w:
-#         for cls, weight in w[feat].items():
-#             weights[feat][cls] = weight
-#     for feat in wc:
-#         for cls, weight in wc[feat].items():
-#             weights_c[feat][cls] = weight
-#     total, incorrect, early_update = 0, 0, 0
-#     for structure in training_data:
-#         items, static_features, gold_classes = structure
-#         predicted, features = beam_search(items, static_features, weights, beam_size, gold_classes)
-#         assert type(predicted) == type(gold_classes)
-#         if len(predicted) != len(gold_classes):
-#             early_update += 1
-#         if predicted != gold_classes:
-#             incorrect += 1
-#             weights, weights_c = update(weights, weights_c, gold_classes, predicted, features, counter)
-#         counter += len(predicted)
-#         total += 1
-#     correct = total - incorrect
-#     return weights, weights_c, counter, correct, total, early_update
+    def _save_original_rows(self, ids):
+        """Remember the values of rows before they are modified for the
+        first time (cf. _train_shard).
+
+        """
+        original_rows = self._original_rows
+        for idx in ids.tolist():
+            if idx not in original_rows:
+                original_rows[idx] = self.weights[idx].copy()
+
+
+# State of parallel training that is inherited by the forked worker
+# processes (cf. AveragedStructuredPerceptron._fit_parallel).
+_parallel_training = None
+
+
+def _train_shard(args):
+    """"""
+    shard, counter, seed = args
+    random.seed(seed)
+    model, X, y, shards = _parallel_training
+    ranges = shards[shard]
+    result = model._train_shard(X, y, ranges, counter)
+    return (ranges,) + result
+
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from someweta import cli
+from someweta import utils
+from someweta import ASPTagger
+from someweta.version import __version__
+
+# only available in a source checkout
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "data", "additional_training_german_web_social_media.txt")
+BENCHMARKS = ("train", "load", "read", "features", "beam", "parallel")
+
+
+def arguments():
+    """Process command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark training, model loading and tagging")
+    parser.add_argument("--corpus", type=os.path.abspath, default=DEFAULT_CORPUS, help="Tagged corpus (one token-pos pair per line, sentences delimited by an empty line) that is replicated until it has at least --tokens tokens; default: data/additional_training_german_web_social_media.txt")
+    parser.add_argument("--tokens", type=int, default=50000, help="Minimal size of the benchmark corpus; default: 50000")
+    parser.add_argument("--model", type=os.path.abspath, help="Benchmark loading and tagging with this model instead of a model trained on the benchmark corpus")
+    parser.add_argument("-i", "--iterations", type=int, default=2, help="Number of training iterations; default: 2")
+    parser.add_argument("--beam-sizes", type=lambda s: [int(b) for b in s.split(",")], default=[1, 2, 5, 10], help="Comma-separated list of beam sizes; default: 1,2,5,10")
+    parser.add_argument("--parallel", type=lambda s: [int(p) for p in s.split(",")], help="Comma-separated list of numbers of worker processes; default: 1, 2, 4, … up to the number of CPUs")
+    parser.add_argument("--repeat", type=int, default=3, help="Report the best of this many runs of every measurement; default: 3")
+    parser.add_argument("--only", type=lambda s: s.split(","), default=list(BENCHMARKS), help="Comma-separated list of benchmarks to run (%s); default: all" % ",".join(BENCHMARKS))
+    parser.add_argument("-o", "--output", type=os.path.abspath, help="Write the results to this file instead of STDOUT")
+    parser.add_argument("-v", "--version", action="version", version="SoMeWeTa %s" % __version__, help="Output version information and exit.")
+    args = parser.parse_args()
+    if not os.path.isfile(args.corpus):
+        parser.error("Corpus %s not found; please use --corpus" % args.corpus)
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error("Unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+    if args.parallel is None:
+        args.parallel = [2**i for i in range(int(math.log2(multiprocessing.cpu_count())) + 1)]
+    return args
+
+
+def rss():
+    """Return the resident set size of the process in bytes or None."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def best_of(repeat, function):
+    """Call `function` `repeat` times and return the shortest running
+    time.
+
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def read_corpus(filename, min_tokens):
+    """Read a tagged corpus and replicate it until it has at least
+    `min_tokens` tokens.
+
+    """
+    with open(filename, encoding="utf-8") as fh:
+        words, tags, lengths = utils.read_corpus(fh, tagged=True)
+    copies = max(1, math.ceil(min_tokens / len(words)))
+    return words * copies, tags * copies, lengths * copies
+
+
+def sentences(words, lengths):
+    """Split the corpus into a list of sentences."""
+    result, start = [], 0
+    for length in lengths:
+        result.append(words[start:start + length])
+        start += length
+    return result
+
+
+def bench_train(words, tags, lengths, iterations, model):
+    """Train a model, save it to `model` and return the time needed
+    for feature extraction and per iteration.
+
+    """
+    # the sentences are shuffled after every iteration
+    random.seed(0)
+    asptagger = ASPTagger(iterations=iterations)
+    t0 = time.perf_counter()
+    static_features = asptagger.get_static_features(words, lengths)
+    t1 = time.perf_counter()
+    asptagger.train(words, tags, lengths, static_features)
+    t2 = time.perf_counter()
+    asptagger.save(model)
+    return {"iterations": iterations,
+            "feature_extraction_seconds": t1 - t0,
+            "seconds_per_iteration": (t2 - t1) / iterations,
+            "tokens_per_second": len(words) * iterations / (t2 - t1)}
+
+
+def _load_in_child(model, lazy):
+    before = rss()
+    t0 = time.perf_counter()
+    asptagger = ASPTagger()
+    asptagger.load(model, lazy)
+    t1 = time.perf_counter()
+    after = rss()
+    return t1 - t0, before, after
+
+
+def bench_load(model, repeat):
+    """Measure the time and memory needed for loading `model` (eagerly
+    and lazily), each time in a fresh process.
+
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {"model_size_mb": os.path.getsize(model) / 2**20}
+    for lazy in (False, True):
+        runs = []
+        for _ in range(repeat):
+            with context.Pool(1) as pool:
+                runs.append(pool.apply(_load_in_child, (model, lazy)))
+        seconds, before, after = min(runs)
+        result = {"seconds": seconds}
+        if before is not None:
+            result["rss_mb"] = after / 2**20
+            result["rss_delta_mb"] = (after - before) / 2**20
+        results["lazy" if lazy else "eager"] = result
+    return results
+
+
+def bench_read(words, tags, lengths, repeat):
+    """Measure the throughput of reading the corpus from a file, with
+    and without tags (cf. utils.read_corpus).
+
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for tagged in (True, False):
+            filename = os.path.join(tmp, "corpus.txt")
+            with open(filename, mode="w", encoding="utf-8") as fh:
+                if tagged:
+                    fh.write("".join("".join("%s\t%s\n" % wt for wt in zip(*sentence)) + "\n" for sentence in zip(sentences(words, lengths), sentences(tags, lengths))))
+                else:
+                    fh.write("".join("\n".join(sentence) + "\n\n" for sentence in sentences(words, lengths)))
+
+            def read():
+                with open(filename, encoding="utf-8") as fh:
+                    utils.read_corpus(fh, tagged)
+
+            seconds = best_of(repeat, read)
+            results["tagged" if tagged else "plain"] = {"seconds": seconds,
+                                                        "tokens_per_second": len(words) / seconds,
+                                                        "mb_per_second": os.path.getsize(filename) / 2**20 / seconds}
+    return results
+
+
+def bench_features(words, lengths, repeat):
+    """Measure the throughput of static feature extraction."""
+    asptagger = ASPTagger()
+    seconds = best_of(repeat, lambda: asptagger._get_static_features(words, lengths))
+    return {"seconds": seconds, "tokens_per_second": len(words) / seconds}
+
+
+def bench_beam(words, lengths, model, beam_sizes, repeat):
+    """Measure the tagging throughput for every beam size."""
+    results = {}
+    sents = sentences(words, lengths)
+    for beam_size in beam_sizes:
+        asptagger = ASPTagger(beam_size=beam_size)
+        asptagger.load(model)
+        seconds = best_of(repeat, lambda: list(asptagger.tag_many(sents)))
+        results[str(beam_size)] = {"seconds": seconds, "tokens_per_second": len(words) / seconds}
+    return results
+
+
+def bench_parallel(words, lengths, model, processes, repeat):
+    """Measure tagging throughput (including reading the input and
+    formatting the output) with different numbers of worker
+    processes.
+
+    """
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        logging.warning("Skipping the parallel benchmark: The 'fork' start method is not available.")
+        return None
+    asptagger = ASPTagger()
+    asptagger.load(model)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "corpus.txt")
+        with open(plain, mode="w", encoding="utf-8") as fh:
+            fh.write("".join("\n".join(sentence) + "\n\n" for sentence in sentences(words, lengths)))
+
+        def tag(n):
+            with open(plain, encoding="utf-8") as corpus:
+                if n > 1:
+                    tagged = cli.parallel_tagging(corpus, asptagger, n, context=context)
+                else:
+                    tagged = cli.single_core_tagging(corpus, asptagger)
+                for output in tagged:
+                    pass
+
+        for n in processes:
+            seconds = best_of(repeat, lambda: tag(n))
+            results[str(n)] = {"seconds": seconds, "tokens_per_second": len(words) / seconds}
+    base = results.get("1")
+    if base is not None:
+        for result in results.values():
+            result["speedup"] = base["seconds"] / result["seconds"]
+    return results
+
+
+def main():
+    args = arguments()
+    words, tags, lengths = read_corpus(args.corpus, args.tokens)
+    report = {"someweta": __version__,
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "cpu_count": multiprocessing.cpu_count(),
+              "corpus": {"file": args.corpus, "tokens": len(words), "sentences": len(lengths)},
+              "model": args.model,
+              "results": {}}
+    results = report["results"]
+    with tempfile.TemporaryDirectory() as tmp:
+        model = args.model
+        if model is None or "train" in args.only:
+            trained = os.path.join(tmp, "bench.model")
+            logging.info("Training for %d iterations on %d tokens" % (args.iterations, len(words)))
+            train = bench_train(words, tags, lengths, args.iterations, trained)
+            if "train" in args.only:
+                results["train"] = train
+            if model is None:
+                model = trained
+        if "load" in args.only:
+            logging.info("Loading the model")
+            results["load"] = bench_load(model, args.repeat)
+        if "read" in args.only:
+            logging.info("Reading the corpus")
+            results["read"] = bench_read(words, tags, lengths, args.repeat)
+        if "features" in args.only:
+            logging.info("Extracting static features")
+            results["features"] = bench_features(words, lengths, args.repeat)
+        if "beam" in args.only:
+            logging.info("Tagging with beam sizes %s" % ", ".join(str(b) for b in args.beam_sizes))
+            results["beam"] = bench_beam(words, lengths, model, args.beam_sizes, args.repeat)
+        if "parallel" in args.only:
+            logging.info("Tagging with %s worker processes" % ", ".join(str(p) for p in args.parallel))
+            results["parallel"] = bench_parallel(words, lengths, model, args.parallel, args.repeat)
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, mode="w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
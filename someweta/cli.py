@@ -1,23 +1,25 @@
 #!/usr/bin/env python3
 
 import argparse
-import io
+import collections
 import itertools
+import json
 import logging
 import math
 import multiprocessing
 import os
 import statistics
-import threading
+import sys
+import tempfile
 import time
 
+from someweta import profiling
 from someweta import utils
 from someweta import ASPTagger
 from someweta.version import __version__
 
-
-class Sentinel:
-    pass
+# buffer size for the output of --tag
+OUTPUT_BUFFER_SIZE = 2**20
 
 
 def arguments():
@@ -27,7 +29,7 @@ def arguments():
     group.add_argument("--train", type=os.path.abspath, help="Train the tagger on the input corpus and write the model to the specified file")
     group.add_argument("--tag", type=os.path.abspath, help="Tag the input corpus using the specified model")
     group.add_argument("--evaluate", type=os.path.abspath, help="Evaluate the performance of the specified model on the input corpus")
-    group.add_argument("--crossvalidate", action="store_true", help="Evaluate tagger performance via 10-fold cross-validation on the input corpus")
+    group.add_argument("--crossvalidate", action="store_true", help="Evaluate tagger performance via k-fold cross-validation on the input corpus (cf. --folds)")
     parser.add_argument("--brown", type=argparse.FileType("r"), help="""Brown clusters (paths output file
                         produced by wcluster (https://github.com/percyliang/brown-cluster)); optional and only for
                         training or cross-validation""")
@@ -36,13 +38,25 @@ def arguments():
     parser.add_argument("--mapping", type=os.path.abspath, help="Additional mapping to coarser tagset; optional and only for tagging, evaluating or cross-validation")
     parser.add_argument("--ignore-tag", type=str, help="Ignore this tag (useful for partial annotation); optional and only for training, evaluating or cross-validation")
     parser.add_argument("--prior", type=os.path.abspath, help="Prior weights, i.e. a model trained on another corpus; optional and only for training or cross-validation")
+    parser.add_argument("--hash-bits", type=int, metavar="N", help="Only for training or cross-validation: Use feature hashing with a weight matrix of 2^N rows instead of storing feature strings. This bounds memory usage at the cost of feature collisions (e.g. --hash-bits 22); optional")
+    parser.add_argument("--train-parallel", type=int, default=1, metavar="N", help="Only for training: Train with N worker processes by iterative parameter mixing (McDonald et al. 2010); requires the 'fork' start method; default: 1")
+    parser.add_argument("--stream", action="store_true", help="Only for training: Read the training corpus sentence by sentence in every iteration instead of loading it into memory. Use this for corpora that are too large for the available memory; the corpus has to be a regular file")
+    parser.add_argument("--shuffle-buffer", type=int, default=10000, metavar="N", help="Only for training with --stream: Shuffle the training sentences with a buffer of N sentences; default: 10000")
+    parser.add_argument("--feature-cache", type=os.path.abspath, metavar="DIR", help="Only for training or cross-validation: Cache the static features of the training corpus in DIR and reuse them in later runs on the same corpus with the same resources (lexicon, Brown clusters, word2vec vectors); optional")
     parser.add_argument("-i", "--iterations", type=int, default=10, help="Only for training or cross-validation: Number of iterations; default: 10")
     parser.add_argument("-b", "--beam-size", type=int, default=5, help="Size of the search beam; default: 5")
-    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="Run N worker processes (up to the number of CPUs) to speed up tagging.")
+    parser.add_argument("--decoder", choices=["greedy", "beam", "viterbi"], default="beam", help="Decoding algorithm for tagging and evaluation: greedy (fastest, slightly less accurate), beam (beam search with the beam size given by -b/--beam-size) or viterbi (exact second-order search, slow); training always uses beam search; default: beam")
+    parser.add_argument("--lazy", action="store_true", help="Only for tagging and evaluation: Do not build an in-memory index of the features of the model but look them up in the model file when they are first needed; loading is almost instantaneous, which is useful for tagging small inputs")
+    parser.add_argument("--cache-size", type=int, default=65536, metavar="N", help="Only for tagging, evaluation or cross-validation: Cache the static weights of up to N (word, position) pairs; 0 disables the cache; default: 65536")
+    parser.add_argument("--folds", type=int, default=10, metavar="K", help="Only for cross-validation: Number of folds; default: 10")
+    parser.add_argument("--parallel", type=int, metavar="N", help="Run N worker processes (up to the number of CPUs) to speed up tagging or cross-validation; default: 1 for tagging, the number of CPUs for cross-validation")
     parser.add_argument("-x", "--xml", action="store_true", help="The input is an XML file. We assume that each tag is on a separate line. Otherwise the format is the same as for regular files with respect to tag and sentence delimiters.")
     parser.add_argument("--sentence-tag", "--sentence_tag", type=str, help="Tag name for sentence boundaries (e.g. --sentence-tag s). Use this option, if input sentences are delimited by XML tags (e.g. <s>…</s>) instead of empty lines. Implies -x/--xml.")
     parser.add_argument("--use-nfkc", action="store_true", help="Convert input to NFKC before feeding it to the tagger. This only affects the internal representation of the data.")
-    parser.add_argument("--progress", action="store_true", help="Show progress when tagging a file.")
+    parser.add_argument("--progress", action="store_true", help="Show progress when tagging a file. If the input is a regular file, the total number of tokens and the remaining time are estimated from the number of bytes read so far.")
+    parser.add_argument("--progress-json", action="store_true", help="Write progress statistics (tokens, bytes, throughput, pending chunks, ETA) as JSON lines to STDERR about once per second; implies --progress")
+    parser.add_argument("--profile", action="store_true", help="Only for tagging and evaluation: Record the time spent in the stages of tagging (reading, feature extraction, scoring, decoding, writing, …), cache hit rates and average beam and agenda sizes and log a summary at the end. This slows down tagging")
+    parser.add_argument("--profile-json", type=os.path.abspath, metavar="FILE", help="Write the statistics of --profile as JSON to FILE; implies --profile")
     parser.add_argument("-v", "--version", action="version", version="SoMeWeTa %s" % __version__, help="Output version information and exit.")
     parser.add_argument("CORPUS", type=argparse.FileType("r", encoding="utf-8"),
                         help="""Input corpus (UTF-8-encoded). Path to a file or "-" for STDIN. Format for training,
@@ -52,140 +66,244 @@ def arguments():
                              line. Format for tagging: One token per
                              line; sentences delimited by an empty
                              line.""")
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.progress_json:
+        args.progress = True
+    if args.profile_json:
+        args.profile = True
+    if args.crossvalidate and args.folds < 2:
+        parser.error("--folds must be at least 2")
+    if args.stream and args.train and not args.CORPUS.seekable():
+        parser.error("--stream requires the training corpus to be a regular file")
+    if args.stream and args.train and args.feature_cache:
+        # the static features are extracted sentence by sentence
+        parser.error("--stream cannot be combined with --feature-cache")
+    if args.stream and args.train and args.train_parallel > 1:
+        # the shards of parallel training are held in memory
+        parser.error("--stream cannot be combined with --train-parallel")
+    return args
+
+
+# Data shared by all folds of a cross-validation: set in the parent
+# before the worker processes are forked and inherited by them, or,
+# without fork, sent to every worker once (cf. crossvalidate)
+crossvalidation = None
+
+
+def init_crossvalidation(tagger_args, prior, corpus, static_features):
+    """Store the data shared by all folds in the worker process."""
+    global crossvalidation
+    crossvalidation = (tagger_args, prior, corpus, static_features)
 
 
 def evaluate_fold(args):
-    i, beam_size, iterations, lexicon, mapping, brown_clusters, word_to_vec, ignore_tag, use_nfkc, words, tags, lengths, sentence_ranges, div, mod = args
-    asptagger = ASPTagger(beam_size, iterations, lexicon, mapping, brown_clusters, word_to_vec, ignore_tag, use_nfkc)
-    test_ranges = sentence_ranges[i * div + min(i, mod):(i + 1) * div + min(i + 1, mod)]
-    test_start = test_ranges[0][0]
-    test_end = test_ranges[-1][0] + test_ranges[-1][1]
-    test_lengths = lengths[i * div + min(i, mod):(i + 1) * div + min(i + 1, mod)]
-    train_lengths = lengths[:i * div + min(i, mod)] + lengths[(i + 1) * div + min(i + 1, mod):]
-    test_words = words[test_start:test_end]
-    test_tags = tags[test_start:test_end]
-    train_words = words[:test_start] + words[test_end:]
-    train_tags = tags[:test_start] + tags[test_end:]
-    asptagger.train(train_words, train_tags, train_lengths)
-    accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov = asptagger.evaluate(test_words, test_tags, test_lengths)
+    """Train and evaluate the tagger on fold `i` of `folds`. The folds
+    consist of consecutive sentences.
+
+    """
+    i, folds = args
+    tagger_args, prior, corpus, static_features = crossvalidation
+    asptagger = ASPTagger(*tagger_args)
+    if prior is not None:
+        asptagger.load_prior_model(prior)
+    n_sentences, n_tokens = len(corpus.lengths), len(corpus.word_ids)
+    div, mod = divmod(n_sentences, folds)
+    first, last = i * div + min(i, mod), (i + 1) * div + min(i + 1, mod)
+    test_start, test_end = int(corpus.offsets[first]), int(corpus.offsets[last])
+    test_lengths = corpus.lengths[first:last].tolist()
+    train_lengths = corpus.lengths[:first].tolist() + corpus.lengths[last:].tolist()
+    train_words = corpus.words(0, test_start) + corpus.words(test_end, n_tokens)
+    train_tags = corpus.tags(0, test_start) + corpus.tags(test_end, n_tokens)
+    if static_features is not None:
+        static_features = static_features.select([(0, test_start), (test_end, n_tokens)])
+    asptagger.train(train_words, train_tags, train_lengths, static_features)
+    del train_words, train_tags, static_features
+    accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov = asptagger.evaluate(corpus.words(test_start, test_end), corpus.tags(test_start, test_end), test_lengths)
     logging.info("Accuracy: %.2f%%" % (accuracy * 100,))
     if coarse_accuracy is not None:
         logging.info("Accuracy on mapped tagset: %.2f%%" % (coarse_accuracy * 100,))
     return accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov
 
 
-def fill_input_queue(input_queue, corpus, processes, sentinel, xml=False, sentence_tag=None):
-    """"""
-    corpus_size = 0
+def crossvalidate(tagger_args, prior, corpus, folds, processes, static_features=None):
+    """Perform a `folds`-fold cross-validation on an EncodedCorpus with
+    `processes` worker processes. The corpus is saved to a temporary
+    directory and memory-mapped, i.e. the workers share its arrays
+    read-only. Forked workers inherit corpus, static features and
+    tagger arguments; otherwise, they are sent to every worker once,
+    the corpus and the static features as references to their
+    directories (cf. EncodedCorpus and StaticFeatures). Return the
+    results of the folds.
+
+    """
+    global crossvalidation
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus.save(tmpdir)
+        corpus = utils.EncodedCorpus.load(tmpdir)
+        jobs = [(i, folds) for i in range(folds)]
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+            with context.Pool(processes=processes, initializer=init_crossvalidation, initargs=(tagger_args, prior, corpus, static_features)) as pool:
+                return pool.map(evaluate_fold, jobs, chunksize=1)
+        crossvalidation = (tagger_args, prior, corpus, static_features)
+        try:
+            with context.Pool(processes=processes) as pool:
+                return pool.map(evaluate_fold, jobs, chunksize=1)
+        finally:
+            crossvalidation = None
+
+
+def log_cache_info(asptagger):
+    hits, misses, maxsize, currsize = asptagger.cache_info()
+    if hits + misses > 0:
+        logging.info("Static feature cache: %d hits, %d misses (%.2f%% hit rate), %d entries" % (hits, misses, hits / (hits + misses) * 100, currsize))
+
+
+def log_profile(asptagger, filename=None):
+    """Log a summary of the statistics of the profiler of `asptagger`
+    and write them as JSON to `filename` (if given).
+
+    """
+    report = asptagger.profiler.report(asptagger)
+    for line in profiling.summary(report):
+        logging.info(line)
+    if filename is not None:
+        with open(filename, mode="w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+            fh.write("\n")
+
+
+def read_chunks(corpus, chunk_size, xml=False, sentence_tag=None):
+    """Read the input corpus in chunks of up to `chunk_size`
+    sentences. Unless the input is XML, the sentences are strings
+    (cf. utils.get_raw_sentences) that are split into tokens by
+    tag_chunks, i.e. in the worker processes when tagging in
+    parallel.
+
+    """
     if xml:
-        for i, (words, length, lines, word_indexes) in enumerate(utils.iter_xml(corpus, tagged=False, sentence_tag=sentence_tag)):
-            corpus_size += length
-            input_queue.put((i, words, lines, word_indexes))
+        sentences = ((words, lines, word_indexes) for words, length, lines, word_indexes in utils.iter_xml(corpus, tagged=False, sentence_tag=sentence_tag))
     else:
-        for i, (words, length) in enumerate(utils.iter_corpus(corpus, tagged=False)):
-            corpus_size += length
-            input_queue.put((i, words))
-    for proc in range(processes):
-        input_queue.put(sentinel)
-    input_queue.put(corpus_size)
+        sentences = utils.get_raw_sentences(corpus)
+    while True:
+        chunk = list(itertools.islice(sentences, chunk_size))
+        if not chunk:
+            break
+        yield chunk
 
 
-def process_input_queue(func, input_queue, output_queue, sentinel, xml=False):
+def init_worker(asptagger):
     """"""
-    while True:
-        data = input_queue.get()
-        if isinstance(data, Sentinel):
-            break
+    global worker_tagger
+    worker_tagger = asptagger
+    if asptagger.profiler is not None:
+        # the statistics of the parent are not ours
+        asptagger.profiler.reset(asptagger)
+
+
+def tag_chunk(chunk, xml=False, sentence_tag=None, encoding="utf-8", errors="strict"):
+    """Tag a chunk of sentences in a worker process. The sentences of
+    a chunk are decoded as a batch and the output is returned as
+    bytes, i.e. the main process only has to write it. If the tagger
+    is profiled, the statistics of the worker are returned as well and
+    merged into the profiler of the main process.
+
+    """
+    data, n_tokens = next(tag_chunks([chunk], worker_tagger, xml, sentence_tag, encoding, errors))
+    statistics = None
+    if worker_tagger.profiler is not None:
+        statistics = worker_tagger.profiler.take(worker_tagger)
+    return data, n_tokens, statistics
+
+
+def format_chunk(tagged, xml=False, sentence_tag=None):
+    """Return the output for a list of tagged sentences (for XML input:
+    of (tagged sentence, lines, word indexes) triples) as a single
+    string.
+
+    """
+    if xml:
+        end = "\n" if sentence_tag is not None else "\n\n"
+        return "".join(["\n".join(utils.add_pos_to_xml(sentence, lines, word_indexes)) + end for sentence, lines, word_indexes in tagged])
+    return "".join(["\n".join(["\t".join(t) for t in sentence]) + "\n\n" for sentence in tagged])
+
+
+def tag_chunks(chunks, asptagger, xml=False, sentence_tag=None, encoding="utf-8", errors="strict"):
+    """Tag the chunks of sentences produced by read_chunks and yield the
+    encoded output of every chunk and its number of tokens. The
+    sentences of a chunk are decoded as a batch (cf.
+    ASPTagger.tag_many).
+
+    """
+    profiler = asptagger.profiler
+    for chunk in chunks:
         if xml:
-            i, words, lines, word_indexes = data
-            result = func(words)
-            output_queue.put((i, result, lines, word_indexes))
+            tagged = asptagger.tag_many([sentence for sentence, lines, word_indexes in chunk], len(chunk))
+            tagged = [(sentence, lines, word_indexes) for sentence, (_, lines, word_indexes) in zip(tagged, chunk)]
+            n_tokens = sum(len(sentence) for sentence, lines, word_indexes in tagged)
         else:
-            i, words = data
-            result = func(words)
-            output_queue.put((i, result))
-    output_queue.put(sentinel)
+            with profiling.stage(profiler, "reading"):
+                sentences = [utils.sentence_lines(sentence) for sentence in chunk]
+            tagged = list(asptagger.tag_many(sentences, len(chunk)))
+            n_tokens = sum(len(sentence) for sentence in tagged)
+        with profiling.stage(profiler, "formatting"):
+            data = format_chunk(tagged, xml, sentence_tag).encode(encoding, errors)
+        yield data, n_tokens
 
 
-def parallel_tagging(corpus, asptagger, parallel, xml=False, sentence_tag=None):
-    """"""
-    sentinel = Sentinel()
+def parallel_tagging(corpus, asptagger, parallel, xml=False, sentence_tag=None, chunk_size=64, context=multiprocessing, encoding="utf-8", errors="strict"):
+    """Tag the corpus with a pool of worker processes. The workers
+    receive the tagger once, when the pool is started; a tagger with
+    a memory-mapped model is sent as a reference to the model file
+    and all workers map the same file (cf. ASPTagger.load). The input
+    is distributed in chunks of `chunk_size` sentences and at most a
+    few chunks per worker are pending at any time. `context` is the
+    multiprocessing context used for starting the workers. Yield the
+    encoded output of every chunk, its number of tokens, the number
+    of bytes of input read up to the chunk (cf.
+    utils.input_position) and the number of pending chunks. If the
+    tagger is profiled, the statistics of the workers are merged into
+    its profiler.
+
+    """
     processes = min(parallel, multiprocessing.cpu_count())
-    input_queue = multiprocessing.Queue(maxsize=processes * 100)
-    output_queue = multiprocessing.Queue(maxsize=processes * 100)
-    producer = threading.Thread(target=fill_input_queue, args=(input_queue, corpus, processes, sentinel, xml, sentence_tag))
-    with multiprocessing.Pool(processes=processes, initializer=process_input_queue, initargs=(asptagger.tag_sentence, input_queue, output_queue, sentinel, xml)):
-        producer.start()
-        observed_sentinels = 0
-        current = 0
-        cached_results = {}
-        while True:
-            data = output_queue.get()
-            if isinstance(data, Sentinel):
-                observed_sentinels += 1
-                if observed_sentinels == processes:
-                    break
-                else:
-                    continue
-            i = data[0]
-            cached_results[i] = data[1:]
-            while current in cached_results:
-                yield cached_results[current]
-                del cached_results[current]
-                current += 1
-        corpus_size = input_queue.get()
-        producer.join()
-        # return corpus_size
-
-
-def single_core_tagging(corpus, asptagger, xml=False, sentence_tag=None):
-    """"""
-    if xml:
-        for words, length, lines, word_indexes in utils.iter_xml(corpus, tagged=False, sentence_tag=sentence_tag):
-            sentence = asptagger.tag_sentence(words)
-            yield sentence, lines, word_indexes
-    else:
-        for words, length in utils.iter_corpus(corpus, tagged=False):
-            sentence = asptagger.tag_sentence(words)
-            yield (sentence,)
+    profiler = asptagger.profiler
 
+    def get(result):
+        data, n_tokens, statistics = result.get()
+        if statistics is not None:
+            profiler.merge(statistics)
+        return data, n_tokens
+
+    with context.Pool(processes=processes, initializer=init_worker, initargs=(asptagger,)) as pool:
+        pending = collections.deque()
+        for chunk in profiling.iterate(profiler, "reading", read_chunks(corpus, chunk_size, xml, sentence_tag)):
+            pending.append((utils.input_position(corpus), pool.apply_async(tag_chunk, (chunk, xml, sentence_tag, encoding, errors))))
+            if len(pending) >= processes * 4:
+                position, result = pending.popleft()
+                yield get(result) + (position, len(pending))
+        while pending:
+            position, result = pending.popleft()
+            yield get(result) + (position, len(pending))
 
-def get_number_of_tokens(queue, corpus, xml, sentence_tag):
-    """"""
-    n = 0
-    try:
-        corpus.seek(0)
-    except io.UnsupportedOperation:
-        logging.info("Input stream is not seekable, cannot determine ETA.")
-        logging.info("If you want SoMeWeTa to estimate the remaining time, please provide the input as a regular file.")
-        queue.put(None)
-        return
-    except ValueError:
-        logging.info("Input stream is not seekable, cannot determine ETA.")
-        logging.info("If you want SoMeWeTa to estimate the remaining time, please provide the input as a regular file.")
-        queue.put(None)
-        return
-    if xml:
-        for words, length, lines, word_indexes in utils.iter_xml(corpus, tagged=False, sentence_tag=sentence_tag):
-            n += length
-    else:
-        for words, length in utils.iter_corpus(corpus, tagged=False):
-            n += length
-    corpus.seek(0)
-    queue.put(n)
+
+def single_core_tagging(corpus, asptagger, xml=False, sentence_tag=None, chunk_size=64, encoding="utf-8", errors="strict"):
+    """Tag the corpus in the main process (cf. parallel_tagging)."""
+    for chunk in profiling.iterate(asptagger.profiler, "reading", read_chunks(corpus, chunk_size, xml, sentence_tag)):
+        position = utils.input_position(corpus)
+        for data, length in tag_chunks([chunk], asptagger, xml, sentence_tag, encoding, errors):
+            yield data, length, position, 0
 
 
 def main():
     args = arguments()
     lexicon, mapping, brown_clusters, word_to_vec = None, None, None, None
-    if args.progress:
-        if args.tag:
-            n_queue = multiprocessing.Queue()
-            p = multiprocessing.Process(target=get_number_of_tokens, args=(n_queue, args.CORPUS, args.xml, args.sentence_tag))
-            p.start()
-        else:
-            logging.warning("Currently, the --progress option is only available for tagging, i.e. in combination with --tag.")
+    if args.progress and not args.tag:
+        logging.warning("Currently, the --progress option is only available for tagging, i.e. in combination with --tag.")
+    if args.profile and not (args.tag or args.evaluate):
+        logging.warning("The --profile option is only available for tagging and evaluation, i.e. in combination with --tag or --evaluate.")
     if args.mapping and (args.tag or args.evaluate or args.crossvalidate):
         mapping = utils.read_mapping(args.mapping)
     if args.lexicon and (args.train or args.crossvalidate):
@@ -196,57 +314,79 @@ def main():
         word_to_vec = utils.read_word2vec_vectors(args.w2v)
     if args.sentence_tag is not None:
         args.xml = True
-    asptagger = ASPTagger(args.beam_size, args.iterations, lexicon, mapping, brown_clusters, word_to_vec, args.ignore_tag, args.use_nfkc)
+    asptagger = ASPTagger(args.beam_size, args.iterations, lexicon, mapping, brown_clusters, word_to_vec, args.ignore_tag, args.use_nfkc, args.hash_bits, args.decoder, args.cache_size, args.train_parallel)
     if args.prior and (args.train or args.crossvalidate):
         asptagger.load_prior_model(args.prior)
     if args.train:
-        if args.xml:
-            words, tags, lengths = utils.read_tagged_xml(args.CORPUS, args.sentence_tag)
+        if args.stream:
+            def sentences():
+                args.CORPUS.seek(0)
+                if args.xml:
+                    return utils.iter_xml(args.CORPUS, tagged=True, sentence_tag=args.sentence_tag)
+                return utils.iter_corpus(args.CORPUS, tagged=True)
+            asptagger.train_stream(sentences, args.shuffle_buffer)
         else:
-            words, tags, lengths = utils.read_corpus(args.CORPUS, tagged=True)
-        asptagger.train(words, tags, lengths)
+            if args.xml:
+                words, tags, lengths = utils.read_tagged_xml(args.CORPUS, args.sentence_tag)
+            else:
+                words, tags, lengths = utils.read_corpus(args.CORPUS, tagged=True)
+            static_features = None
+            if args.feature_cache is not None:
+                static_features = asptagger.get_static_features(words, lengths, args.feature_cache)
+            asptagger.train(words, tags, lengths, static_features)
         asptagger.save(args.train)
     elif args.tag:
         prog = None
-        asptagger.load(args.tag)
+        asptagger.load(args.tag, args.lazy)
+        if args.profile:
+            profiling.Profiler().instrument(asptagger)
         if args.progress:
-            n = n_queue.get()
-            p.join()
-            prog = utils.Progress(length=n, rate=1000)
+            size = utils.input_size(args.CORPUS)
+            if size is None:
+                logging.info("Input is not a regular file, cannot determine ETA.")
+            prog = utils.Progress(rate=1000, size=size, json_lines=args.progress_json)
         t0 = time.perf_counter()
         corpus_size = 0
-        if args.parallel > 1:
+        if args.parallel is not None and args.parallel > 1:
             try:
-                multiprocessing.set_start_method("fork")
+                context = multiprocessing.get_context("fork")
             except ValueError:
-                logging.warning(f"Multiprocessing start method 'fork' is not available on your operating system. Using method '{multiprocessing.get_start_method()}' instead. Note that this can lead to a massive overhead when creating the worker processes and to an increased memory usage.")
-            tagged = parallel_tagging(args.CORPUS, asptagger, args.parallel, xml=args.xml, sentence_tag=args.sentence_tag)
+                context = multiprocessing.get_context()
+                logging.info(f"Multiprocessing start method 'fork' is not available on your operating system. Using method '{context.get_start_method()}' instead.")
+                if asptagger.model_file is None:
+                    logging.warning("The model is in the legacy format and will be copied into every worker process. Convert it with somewe-convert-model to share it between the processes.")
+            tagged = parallel_tagging(args.CORPUS, asptagger, args.parallel, xml=args.xml, sentence_tag=args.sentence_tag, context=context, encoding=sys.stdout.encoding, errors=sys.stdout.errors)
         else:
-            tagged = single_core_tagging(args.CORPUS, asptagger, xml=args.xml, sentence_tag=args.sentence_tag)
-        for output in tagged:
-            if args.xml:
-                sentence, lines, word_indexes = output
-                print("\n".join(utils.add_pos_to_xml(sentence, lines, word_indexes)))
-                if args.sentence_tag is None:
-                    print()
-            else:
-                sentence, = output
-                print("\n".join(["\t".join(t) for t in sentence]), "\n", sep="")
-            length = len(sentence)
-            corpus_size += length
-            if args.progress:
-                prog.update(length)
+            tagged = single_core_tagging(args.CORPUS, asptagger, xml=args.xml, sentence_tag=args.sentence_tag, encoding=sys.stdout.encoding, errors=sys.stdout.errors)
+        # the chunks are written as they are, bypassing sys.stdout
+        sys.stdout.flush()
+        with open(sys.stdout.fileno(), mode="wb", buffering=OUTPUT_BUFFER_SIZE, closefd=False) as output:
+            for data, length, position, pending in tagged:
+                with profiling.stage(asptagger.profiler, "writing"):
+                    output.write(data)
+                corpus_size += length
+                if args.progress:
+                    prog.update(length, position, pending)
         if args.progress:
             prog.finalize()
         t1 = time.perf_counter()
         logging.info("Tagged %d tokens in %s (%d tokens/s)" % (corpus_size, utils.int2str(t1 - t0), corpus_size / (t1 - t0)))
+        if args.parallel is None or args.parallel <= 1:
+            log_cache_info(asptagger)
+        if args.profile:
+            log_profile(asptagger, args.profile_json)
     elif args.evaluate:
-        asptagger.load(args.evaluate)
+        asptagger.load(args.evaluate, args.lazy)
+        if args.profile:
+            profiling.Profiler().instrument(asptagger)
         if args.xml:
             words, tags, lengths = utils.read_tagged_xml(args.CORPUS, args.sentence_tag)
         else:
             words, tags, lengths = utils.read_corpus(args.CORPUS, tagged=True)
         accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov = asptagger.evaluate(words, tags, lengths)
+        log_cache_info(asptagger)
+        if args.profile:
+            log_profile(asptagger, args.profile_json)
         print("Accuracy: %.2f%%; IV: %.2f%%; OOV: %.2f%%" % (accuracy * 100, accuracy_iv * 100, accuracy_oov * 100))
         if coarse_accuracy is not None:
             print("Accuracy on mapped tagset: %.2f%%; IV: %.2f%%; OOV: %.2f%%" % (coarse_accuracy * 100, coarse_accuracy_iv * 100, coarse_accuracy_oov * 100))
@@ -255,20 +395,27 @@ def main():
             words, tags, lengths = utils.read_tagged_xml(args.CORPUS, args.sentence_tag)
         else:
             words, tags, lengths = utils.read_corpus(args.CORPUS, tagged=True)
-        sentence_ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
-        div, mod = divmod(len(sentence_ranges), 10)
-        with multiprocessing.Pool() as pool:
-            accs = pool.map(evaluate_fold, zip(range(10), itertools.repeat(args.beam_size), itertools.repeat(args.iterations), itertools.repeat(lexicon), itertools.repeat(mapping), itertools.repeat(brown_clusters), itertools.repeat(word_to_vec), itertools.repeat(args.ignore_tag), itertools.repeat(args.use_nfkc), itertools.repeat(words), itertools.repeat(tags), itertools.repeat(lengths), itertools.repeat(sentence_ranges), itertools.repeat(div), itertools.repeat(mod)))
+        if args.folds > len(lengths):
+            raise ValueError("Cannot perform a %d-fold cross-validation on %d sentences" % (args.folds, len(lengths)))
+        static_features = None
+        if args.feature_cache is not None:
+            static_features = asptagger.get_static_features(words, lengths, args.feature_cache)
+        corpus = utils.EncodedCorpus.encode(words, tags, lengths)
+        # the workers only need the encoded corpus
+        del words, tags, lengths
+        tagger_args = (args.beam_size, args.iterations, lexicon, mapping, brown_clusters, word_to_vec, args.ignore_tag, args.use_nfkc, args.hash_bits, args.decoder, args.cache_size)
+        processes = min(args.parallel or multiprocessing.cpu_count(), multiprocessing.cpu_count(), args.folds)
+        accs = crossvalidate(tagger_args, args.prior, corpus, args.folds, processes, static_features)
         accuracies, accuracies_iv, accuracies_oov, coarse_accuracies, coarse_accuracies_iv, coarse_accuracies_oov = zip(*accs)
         mean_accuracy = statistics.mean(accuracies)
-        # 2.26 is the approximate value of the 97.5 percentile point
-        # of the t distribution with 9 degrees of freedom. We use the
-        # t distribution instead of the standard normal distribution
-        # (= 1.96) because the population standard deviation is
-        # unknown and because we have a small sample size (10).
-        confidence = 2.26 * statistics.stdev(accuracies) / math.sqrt(10)
+        # We use the t distribution instead of the standard normal
+        # distribution (= 1.96) because the population standard
+        # deviation is unknown and because we have a small sample
+        # size (the number of folds).
+        t = utils.t_975(args.folds - 1)
+        confidence = t * statistics.stdev(accuracies) / math.sqrt(args.folds)
         print("Mean accuracy and 95%% confidence interval: %.2f%% ±%.2f" % (mean_accuracy * 100, confidence * 100))
         if coarse_accuracies[0] is not None:
             coarse_mean_accuracy = statistics.mean(coarse_accuracies)
-            coarse_confidence = 2.26 * statistics.stdev(coarse_accuracies) / math.sqrt(10)
+            coarse_confidence = t * statistics.stdev(coarse_accuracies) / math.sqrt(args.folds)
             print("Mean accuracy and 95%% confidence interval on mapped tagset: %.2f%% ±%.2f" % (coarse_mean_accuracy * 100, coarse_confidence * 100))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from someweta import ASPTagger
+from someweta import model_io
+from someweta import utils
+from someweta.version import __version__
+
+
+def arguments():
+    """Process command line arguments."""
+    parser = argparse.ArgumentParser(description="Convert a SoMeWeTa model to the binary, memory-mappable model format, optionally pruning and quantising its weights")
+    parser.add_argument("--dtype", choices=model_io.WEIGHT_DTYPES, default="float64", help="Data type of the stored weights; float32 halves the size of the weight matrix at the cost of a small loss in precision; int16 and int8 quantise the weights of every feature with a scale factor of its own; default: float64")
+    parser.add_argument("--prune", type=float, default=0.0, metavar="THRESHOLD", help="Remove features whose largest absolute weight is below THRESHOLD; default: 0 (no pruning)")
+    parser.add_argument("--min-nonzero", type=int, default=1, metavar="N", help="Remove features with fewer than N non-zero weights, i.e. features that have been updated rarely during training (every update changes two weights); default: 1")
+    parser.add_argument("--evaluate", type=argparse.FileType("r", encoding="utf-8"), metavar="CORPUS", help="Compare size, loading time, tagging speed and accuracy of input and output model on a tagged corpus (cf. somewe-tagger --evaluate)")
+    parser.add_argument("--report", type=os.path.abspath, metavar="FILE", help="Only with --evaluate: Write the comparison as JSON to FILE")
+    parser.add_argument("-v", "--version", action="version", version="SoMeWeTa %s" % __version__, help="Output version information and exit.")
+    parser.add_argument("MODEL", type=os.path.abspath, help="Input model (legacy gzipped JSON format or binary format)")
+    parser.add_argument("OUTPUT", type=os.path.abspath, help="Output model (binary format)")
+    args = parser.parse_args()
+    if args.report is not None and args.evaluate is None:
+        parser.error("--report requires --evaluate")
+    return args
+
+
+def convert(model, output, dtype=np.float64, threshold=0.0, min_nonzero=1):
+    """Convert `model` to the binary format and write it to `output`,
+    pruning and quantising the weights (cf. ASPTagger.save).
+
+    """
+    asptagger = ASPTagger()
+    asptagger.load(model)
+    asptagger.save(output, dtype=dtype, threshold=threshold, min_nonzero=min_nonzero)
+
+
+def evaluate(model, words, tags, lengths):
+    """Load `model`, evaluate it on a tagged corpus and return size,
+    number of features, loading time, throughput and accuracy.
+
+    """
+    t0 = time.perf_counter()
+    asptagger = ASPTagger()
+    asptagger.load(model)
+    t1 = time.perf_counter()
+    accuracy, accuracy_iv, accuracy_oov, *_ = asptagger.evaluate(words, tags, lengths)
+    t2 = time.perf_counter()
+    return {"model": model,
+            "size_mb": os.path.getsize(model) / 2**20,
+            "features": len(asptagger.feature_index),
+            "dtype": asptagger.weights.dtype.name,
+            "load_seconds": t1 - t0,
+            "tokens_per_second": len(words) / (t2 - t1),
+            "accuracy": accuracy,
+            "accuracy_iv": accuracy_iv,
+            "accuracy_oov": accuracy_oov}
+
+
+def main():
+    args = arguments()
+    if model_io.is_binary_model(args.MODEL):
+        logging.info("%s already is in the binary format" % args.MODEL)
+    t0 = time.perf_counter()
+    convert(args.MODEL, args.OUTPUT, np.dtype(args.dtype), args.prune, args.min_nonzero)
+    t1 = time.perf_counter()
+    logging.info("Converted %s to %s in %s (%.1f MB → %.1f MB)" % (args.MODEL, args.OUTPUT, utils.int2str(t1 - t0), os.path.getsize(args.MODEL) / 2**20, os.path.getsize(args.OUTPUT) / 2**20))
+    if args.evaluate is not None:
+        words, tags, lengths = utils.read_corpus(args.evaluate, tagged=True)
+        results = [evaluate(model, words, tags, lengths) for model in (args.MODEL, args.OUTPUT)]
+        print("%-8s %10s %10s %8s %10s %10s %9s" % ("model", "size (MB)", "features", "dtype", "load (s)", "tokens/s", "accuracy"))
+        for name, result in zip(("input", "output"), results):
+            print("%-8s %10.1f %10d %8s %10.3f %10d %8.2f%%" % (name, result["size_mb"], result["features"], result["dtype"], result["load_seconds"], result["tokens_per_second"], result["accuracy"] * 100))
+        if args.report is not None:
+            with open(args.report, mode="w", encoding="utf-8") as fh:
+                json.dump({"input": results[0], "output": results[1]}, fh, indent=2)
+                fh.write("\n")
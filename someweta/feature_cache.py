@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+# Increase whenever the static features produced for a word change, so
+# that cached features of older versions are not used.
+FEATURE_VERSION = 1
+
+
+class StaticFeatures:
+    """The static features of the tokens of a corpus as integer ids into
+    a table of feature strings: The features of token i are
+    features[ids[offsets[i]:offsets[i + 1]]].
+
+    Features that have been loaded from a cache directory are pickled
+    as a reference to the directory.
+
+    """
+    def __init__(self, features, ids, offsets, directory=None):
+        self.features = features
+        self.ids = ids
+        self.offsets = offsets
+        self.directory = directory
+
+    def __getstate__(self):
+        if self.directory is not None:
+            return {"directory": self.directory}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if "features" not in state:
+            state = StaticFeatures.load(state["directory"]).__dict__
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_lists(cls, feature_lists):
+        """Convert a list with a list of feature strings for every token."""
+        table = {}
+        ids = np.fromiter((table.setdefault(feat, len(table)) for features in feature_lists for feat in features), dtype=np.int64)
+        offsets = np.zeros(len(feature_lists) + 1, dtype=np.int64)
+        np.cumsum([len(features) for features in feature_lists], out=offsets[1:])
+        return cls(list(table), ids, offsets)
+
+    def select(self, token_ranges):
+        """Return the static features of the tokens in the given (start,
+        end) ranges.
+
+        """
+        ids = [self.ids[self.offsets[start]:self.offsets[end]] for start, end in token_ranges]
+        lengths = [np.diff(self.offsets[start:end + 1]) for start, end in token_ranges]
+        offsets = np.zeros(sum(len(l) for l in lengths) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(lengths), out=offsets[1:])
+        return StaticFeatures(self.features, np.concatenate(ids), offsets)
+
+    def to_id_arrays(self, feature_index):
+        """Return an array of feature ids of `feature_index` for every
+        token. New features are added to the index.
+
+        """
+        used = np.unique(self.ids)
+        mapping = np.zeros(len(self.features), dtype=np.intp)
+        mapping[used] = feature_index.intern([self.features[i] for i in used])
+        ids = mapping[self.ids]
+        return np.split(ids, self.offsets[1:-1])
+
+    def save(self, directory):
+        """Save the features to `directory`. The directory is written
+        under a temporary name and renamed at the end, i.e. concurrent
+        readers never see an incomplete cache entry.
+
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        with open(os.path.join(tmp, "features.txt"), "w", encoding="utf-8") as fh:
+            fh.write("\n".join(self.features))
+        np.save(os.path.join(tmp, "ids.npy"), self.ids)
+        np.save(os.path.join(tmp, "offsets.npy"), self.offsets)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # another process has created the same entry in the meantime
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
+            os.rmdir(tmp)
+
+    @classmethod
+    def load(cls, directory):
+        """Load features saved with save(). The id arrays are
+        memory-mapped.
+
+        """
+        with open(os.path.join(directory, "features.txt"), encoding="utf-8") as fh:
+            table = fh.read()
+        features = table.split("\n") if table != "" else []
+        ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        return cls(features, ids, offsets, directory)
+
+
+def corpus_hash(words, lengths):
+    """Return a hash of the words and sentence lengths of a corpus."""
+    h = hashlib.sha1()
+    h.update(np.array(lengths, dtype=np.int64).tobytes())
+    for word in words:
+        h.update(word.encode())
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def resource_hash(use_nfkc, lexicon, brown_clusters, word_to_vec):
+    """Return a hash of the resources that the static features depend
+    on.
+
+    """
+    if lexicon is not None:
+        lexicon = {word: sorted(values) for word, values in lexicon.items()}
+    # resources of a loaded model are ResourceIndex objects
+    if brown_clusters is not None:
+        brown_clusters = dict(brown_clusters.items())
+    if word_to_vec is not None:
+        word_to_vec = dict(word_to_vec.items())
+    resources = [FEATURE_VERSION, use_nfkc, lexicon, brown_clusters, word_to_vec]
+    return hashlib.sha1(json.dumps(resources, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def cached(cache_dir, key, extract):
+    """Return the static features stored under `key` in `cache_dir`.
+    If there are none, call `extract` and store its result.
+
+    """
+    directory = os.path.join(cache_dir, key)
+    if os.path.isdir(directory):
+        logging.info("Loading static features from %s" % directory)
+        return StaticFeatures.load(directory)
+    static_features = extract()
+    logging.info("Saving static features to %s" % directory)
+    static_features.save(directory)
+    return StaticFeatures.load(directory)
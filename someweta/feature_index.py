@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import zlib
+
+
+class FeatureIndex:
+    """Map feature strings to consecutive integer ids, i.e. to rows of a
+    weight matrix.
+
+    """
+    hash_bits = None
+
+    def __init__(self, features=()):
+        self.features = list(features)
+        self.ids = dict(zip(self.features, range(len(self.features))))
+
+    def __len__(self):
+        return len(self.features)
+
+    def __contains__(self, feature):
+        return feature in self.ids
+
+    def lookup(self, features):
+        """Return the ids of all known features and skip unknown ones."""
+        ids = self.ids
+        return [ids[feat] for feat in features if feat in ids]
+
+    def intern(self, features):
+        """Return the ids of all features and assign new ids to unknown
+        ones.
+
+        """
+        ids = self.ids
+        result = []
+        for feat in features:
+            idx = ids.get(feat)
+            if idx is None:
+                idx = len(self.features)
+                ids[feat] = idx
+                self.features.append(feat)
+            result.append(idx)
+        return result
+
+
+class HashedFeatureIndex:
+    """Map feature strings to rows of a weight matrix with 2 **
+    `hash_bits` rows via feature hashing. No feature strings are
+    stored, i.e. memory usage is independent of the number of
+    features; different features may share a row.
+
+    """
+    def __init__(self, hash_bits):
+        if not 1 <= hash_bits <= 32:
+            raise ValueError("hash_bits must be between 1 and 32")
+        self.hash_bits = hash_bits
+        self.mask = (1 << hash_bits) - 1
+        self.features = None
+
+    def __len__(self):
+        return self.mask + 1
+
+    def __contains__(self, feature):
+        return True
+
+    def lookup(self, features):
+        """Return the row indexes of the features."""
+        mask = self.mask
+        # crc32 is stable across processes and Python versions, unlike hash()
+        return [zlib.crc32(feat.encode()) & mask for feat in features]
+
+    intern = lookup
+
+
+class MappedFeatureIndex:
+    """Map feature strings to rows of a weight matrix via a StringTable
+    of the features of a model, e.g. one that is memory-mapped from
+    the model file. Feature strings are only read when they are looked
+    up; the ids of features that have been looked up are cached. The
+    index is read-only.
+
+    """
+    hash_bits = None
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, feature):
+        return self.lookup([feature]) != []
+
+    @property
+    def features(self):
+        return self.table.strings()
+
+    def lookup(self, features):
+        """Return the ids of all known features and skip unknown ones."""
+        ids = self.ids
+        for feat in features:
+            if feat not in ids:
+                ids[feat] = self.table.find(feat)
+        return [idx for idx in [ids[feat] for feat in features] if idx >= 0]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import base64
+import gzip
+import json
+import struct
+import sys
+
+import numpy as np
+
+from someweta.resource_index import ResourceIndex, StringTable
+
+# Binary model format
+#
+# offset 0:  MAGIC (8 bytes)
+# offset 8:  length of the JSON header in bytes (little-endian uint64)
+# offset 16: JSON header (UTF-8)
+# followed by the data section, starting at the next multiple of
+# ALIGNMENT. The header records the position (relative to the start
+# of the data section) and size of each block in the data section:
+#
+#   - features:   feature strings, UTF-8, separated by newlines,
+#                 together with the other two arrays of a StringTable
+#                 for looking up feature strings without reading them
+#   - weights:    C-ordered weight matrix with one row per feature
+#                 (float64, float32 or quantised int16 or int8)
+#   - scales:     only for quantised weights: float32 scale factor of
+#                 every row, i.e. the weights of row i are
+#                 weights[i] * scales[i] (cf. quantize)
+#   - vocabulary: the arrays of a StringTable of the training
+#                 vocabulary
+#   - resources:  the arrays of the resource indexes (lexicon, Brown
+#                 clusters, word2vec vectors; cf. ResourceIndex)
+#
+# Since all blocks are stored as raw bytes at aligned offsets, they can
+# be memory-mapped: loading a model does not decode any weights or
+# resources and several processes that load the same model share the
+# same pages.
+MAGIC = b"SMWTBIN1"
+ALIGNMENT = 64
+FORMAT_VERSION = 1
+# data types of the weight matrix; the integer types are quantised
+WEIGHT_DTYPES = ("float64", "float32", "int16", "int8")
+
+
+def is_binary_model(filename):
+    """Return True if `filename` is a model in the binary format."""
+    with open(filename, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def quantize(weights, dtype):
+    """Quantise the rows of the weight matrix `weights` to the integer
+    type `dtype` (int8 or int16). Every row is scaled to the range of
+    `dtype` by its largest absolute weight. Return the quantised
+    matrix and the scale factor of every row (cf. dequantize).
+
+    """
+    dtype = np.dtype(dtype)
+    limit = np.iinfo(dtype).max
+    scales = (np.abs(weights).max(axis=1, initial=0) / limit).astype(np.float32)
+    # rows that are all zero keep a scale factor of 1
+    scales[scales == 0] = 1
+    quantized = np.rint(weights / scales[:, None].astype(np.float64))
+    return np.clip(quantized, -limit, limit).astype(dtype), scales
+
+
+def dequantize(weights, scales):
+    """Return the float64 weights of a quantised weight matrix."""
+    return weights * scales[:, None].astype(np.float64)
+
+
+def write_model(filename, metadata, features, weights, vocabulary=(), resources=None, scales=None):
+    """Write a model in the binary format.
+
+    `metadata` is a JSON-serializable dictionary, `features` a list
+    of feature strings (or None if the model uses feature hashing),
+    `weights` a 2-D array with one row per feature, `vocabulary` an
+    iterable of words and `resources` a dictionary that maps resource
+    names to mappings (cf. ResourceIndex.from_mapping). For quantised
+    weights, `scales` contains the scale factor of every row (cf.
+    quantize).
+
+    """
+    if features is None:
+        features = []
+    elif any("\n" in feat for feat in features):
+        raise ValueError("Feature strings must not contain line breaks")
+    weights = np.ascontiguousarray(weights)
+    assert weights.ndim == 2 and (len(features) == 0 or weights.shape[0] == len(features))
+    feature_table = StringTable.from_strings(features)
+    blocks = []
+    offset = 0
+
+    def add_block(array):
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        blocks.append(array)
+        spec = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += _align(array.nbytes)
+        return spec
+
+    def add_table(table):
+        return {name: add_block(table.arrays[name]) for name in table.array_names}
+
+    header = dict(metadata)
+    header["format_version"] = FORMAT_VERSION
+    keys = add_block(feature_table.arrays["keys"])
+    header["features"] = {"offset": keys["offset"], "size": keys["shape"][0], "n": len(features),
+                          "key_offsets": add_block(feature_table.arrays["key_offsets"]),
+                          "slots": add_block(feature_table.arrays["slots"])}
+    header["weights"] = add_block(weights)
+    if scales is not None:
+        assert scales.shape == (weights.shape[0],)
+        header["scales"] = add_block(scales.astype(np.float32))
+    header["vocabulary"] = add_table(StringTable.from_strings(sorted(vocabulary)))
+    header["resources"] = {name: add_table(ResourceIndex.from_mapping(mapping)) for name, mapping in (resources or {}).items()}
+    header = json.dumps(header, ensure_ascii=False).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    with open(filename, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack("<Q", len(header)))
+        fh.write(header)
+        for block in blocks:
+            fh.write(b"\0" * (_align(fh.tell()) - fh.tell()))
+            fh.write(block.tobytes())
+
+
+def read_header(fh):
+    """Read the header of a binary model and return it together with the
+    absolute offset of the data section.
+
+    """
+    if fh.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary SoMeWeTa model")
+    header_length, = struct.unpack("<Q", fh.read(8))
+    header = json.loads(fh.read(header_length).decode())
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported model format version %d" % header["format_version"])
+    data_start = _align(len(MAGIC) + 8 + header_length)
+    return header, data_start
+
+
+def _read_array(filename, spec, offset, mmap):
+    dtype = np.dtype(spec["dtype"])
+    shape = tuple(spec["shape"])
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    elif mmap:
+        return np.memmap(filename, dtype=dtype, mode="r", offset=offset + spec["offset"], shape=shape)
+    return np.fromfile(filename, dtype=dtype, count=int(np.prod(shape)), offset=offset + spec["offset"]).reshape(shape)
+
+
+def read_model(filename, mmap=True, lazy=False):
+    """Read a model in the binary format and return the metadata, the
+    feature strings, the weight matrix, the scale factors of its rows
+    (None unless the weights are quantised, cf. quantize), the
+    vocabulary and a dictionary of resource indexes. If `mmap` is
+    True, the weight matrix and the resource indexes are read-only
+    memory maps of the file.
+
+    By default, features are returned as a list and the vocabulary as
+    a set. If `lazy` is True, both are returned as memory-mapped
+    StringTables, i.e. the strings are only read when they are looked
+    up.
+
+    """
+    with open(filename, "rb") as fh:
+        header, data_start = read_header(fh)
+        if not lazy:
+            fh.seek(data_start + header["features"]["offset"])
+            feature_table = fh.read(header["features"]["size"]).decode()
+    mmap = mmap or lazy
+
+    def read_table(cls, specs):
+        return cls(**{name: _read_array(filename, specs[name], data_start, mmap) for name in cls.array_names})
+
+    if not lazy:
+        features = feature_table.split("\n") if header["features"]["n"] > 0 else []
+    else:
+        spec = {"offset": header["features"]["offset"], "dtype": "|u1", "shape": [header["features"]["size"]]}
+        features = StringTable(keys=_read_array(filename, spec, data_start, mmap),
+                               key_offsets=_read_array(filename, header["features"]["key_offsets"], data_start, mmap),
+                               slots=_read_array(filename, header["features"]["slots"], data_start, mmap))
+    weights = _read_array(filename, header["weights"], data_start, mmap)
+    scales = None
+    if "scales" in header:
+        scales = _read_array(filename, header["scales"], data_start, mmap)
+    vocabulary = read_table(StringTable, header["vocabulary"])
+    if not lazy:
+        vocabulary = set(vocabulary.strings())
+    resources = {name: read_table(ResourceIndex, specs) for name, specs in header["resources"].items()}
+    return header, features, weights, scales, vocabulary, resources
+
+
+def read_legacy_model(filename):
+    """Read a model in the gzipped JSON format used up to version 1.8
+    and return vocabulary, lexicon, Brown clusters, word2vec vectors,
+    target mapping, target size, list of features and list of weight
+    vectors.
+
+    """
+    # Try an optimised ijson-based loading algorithm if we're on a python
+    # where dict iteration order is guaranteed (3.7+ any interpreter, or
+    # 3.6+ cpython specifically)
+    if sys.version_info >= (3, 7) or (sys.version_info >= (3, 6, 0, 'final') and sys.implementation.name == 'cpython'):
+        try:
+            import ijson
+            with gzip.open(filename, 'rb') as f:
+                parser = ijson.parse(f)
+                (prefix, event, value) = next(parser)
+                assert event == 'start_array'
+                # vocabulary - need to load JSON array into a Python set
+                (prefix, event, value) = next(parser)
+                assert event == 'start_array'
+                vocabulary = set()
+                (prefix, event, value) = next(parser)
+                while event == 'string':
+                    vocabulary.add(value)
+                    (prefix, event, value) = next(parser)
+
+                # the simple parts where we don't need to change the default type
+                item_iter = ijson.items(parser, 'item')
+                lexicon = next(item_iter)
+                brown_clusters = next(item_iter)
+                word_to_vec = next(item_iter)
+                target_mapping = next(item_iter)
+                target_size = next(item_iter)
+
+                # features and weights - first load the list of features (the
+                # keys), then apply the parallel list of weights
+                features = []
+                (prefix, event, value) = next(parser)
+                assert event == 'start_array'
+                (prefix, event, value) = next(parser)
+                while event == 'string':
+                    features.append(value)
+                    (prefix, event, value) = next(parser)
+
+                # now actual weights are in the same order as keys
+                weights = []
+                (prefix, event, value) = next(parser)
+                assert event == 'start_array'
+                for _ in features:
+                    (prefix, event, value) = next(parser)
+                    assert event == 'string'
+                    weights.append(np.frombuffer(base64.b85decode(value), np.float64).copy())
+                return vocabulary, lexicon, brown_clusters, word_to_vec, target_mapping, target_size, features, weights
+
+        except ImportError:
+            pass
+
+    # older Python, or ijson not available - fall back to standard json parser
+    with gzip.open(filename, 'rb') as f:
+        model = json.loads(f.read().decode())
+        vocabulary, lexicon, brown_clusters, word_to_vec, target_mapping, target_size, features, weights = model
+        vocabulary = set(vocabulary)
+        weights = [np.frombuffer(base64.b85decode(w), np.float64).copy() for w in weights]
+        return vocabulary, lexicon, brown_clusters, word_to_vec, target_mapping, target_size, features, weights
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+from someweta import cli
+from someweta import utils
+from someweta import ASPTagger
+from someweta.version import __version__
+
+
+def arguments():
+    """Process command line arguments."""
+    parser = argparse.ArgumentParser(description="Tag many files with an averaged perceptron part-of-speech tagger")
+    parser.add_argument("--tag", type=os.path.abspath, required=True, help="Tag the input texts using the specified model")
+    parser.add_argument("--mapping", type=os.path.abspath, help="Additional mapping to coarser tagset; optional")
+    parser.add_argument("-b", "--beam-size", type=int, default=5, help="Size of the search beam; default: 5")
+    parser.add_argument("--decoder", choices=["greedy", "beam", "viterbi"], default="beam", help="Decoding algorithm: greedy (fastest, slightly less accurate), beam (beam search with the beam size given by -b/--beam-size) or viterbi (exact second-order search, slow); default: beam")
+    parser.add_argument("--cache-size", type=int, default=65536, metavar="N", help="Cache the static weights of up to N (word, position) pairs; 0 disables the cache; default: 65536")
+    parser.add_argument("-x", "--xml", action="store_true", help="The input texts are XML files. We assume that each tag is on a separate line. Otherwise the format is the same as for regular files with respect to tag and sentence delimiters.")
+    parser.add_argument("--sentence-tag", "--sentence_tag", type=str, help="The name of the XML element that delimits sentences (e.g. 's' for <s>…</s>); implies -x/--xml")
+    parser.add_argument("--output-prefix", type=str, default="", help="Prefix of output files; default: \"\" (no prefix)")
+    parser.add_argument("--output-suffix", type=str, default=".tagged", help="Suffix of output files; default: \".tagged\"")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="Tag N files at a time in worker processes (up to the number of CPUs); default: 1")
+    parser.add_argument("--skip-existing", action="store_true", help="Do not tag texts whose output file already exists, e.g. to resume an interrupted run. Output files are only created when a text has been tagged completely.")
+    parser.add_argument("--lazy", action="store_true", help="Do not build an in-memory index of the features of the model but look them up in the model file when they are first needed (cf. somewe-tagger --lazy)")
+    parser.add_argument("--use-nfkc", action="store_true", help="Convert input to NFKC before feeding it to the tagger. This only affects the internal representation of the data.")
+    parser.add_argument("-v", "--version", action="version", version="SoMeWeTa %s" % __version__, help="Output version information and exit.")
+    parser.add_argument("TEXTS", type=os.path.abspath, nargs="+", help="""Paths to
+                                                         input texts (UTF-8-encoded). Format for
+                                                         tagging: One token per line; sentences
+                                                         delimited by an empty line.""")
+    args = parser.parse_args()
+    if args.sentence_tag:
+        args.xml = True
+    return args
+
+
+def output_filename(filename, output_prefix, output_suffix):
+    """Return the name of the output file for `filename`."""
+    return output_prefix + os.path.basename(filename) + output_suffix
+
+
+def tag_file(asptagger, filename, outname, xml=False, sentence_tag=None, chunk_size=256):
+    """Tag `filename` and write the result to `outname`. The output is
+    written to a temporary file that is renamed when the text has
+    been tagged completely, i.e. an existing output file is never
+    incomplete. Return the number of tokens.
+
+    """
+    corpus_size = 0
+    tmpname = "%s.tmp-%d" % (outname, os.getpid())
+    try:
+        with open(filename, encoding="utf-8") as fh, open(tmpname, mode="wb", buffering=cli.OUTPUT_BUFFER_SIZE) as out:
+            for data, length in cli.tag_chunks(cli.read_chunks(fh, chunk_size, xml, sentence_tag), asptagger, xml, sentence_tag):
+                out.write(data)
+                corpus_size += length
+        os.replace(tmpname, outname)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+    return corpus_size
+
+
+def init_worker(asptagger):
+    """"""
+    global worker_tagger
+    worker_tagger = asptagger
+
+
+def tag_file_in_worker(job):
+    """Tag a file in a worker process (cf. tag_file)."""
+    filename, outname, xml, sentence_tag = job
+    return filename, tag_file(worker_tagger, filename, outname, xml, sentence_tag)
+
+
+def schedule(texts, output_prefix, output_suffix, skip_existing=False):
+    """Return a list of (filename, outname) pairs, largest file first,
+    so that the last files to be tagged are small ones and the workers
+    finish at about the same time.
+
+    """
+    jobs = []
+    for filename in texts:
+        outname = output_filename(filename, output_prefix, output_suffix)
+        if skip_existing and os.path.exists(outname):
+            logging.info("Skipping %s (%s exists)" % (filename, outname))
+            continue
+        jobs.append((filename, outname))
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+    return jobs
+
+
+def main():
+    args = arguments()
+    mapping = None
+    if args.mapping:
+        mapping = utils.read_mapping(args.mapping)
+    logging.info("Loading model…")
+    asptagger = ASPTagger(beam_size=args.beam_size, mapping=mapping, use_nfkc=args.use_nfkc, decoder=args.decoder, cache_size=args.cache_size)
+    asptagger.load(args.tag, args.lazy)
+    logging.info("… done")
+    jobs = schedule(args.TEXTS, args.output_prefix, args.output_suffix, args.skip_existing)
+    corpus_size = 0
+    t0 = time.perf_counter()
+    processes = min(args.parallel, multiprocessing.cpu_count(), len(jobs))
+    if processes > 1:
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+            logging.info(f"Multiprocessing start method 'fork' is not available on your operating system. Using method '{context.get_start_method()}' instead.")
+            if asptagger.model_file is None:
+                logging.warning("The model is in the legacy format and will be copied into every worker process. Convert it with somewe-convert-model to share it between the processes.")
+        with context.Pool(processes=processes, initializer=init_worker, initargs=(asptagger,)) as pool:
+            # chunksize 1 keeps the largest-first order
+            for filename, n in pool.imap_unordered(tag_file_in_worker, [(filename, outname, args.xml, args.sentence_tag) for filename, outname in jobs], chunksize=1):
+                logging.info("Tagged %s" % filename)
+                corpus_size += n
+    else:
+        for filename, outname in jobs:
+            logging.info("Tagging %s" % filename)
+            corpus_size += tag_file(asptagger, filename, outname, args.xml, args.sentence_tag)
+    t1 = time.perf_counter()
+    logging.info("Tagged %d tokens in %s (%d tokens/s)" % (corpus_size, utils.int2str(t1 - t0), corpus_size / (t1 - t0)))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import contextlib
+import inspect
+import time
+
+# instrumented methods of ASPTagger (and AveragedStructuredPerceptron)
+# and the stages they are attributed to
+STAGES = {"tag": "tagging",
+          "predict": "decoding",
+          "_get_windows": "context windows",
+          "_static_weights": "static weights",
+          "_get_partial_features": "static features",
+          "_word_shape": "word shape",
+          "_word_flags": "word flags",
+          "_get_latent_features": "latent features",
+          "_latent_weight_tensor": "latent features",
+          "_sum_weights": "scoring",
+          "_predict_static": "scoring",
+          "_predict_latent": "scoring",
+          "_top_k": "scoring",
+          "_beam_search": "decoding",
+          "_batch_beam_search": "decoding",
+          "_greedy_search": "decoding",
+          "_viterbi_search": "decoding"}
+
+
+class Timed:
+    """A function whose calls are timed by a Profiler. Unlike a closure,
+    it can be pickled together with the tagger (the function is a
+    bound method or a module-level function).
+
+    """
+    def __init__(self, profiler, stage, function):
+        self.profiler = profiler
+        self.stage = stage
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        return self.profiler.call(self.stage, self.function, *args, **kwargs)
+
+
+class TimedGenerator(Timed):
+    """A generator function whose steps are timed by a Profiler."""
+    def __call__(self, *args, **kwargs):
+        return self.profiler.iterate(self.stage, self.function(*args, **kwargs))
+
+
+class Profiler:
+    """Collects the time spent in the stages of tagging (feature
+    extraction, scoring, decoding, I/O, …), the hit rates of the
+    caches of ASPTagger and the average sizes of beams and agendas.
+
+    The time of a stage is exclusive, i.e. it does not include the
+    time of other stages that are called from it: The time of
+    "decoding" is the bookkeeping of the decoder without scoring and
+    feature extraction. Stages are recorded by replacing the methods
+    listed in STAGES with timed versions on a tagger instance (cf.
+    instrument); a tagger that is not instrumented is not slowed
+    down at all.
+
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.caches = {}
+        self._cache_baseline = {}
+        # time spent in nested stages, one entry per active stage
+        self._children = [0.0]
+
+    def instrument(self, asptagger):
+        """Record the stages of `asptagger` (and of its feature index).
+        Call this again after loading a model, as loading replaces the
+        feature index.
+
+        """
+        asptagger.profiler = self
+        targets = [(asptagger, name, stage) for name, stage in STAGES.items()]
+        targets.append((asptagger.feature_index, "lookup", "feature lookup"))
+        for obj, name, stage in targets:
+            if isinstance(vars(obj).get(name), Timed):
+                continue
+            function = getattr(obj, name)
+            if inspect.isgeneratorfunction(function):
+                setattr(obj, name, TimedGenerator(self, stage, function))
+            else:
+                setattr(obj, name, Timed(self, stage, function))
+        self.reset(asptagger)
+
+    def reset(self, asptagger):
+        """Discard all statistics, e.g. in a worker process that inherited
+        the statistics of its parent.
+
+        """
+        self.stages = {}
+        self.counters = {}
+        self.caches = {}
+        self._cache_baseline = cache_infos(asptagger)
+
+    def call(self, stage, function, *args, **kwargs):
+        """Call `function` and record its running time for `stage`."""
+        self._children.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._record(stage, time.perf_counter() - t0)
+
+    def iterate(self, stage, iterable):
+        """Yield the items of `iterable` and record the time needed for
+        producing them for `stage`.
+
+        """
+        iterator = iter(iterable)
+        while True:
+            try:
+                item = self.call(stage, next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Record the running time of a with block for `stage`."""
+        self._children.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(stage, time.perf_counter() - t0)
+
+    def _record(self, stage, elapsed):
+        """Add the time of a call to `stage`, excluding the time of the
+        stages called from it.
+
+        """
+        children = self._children.pop()
+        self._children[-1] += elapsed
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = [0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed - children
+
+    def count(self, name, total, n=1):
+        """Add `total` to the counter `name`, for an average over `n`
+        observations.
+
+        """
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = [0, 0]
+        counter[0] += total
+        counter[1] += n
+
+    def take(self, asptagger):
+        """Return the statistics collected so far (including the cache
+        statistics of `asptagger`) and start from scratch. Worker
+        processes send these to their parent (cf. merge).
+
+        """
+        self._update_caches(asptagger)
+        statistics = {"stages": self.stages, "counters": self.counters, "caches": self.caches}
+        self.stages, self.counters, self.caches = {}, {}, {}
+        return statistics
+
+    def merge(self, statistics):
+        """Add the statistics of another profiler (cf. take)."""
+        for attribute in ("stages", "counters", "caches"):
+            own = getattr(self, attribute)
+            for name, values in statistics[attribute].items():
+                if name in own:
+                    own[name] = [a + b for a, b in zip(own[name], values)]
+                else:
+                    own[name] = list(values)
+
+    def report(self, asptagger=None):
+        """Return the statistics as a dictionary that can be serialized
+        as JSON. Stages are sorted by their running time.
+
+        """
+        if asptagger is not None:
+            self._update_caches(asptagger)
+        total = sum(seconds for calls, seconds in self.stages.values())
+        stages = {}
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True):
+            stages[name] = {"calls": calls, "seconds": seconds, "share": seconds / total if total > 0 else 0.0}
+        caches = {}
+        for name, (hits, misses) in sorted(self.caches.items()):
+            caches[name] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses > 0 else None}
+        averages = {name: value / n for name, (value, n) in sorted(self.counters.items()) if n > 0}
+        return {"seconds": total, "stages": stages, "caches": caches, "averages": averages}
+
+    def _update_caches(self, asptagger):
+        """Add the cache hits and misses since the last update."""
+        current = cache_infos(asptagger)
+        for name, (hits, misses) in current.items():
+            baseline = self._cache_baseline.get(name)
+            if baseline is not None:
+                hits, misses = hits - baseline[0], misses - baseline[1]
+            stats = self.caches.setdefault(name, [0, 0])
+            stats[0] += hits
+            stats[1] += misses
+        self._cache_baseline = current
+
+
+def cache_infos(asptagger):
+    """Return the numbers of hits and misses of the caches of
+    `asptagger` (cf. functools.lru_cache). Apart from the static
+    weights, the caches are shared by all taggers of a process.
+
+    """
+    cls = type(asptagger)
+    caches = {"static weights": asptagger.cache_info(),
+              "word shape": cls._word_shape.cache_info(),
+              "word flags": cls._word_class.cache_info(),
+              "flag features": cls._flag_features.cache_info()}
+    return {name: (info.hits, info.misses) for name, info in caches.items()}
+
+
+def stage(profiler, name):
+    """Return a context manager that records the running time of a with
+    block for stage `name` or does nothing if `profiler` is None.
+
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+
+def iterate(profiler, name, iterable):
+    """Return `iterable`, timed for stage `name` unless `profiler` is
+    None (cf. Profiler.iterate).
+
+    """
+    if profiler is None:
+        return iterable
+    return profiler.iterate(name, iterable)
+
+
+def summary(report):
+    """Format a report (cf. Profiler.report) as a list of lines."""
+    lines = ["%-20s %10s %10s %7s %12s" % ("stage", "calls", "seconds", "share", "µs/call")]
+    for name, stats in report["stages"].items():
+        lines.append("%-20s %10d %10.3f %6.1f%% %12.2f" % (name, stats["calls"], stats["seconds"], stats["share"] * 100, stats["seconds"] / stats["calls"] * 1e6))
+    for name, stats in report["caches"].items():
+        if stats["hit_rate"] is not None:
+            lines.append("%s cache: %d hits, %d misses (%.2f%% hit rate)" % (name, stats["hits"], stats["misses"], stats["hit_rate"] * 100))
+    for name, average in report["averages"].items():
+        lines.append("Average %s: %.2f" % (name, average))
+    return lines
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import collections.abc
+import json
+import zlib
+
+import numpy as np
+
+
+def _encode(string):
+    return string.encode("utf-8", "surrogatepass")
+
+
+def _decode(data):
+    return data.tobytes().decode("utf-8", "surrogatepass")
+
+
+def _join(strings):
+    """Return the newline-separated concatenation of the encoded
+    `strings` and the offsets of the strings in it.
+
+    """
+    encoded = [_encode(s) for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) + 1 for s in encoded], out=offsets[1:])
+    return np.frombuffer(b"\n".join(encoded), dtype=np.uint8), offsets
+
+
+class StringTable:
+    """A table of unique strings that consists of three flat arrays:
+
+      - keys:        the UTF-8 encoded strings, separated by newlines
+      - key_offsets: string i is keys[key_offsets[i]:key_offsets[i + 1] - 1]
+      - slots:       open-addressing hash table (crc32, linear
+                     probing) of string numbers for O(1) lookups
+
+    The arrays are stored in the binary model format and
+    memory-mapped when a model is loaded (cf. model_io), i.e. loading
+    a table neither parses nor copies it.
+
+    """
+    array_names = ("keys", "key_offsets", "slots")
+
+    def __init__(self, **arrays):
+        self.arrays = arrays
+        self._init_views()
+
+    def _init_views(self):
+        # memoryviews are much faster to index than numpy arrays
+        self._keys = memoryview(self.arrays["keys"])
+        self._key_offsets = memoryview(self.arrays["key_offsets"])
+        self._slots = memoryview(self.arrays["slots"])
+        self._mask = len(self._slots) - 1
+
+    def __getstate__(self):
+        return {"arrays": self.arrays}
+
+    def __setstate__(self, state):
+        self.arrays = state["arrays"]
+        self._init_views()
+
+    @staticmethod
+    def _table_arrays(strings):
+        keys, key_offsets = _join(strings)
+        size = 1
+        while size < 2 * len(strings):
+            size *= 2
+        slots = [-1] * size
+        mask = size - 1
+        for i, s in enumerate(strings):
+            j = zlib.crc32(_encode(s)) & mask
+            while slots[j] >= 0:
+                j = (j + 1) & mask
+            slots[j] = i
+        return {"keys": keys, "key_offsets": key_offsets, "slots": np.array(slots, dtype=np.int32)}
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Create a table of the unique `strings` (in the given order)."""
+        return cls(**cls._table_arrays(strings))
+
+    def find(self, string):
+        """Return the number of `string` or -1."""
+        k = _encode(string)
+        j = zlib.crc32(k) & self._mask
+        while True:
+            i = self._slots[j]
+            if i < 0 or self._keys[self._key_offsets[i]:self._key_offsets[i + 1] - 1] == k:
+                return i
+            j = (j + 1) & self._mask
+
+    def strings(self):
+        """Return a list of all strings."""
+        if len(self) == 0:
+            return []
+        strings = _decode(self._keys).split("\n")
+        if len(strings) != len(self):
+            # some strings contain line breaks
+            strings = list(self)
+        return strings
+
+    def _string(self, i):
+        return _decode(self._keys[self._key_offsets[i]:self._key_offsets[i + 1] - 1])
+
+    def __getitem__(self, i):
+        return self._string(i)
+
+    def __contains__(self, string):
+        return self.find(string) >= 0
+
+    def __len__(self):
+        return len(self._key_offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._string(i)
+
+
+class ResourceIndex(StringTable, collections.abc.Mapping):
+    """A compact, read-only mapping from strings (e.g. the word forms of
+    a lexicon) to JSON-serializable values: A StringTable of the keys
+    in sorted order and three more arrays:
+
+      - values:        the distinct values as JSON strings, separated
+                       by newlines
+      - value_offsets: value j is values[value_offsets[j]:value_offsets[j + 1] - 1]
+      - value_ids:     key i maps to value value_ids[i]
+
+    """
+    array_names = StringTable.array_names + ("values", "value_offsets", "value_ids")
+
+    def _init_views(self):
+        super()._init_views()
+        self._values = memoryview(self.arrays["values"])
+        self._value_offsets = memoryview(self.arrays["value_offsets"])
+        self._value_ids = memoryview(self.arrays["value_ids"])
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Create an index of `mapping`."""
+        if isinstance(mapping, cls):
+            return mapping
+        # sorting strings by code points is sorting them by UTF-8 bytes
+        keys = sorted(mapping)
+        table = {}
+        value_ids = np.fromiter((table.setdefault(json.dumps(mapping[k], ensure_ascii=False), len(table)) for k in keys), dtype=np.int32, count=len(keys))
+        values, value_offsets = _join(table)
+        return cls(values=values, value_offsets=value_offsets, value_ids=value_ids, **cls._table_arrays(keys))
+
+    def _value(self, i):
+        j = self._value_ids[i]
+        return json.loads(_decode(self._values[self._value_offsets[j]:self._value_offsets[j + 1] - 1]))
+
+    def __getitem__(self, key):
+        i = self.find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def get(self, key, default=None):
+        i = self.find(key)
+        if i < 0:
+            return default
+        return self._value(i)
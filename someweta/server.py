@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+import argparse
+import html
+import http.server
+import io
+import json
+import logging
+import os
+import queue
+import signal
+import socketserver
+import stat
+import threading
+import time
+import urllib.parse
+
+from someweta import ASPTagger
+from someweta import utils
+from someweta.version import __version__
+
+
+def arguments():
+    """Process command line arguments."""
+    parser = argparse.ArgumentParser(description="Serve a SoMeWeTa model over HTTP. The model is loaded once and the sentences of concurrent requests are tagged together in batches.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on; default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on; default: 8000")
+    parser.add_argument("--unix-socket", type=os.path.abspath, metavar="PATH", help="Listen on the Unix domain socket PATH instead of a TCP port")
+    parser.add_argument("--max-batch-size", type=int, default=512, metavar="N", help="Tag up to N sentences of concurrent requests together; default: 512")
+    parser.add_argument("--max-wait", type=float, default=0, metavar="MS", help="Wait up to MS milliseconds for more requests before tagging a batch; default: 0, i.e. a batch consists of the requests that arrived while the previous batch was tagged")
+    parser.add_argument("--mapping", type=os.path.abspath, help="Additional mapping to coarser tagset; optional")
+    parser.add_argument("-b", "--beam-size", type=int, default=5, help="Size of the search beam; default: 5")
+    parser.add_argument("--decoder", choices=["greedy", "beam", "viterbi"], default="beam", help="Decoding algorithm: greedy (fastest, slightly less accurate), beam (beam search with the beam size given by -b/--beam-size) or viterbi (exact second-order search, slow); default: beam")
+    parser.add_argument("--cache-size", type=int, default=65536, metavar="N", help="Cache the static weights of up to N (word, position) pairs; 0 disables the cache; default: 65536")
+    parser.add_argument("--lazy", action="store_true", help="Do not build an in-memory index of the features of the model but look them up in the model file when they are first needed")
+    parser.add_argument("--use-nfkc", action="store_true", help="Convert input to NFKC before feeding it to the tagger. This only affects the internal representation of the data.")
+    parser.add_argument("-v", "--version", action="version", version="SoMeWeTa %s" % __version__, help="Output version information and exit.")
+    parser.add_argument("MODEL", type=os.path.abspath, help="Model")
+    args = parser.parse_args()
+    if args.unix_socket is not None and os.path.exists(args.unix_socket) and not _is_socket(args.unix_socket):
+        parser.error("--unix-socket: %s exists and is not a socket" % args.unix_socket)
+    return args
+
+
+class Statistics:
+    """Request, batch and latency counters of a server."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.batches = 0
+        self.sentences = 0
+        self.tokens = 0
+        self.tagging_time = 0.0
+
+    def add_request(self, latency, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def add_batch(self, sentences, tokens, tagging_time):
+        with self.lock:
+            self.batches += 1
+            self.sentences += sentences
+            self.tokens += tokens
+            self.tagging_time += tagging_time
+
+    def as_dict(self):
+        with self.lock:
+            return {"uptime": time.time() - self.start,
+                    "requests": self.requests,
+                    "errors": self.errors,
+                    "mean_latency_ms": self.latency / self.requests * 1000 if self.requests else 0.0,
+                    "max_latency_ms": self.max_latency * 1000,
+                    "batches": self.batches,
+                    "sentences": self.sentences,
+                    "tokens": self.tokens,
+                    "mean_batch_size": self.sentences / self.batches if self.batches else 0.0,
+                    "tokens_per_second": self.tokens / self.tagging_time if self.tagging_time else 0.0}
+
+
+class _Request:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Batcher:
+    """Tag the sentences of concurrent requests together: A worker
+    thread takes all pending requests (up to `max_batch_size`
+    sentences, waiting up to `max_wait` seconds for more) and tags
+    them with a single call to ASPTagger.tag, i.e. the sentences are
+    decoded as a batch. A request that would exceed `max_batch_size`
+    starts the next batch; a single request with more sentences is
+    decoded in batches of `max_batch_size` sentences. The tagger is
+    only used by the worker thread.
+
+    """
+    def __init__(self, asptagger, max_batch_size=512, max_wait=0):
+        self.asptagger = asptagger
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.statistics = Statistics()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def tag(self, sentences):
+        """Tag a list of sentences (lists of tokens) and return a list
+        of tagged sentences (lists of tuples). Blocks until the batch
+        that contains the sentences has been tagged.
+
+        """
+        request = _Request(sentences)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        pending = None
+        while True:
+            if pending is None:
+                pending = self.requests.get()
+            batch = [pending]
+            size = len(pending.sentences)
+            pending = None
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(request.sentences) > self.max_batch_size:
+                    # the request starts the next batch
+                    pending = request
+                    break
+                batch.append(request)
+                size += len(request.sentences)
+            self._tag_batch(batch)
+
+    def _tag_batch(self, batch):
+        sentences = [sentence for request in batch for sentence in request.sentences]
+        n_words = sum(len(sentence) for sentence in sentences)
+        t0 = time.perf_counter()
+        try:
+            results = list(self.asptagger.tag_many(sentences, self.max_batch_size))
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        self.statistics.add_batch(len(sentences), n_words, time.perf_counter() - t0)
+        start = 0
+        for request in batch:
+            request.result = results[start:start + len(request.sentences)]
+            start += len(request.sentences)
+            request.done.set()
+
+
+def _word_indexes(lines):
+    """Return the indexes of the lines of an XML sentence that are
+    tokens, not XML tags (cf. ASPTagger.tag_xml_sentence).
+
+    """
+    return [i for i, line in enumerate(lines) if not (line.startswith("<") and line.endswith(">"))]
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle tagging requests:
+
+    POST /tag with Content-Type application/json: The body is an
+    object with a list of tokenized sentences ("sentences") and/or a
+    list of sentences that also contain XML tags ("xml_sentences", one
+    line per tag or token, cf. ASPTagger.tag_xml_sentence). The
+    response has the same keys and contains the tagged sentences.
+
+    POST /tag with any other Content-Type: The body is in the input
+    format of somewe-tagger --tag (one token per line, sentences
+    delimited by an empty line) and so is the response. With the
+    query parameter xml=1 or sentence_tag=TAG, the body is treated
+    like XML input (cf. somewe-tagger -x and --sentence-tag).
+
+    GET /stats returns the counters of the server as JSON.
+
+    """
+    server_version = "SoMeWeTa/%s" % __version__
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/stats":
+            self._respond(200, "application/json", json.dumps(self.server.batcher.statistics.as_dict()))
+        else:
+            self._respond(404, "text/plain", "Not found\n")
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/tag":
+            # the body is not read
+            self.close_connection = True
+            self._respond(404, "text/plain", "Not found\n")
+            return
+        try:
+            body = self._read_body()
+            if self.headers.get_content_type() == "application/json":
+                content_type, response = "application/json", self._tag_json(body)
+            else:
+                params = urllib.parse.parse_qs(url.query)
+                sentence_tag = params.get("sentence_tag", [None])[0]
+                xml = params.get("xml", ["0"])[0] not in ("0", "") or sentence_tag is not None
+                content_type, response = "text/tab-separated-values", self._tag_text(body, xml, sentence_tag)
+        except ValueError as e:
+            self.server.batcher.statistics.add_request(time.perf_counter() - t0, error=True)
+            self._respond(400, "text/plain", "%s\n" % e)
+            return
+        except Exception as e:
+            logging.exception("Error while tagging")
+            self.server.batcher.statistics.add_request(time.perf_counter() - t0, error=True)
+            self._respond(500, "text/plain", "%s\n" % e)
+            return
+        self._respond(200, content_type, response)
+        self.server.batcher.statistics.add_request(time.perf_counter() - t0)
+
+    def _read_body(self):
+        """Read the body of a request and return it as a string. Raise
+        a ValueError if it is not UTF-8 or if Content-Length is
+        malformed.
+
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # the end of the body is unknown
+            self.close_connection = True
+            raise ValueError("Invalid Content-Length")
+        try:
+            return self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError:
+            raise ValueError("The body is not valid UTF-8")
+
+    def _tag_json(self, body):
+        request = json.loads(body)
+        if not isinstance(request, dict) or not all(isinstance(request.get(key, []), list) for key in ("sentences", "xml_sentences")):
+            raise ValueError("Expected an object with a list of sentences and/or xml_sentences")
+        sentences = request.get("sentences", [])
+        xml_sentences = request.get("xml_sentences", [])
+        if not all(isinstance(s, list) and all(isinstance(t, str) for t in s) for s in sentences + xml_sentences):
+            raise ValueError("Sentences have to be lists of strings")
+        xml_indexes = [_word_indexes(lines) for lines in xml_sentences]
+        xml_words = [[html.unescape(lines[i]) for i in word_indexes] for lines, word_indexes in zip(xml_sentences, xml_indexes)]
+        tagged = self.server.batcher.tag(sentences + xml_words)
+        response = {}
+        if "sentences" in request:
+            response["sentences"] = tagged[:len(sentences)]
+        if "xml_sentences" in request:
+            response["xml_sentences"] = []
+            for lines, word_indexes, sentence in zip(xml_sentences, xml_indexes, tagged[len(sentences):]):
+                tags = {i: t[1:] for i, t in zip(word_indexes, sentence)}
+                response["xml_sentences"].append([(line,) + tags.get(i, ()) for i, line in enumerate(lines)])
+        return json.dumps(response, ensure_ascii=False)
+
+    def _tag_text(self, body, xml, sentence_tag):
+        corpus = io.StringIO(body)
+        if xml:
+            sentences = list(utils.iter_xml(corpus, tagged=False, sentence_tag=sentence_tag))
+            tagged = self.server.batcher.tag([words for words, length, lines, word_indexes in sentences])
+            output = []
+            for sentence, (words, length, lines, word_indexes) in zip(tagged, sentences):
+                output.append("\n".join(utils.add_pos_to_xml(sentence, lines, word_indexes)) + "\n")
+                if sentence_tag is None:
+                    output.append("\n")
+            return "".join(output)
+        sentences = [words for words, length in utils.iter_corpus(corpus, tagged=False)]
+        tagged = self.server.batcher.tag(sentences)
+        return "".join("\n".join("\t".join(t) for t in sentence) + "\n\n" for sentence in tagged)
+
+    def _respond(self, status, content_type, text):
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "%s; charset=utf-8" % content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # the client address of a Unix domain socket is an empty string
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix-socket"
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def _is_socket(path):
+    """Return whether `path` is a Unix domain socket."""
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def make_server(batcher, host="127.0.0.1", port=8000, unix_socket=None):
+    """Create a threading HTTP server for the `batcher` that listens on
+    `host` and `port` or on the Unix domain socket `unix_socket`.
+
+    """
+    if unix_socket is not None:
+        # remove the socket of a previous server, but nothing else
+        if os.path.exists(unix_socket):
+            if not _is_socket(unix_socket):
+                raise FileExistsError("%s exists and is not a socket" % unix_socket)
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.batcher = batcher
+    return server
+
+
+def main():
+    args = arguments()
+    mapping = None
+    if args.mapping:
+        mapping = utils.read_mapping(args.mapping)
+    asptagger = ASPTagger(beam_size=args.beam_size, mapping=mapping, use_nfkc=args.use_nfkc, decoder=args.decoder, cache_size=args.cache_size)
+    asptagger.load(args.MODEL, args.lazy)
+    batcher = Batcher(asptagger, args.max_batch_size, args.max_wait / 1000)
+    server = make_server(batcher, args.host, args.port, args.unix_socket)
+    if args.unix_socket is not None:
+        logging.info("Serving %s on %s" % (args.MODEL, args.unix_socket))
+    else:
+        logging.info("Serving %s on http://%s:%d/" % (args.MODEL, *server.server_address[:2]))
+    # shut down cleanly on SIGTERM as on SIGINT
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket is not None and _is_socket(args.unix_socket):
+            os.remove(args.unix_socket)
@@ -1,27 +1,53 @@
 #!/usr/bin/env python3
 
-import base64
+import collections
 import functools
-import gzip
 import html
-import json
+import itertools
 import math
-import sys
 import unicodedata
 
 import numpy as np
 import regex as re
 
+from someweta import feature_cache
+from someweta import model_io
+from someweta import utils
 from someweta.averaged_structured_perceptron import AveragedStructuredPerceptron
+from someweta.feature_index import FeatureIndex, HashedFeatureIndex, MappedFeatureIndex
 
 
 class ASPTagger(AveragedStructuredPerceptron):
     """A part-of-speech tagger based on the averaged structured
     perceptron.
 
+    When tagging, the static weights of a word are computed from the
+    five positions of its context window. The partial weight vectors
+    of these positions are kept in a least-recently-used cache with
+    up to `cache_size` entries (None: unbounded, 0: no caching); as
+    most tokens of a corpus are frequent words, most lookups are cache
+    hits. Use cache_info() for hit and miss statistics.
+
     """
-    def __init__(self, beam_size=5, iterations=10, lexicon=None, mapping=None, brown_clusters=None, word_to_vec=None, ignore_tag=None, use_nfkc=False):
-        super().__init__(beam_size=beam_size, beam_history=2, iterations=iterations, latent_features=None, ignore_target=ignore_tag)
+    boundary_markers = frozenset(["<START-2>", "<START-1>", "<END+1>", "<END+2>"])
+    # word flags in the order in which they are added to the features
+    word_flags = ("isalpha", "isnumeric", "islower", "isupper", "istitle",
+                  "isemail", "istag", "isurl", "ismention", "ishashtag",
+                  "isactword", "isemoticon", "isemoji", "ispunct",
+                  "isordinal", "isnumber")
+    # resources that are stored as indexes in the model (cf.
+    # ResourceIndex)
+    resource_names = ("lexicon", "brown_clusters", "word_to_vec")
+    # attributes that are set by load()
+    model_attributes = ("vocabulary", "lexicon", "brown_clusters", "word_to_vec", "target_mapping", "target_size", "feature_index", "weights", "weight_scales")
+
+    def __init__(self, beam_size=5, iterations=10, lexicon=None, mapping=None, brown_clusters=None, word_to_vec=None, ignore_tag=None, use_nfkc=False, hash_bits=None, decoder="beam", cache_size=65536, train_parallel=1):
+        super().__init__(beam_size=beam_size, beam_history=2, iterations=iterations, latent_features=None, ignore_target=ignore_tag, hash_bits=hash_bits, decoder=decoder, train_parallel=train_parallel)
+        self.latent_words = None
+        self.cache_size = cache_size
+        self.model_file = None
+        self.lazy = False
+        self._init_cache()
         self.use_nfkc = use_nfkc
         self.vocabulary = set()
         self.lexicon = lexicon
@@ -99,27 +125,91 @@ class ASPTagger(AveragedStructuredPerceptron):
                                    r"|" +
                                    r"|".join([re.escape(_) for _ in emoticon_list]) +
                                    r")$", re.VERBOSE)
+        # characters that an emoticon can start with
+        self.emoticon_initials = set(":;8Xx^Do") | set(e[0] for e in emoticon_list)
         # Unicode emoticons and other symbols
         self.unicode_flags = re.compile(r"^\p{Regional_Indicator}{2}$")
         # self.emoji = re.compile(r"^[\u2600-\u27BF\uFE0E\uFE0F\U0001F300-\U0001f64f\U0001F680-\U0001F6FF\U0001F900-\U0001F9FF]$")
         self.emoji = re.compile(r"[\p{Extended_Pictographic}\p{Emoji_Presentation}\uFE0F\u2600-\u27BF]")
 
-    def train(self, words, tags, lengths):
-        """"""
+    def train(self, words, tags, lengths, static_features=None):
+        """Train the tagger. The static features of the corpus can be
+        given as `static_features` (cf. get_static_features), e.g.
+        from a feature cache; otherwise they are extracted.
+
+        """
         if self.use_nfkc:
             feature_words = [unicodedata.normalize("NFKC", w) for w in words]
         else:
             feature_words = words
         lower_words = [w.lower() for w in feature_words]
-        self.latent_features = functools.partial(self._get_latent_features, lower_words)
+        self._set_latent_words(lower_words)
         self.vocabulary.update(set(feature_words))
         # self.vocabulary.update(set(lower_words))
         # <OOV>
         # # vocabulary = all lower case word forms except hapax legomena
         # self.vocabulary.update(set(k for k, v in collections.Counter(lower_words).items() if v > 1))
         # </OOV>
-        X = self._get_static_features(feature_words, lengths)
-        self.fit(X, tags, lengths)
+        if static_features is None:
+            X = self._get_static_features(feature_words, lengths)
+            self.fit(X, tags, lengths)
+        else:
+            self.fit_ids(static_features.to_id_arrays(self.feature_index), tags, lengths)
+        self.model_file = None
+        self._init_cache()
+
+    def get_static_features(self, words, lengths, cache_dir=None):
+        """Return the static features of a corpus (cf.
+        feature_cache.StaticFeatures). If `cache_dir` is given, the
+        features are cached on disk, keyed by a hash of the corpus and
+        a hash of the resources that the features depend on (lexicon,
+        Brown clusters, word2vec vectors), i.e. repeated training runs
+        on the same corpus extract them only once.
+
+        """
+        def extract():
+            if self.use_nfkc:
+                feature_words = [unicodedata.normalize("NFKC", w) for w in words]
+            else:
+                feature_words = words
+            return feature_cache.StaticFeatures.from_lists(self._get_static_features(feature_words, lengths))
+
+        if cache_dir is None:
+            return extract()
+        key = "%s-%s" % (feature_cache.corpus_hash(words, lengths), feature_cache.resource_hash(self.use_nfkc, self.lexicon, self.brown_clusters, self.word_to_vec))
+        return feature_cache.cached(cache_dir, key, extract)
+
+    def train_stream(self, sentences, shuffle_buffer=10000):
+        """Train the tagger on a corpus that does not fit into memory.
+        `sentences` is a function that returns an iterator over the
+        sentences of the corpus as (words, tags, length) tuples (cf.
+        utils.iter_corpus). It is called once for collecting tagset
+        and vocabulary and once per iteration; the features are
+        extracted sentence by sentence. The sentences are shuffled
+        with a buffer of `shuffle_buffer` sentences.
+
+        """
+        if self.train_parallel > 1:
+            raise ValueError("Streaming training cannot be combined with parallel training")
+        targets = collections.Counter()
+        for words, tags, length in sentences():
+            if self.use_nfkc:
+                words = [unicodedata.normalize("NFKC", w) for w in words]
+            self.vocabulary.update(words)
+            targets.update(tags)
+
+        def corpus():
+            for words, tags, length in utils.shuffle_buffered(sentences(), shuffle_buffer):
+                if self.use_nfkc:
+                    feature_words = [unicodedata.normalize("NFKC", w) for w in words]
+                else:
+                    feature_words = words
+                self._set_latent_words([w.lower() for w in feature_words])
+                yield self._get_static_features(feature_words, [length]), tags
+
+        self.fit_stream(corpus, targets)
+        self.model_file = None
+        self._init_cache()
 
     def tag(self, words, lengths):
         """"""
@@ -127,8 +217,8 @@ class ASPTagger(AveragedStructuredPerceptron):
             feature_words = [unicodedata.normalize("NFKC", w) for w in words]
         else:
             feature_words = words
-        self.latent_features = functools.partial(self._get_latent_features, [w.lower() for w in feature_words])
-        X = self._get_static_features(feature_words, lengths)
+        self._set_latent_words([w.lower() for w in feature_words])
+        X = self._get_windows(feature_words, lengths)
         tags = self.predict(X, lengths)
         start = 0
         for length, local_tags in zip(lengths, tags):
@@ -139,6 +229,44 @@ class ASPTagger(AveragedStructuredPerceptron):
             else:
                 yield zip(local_words, local_tags)
 
+    def tag_many(self, sentences, chunk_size=256):
+        """Tag an iterable of sentences (lists of tokens) and yield the
+        tagged sentences (lists of tuples, cf. tag_sentence). The
+        sentences are read in chunks of `chunk_size` sentences and the
+        sentences of a chunk are decoded as a batch (cf. tag).
+
+        """
+        sentences = iter(sentences)
+        while True:
+            chunk = list(itertools.islice(sentences, chunk_size))
+            if not chunk:
+                break
+            nonempty = [sentence for sentence in chunk if len(sentence) > 0]
+            tagged = self.tag([w for sentence in nonempty for w in sentence], [len(sentence) for sentence in nonempty])
+            for sentence in chunk:
+                yield list(next(tagged)) if len(sentence) > 0 else []
+
+    def tag_documents(self, documents, chunk_size=256):
+        """Tag an iterable of documents (lists of sentences) and yield the
+        tagged documents (lists of tagged sentences). Short documents
+        are tagged together, in chunks of at least `chunk_size`
+        sentences (cf. tag_many).
+
+        """
+        documents = iter(documents)
+        while True:
+            batch, size = [], 0
+            for document in documents:
+                batch.append(list(document))
+                size += len(batch[-1])
+                if size >= chunk_size:
+                    break
+            if not batch:
+                break
+            tagged = self.tag_many((sentence for document in batch for sentence in document), size)
+            for document in batch:
+                yield list(itertools.islice(tagged, len(document)))
+
     def tag_sentence(self, sentence):
         """"""
         sentence_length = [len(sentence)]
@@ -146,8 +274,8 @@ class ASPTagger(AveragedStructuredPerceptron):
             feature_words = [unicodedata.normalize("NFKC", w) for w in sentence]
         else:
             feature_words = sentence
-        self.latent_features = functools.partial(self._get_latent_features, [w.lower() for w in feature_words])
-        X = self._get_static_features(feature_words, sentence_length)
+        self._set_latent_words([w.lower() for w in feature_words])
+        X = self._get_windows(feature_words, sentence_length)
         tags = list(self.predict(X, sentence_length))[0]
         if self.mapping is not None:
             return list(zip(sentence, tags, (self.mapping[lt] for lt in tags)))
@@ -176,8 +304,8 @@ class ASPTagger(AveragedStructuredPerceptron):
             feature_words = [unicodedata.normalize("NFKC", w) for w in words]
         else:
             feature_words = words
-        self.latent_features = functools.partial(self._get_latent_features, [w.lower() for w in feature_words])
-        X = self._get_static_features(feature_words, lengths)
+        self._set_latent_words([w.lower() for w in feature_words])
+        X = self._get_windows(feature_words, lengths)
         # accuracy = self.score(X, tags, lengths)
         # return accuracy
         predicted = self.predict(X, lengths)
@@ -237,205 +365,289 @@ class ASPTagger(AveragedStructuredPerceptron):
                 coarse_accuracy_oov = 0
         return accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov
 
-    def save(self, filename):
-        """"""
-        with gzip.open(filename, 'wb') as f:
-            features = sorted(self.weights.keys())
-            f.write("[\n".encode())
-            f.write(json.dumps(list(self.vocabulary), ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write(json.dumps(self.lexicon, ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write(json.dumps(self.brown_clusters, ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write(json.dumps(self.word_to_vec, ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write(json.dumps(self.target_mapping, ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write(str(self.target_size).encode())
-            f.write(",\n".encode())
-            f.write(json.dumps(features, ensure_ascii=False, indent=4).encode())
-            f.write(",\n".encode())
-            f.write("[\n".encode())
-            for feat in features[:-1]:
-                f.write('"'.encode())
-                f.write(base64.b85encode(self.weights[feat].tobytes()))
-                f.write('",\n'.encode())
-            f.write('"'.encode())
-            f.write(base64.b85encode(self.weights[features[-1]].tobytes()))
-            f.write('"\n]\n'.encode())
-            f.write("]\n".encode())
-
-    def load(self, filename):
-        """"""
-        # Try an optimised ijson-based loading algorithm if we're on a python
-        # where dict iteration order is guaranteed (3.7+ any interpreter, or
-        # 3.6+ cpython specifically)
-        if sys.version_info >= (3, 7) or (sys.version_info >= (3, 6, 0, 'final') and sys.implementation.name == 'cpython'):
-            try:
-                import ijson
-                with gzip.open(filename, 'rb') as f:
-                    parser = ijson.parse(f)
-                    (prefix, event, value) = next(parser)
-                    assert event == 'start_array'
-                    # vocabulary - need to load JSON array into a Python set
-                    (prefix, event, value) = next(parser)
-                    assert event == 'start_array'
-                    self.vocabulary = set()
-                    (prefix, event, value) = next(parser)
-                    while event == 'string':
-                        self.vocabulary.add(value)
-                        (prefix, event, value) = next(parser)
-
-                    # the simple parts where we don't need to change the default type
-                    item_iter = ijson.items(parser, 'item')
-                    self.lexicon = next(item_iter)
-                    self.brown_clusters = next(item_iter)
-                    self.word_to_vec = next(item_iter)
-                    self.target_mapping = next(item_iter)
-                    self.target_size = next(item_iter)
-
-                    # features and weights - first load the list of features (the
-                    # keys), then apply the parallel list of weights
-                    self.weights = {}
-                    (prefix, event, value) = next(parser)
-                    assert event == 'start_array'
-                    (prefix, event, value) = next(parser)
-                    while event == 'string':
-                        self.weights[value] = 0
-                        (prefix, event, value) = next(parser)
-
-                    # now actual weights are in the same order as keys
-                    (prefix, event, value) = next(parser)
-                    assert event == 'start_array'
-                    for k in self.weights:
-                        (prefix, event, value) = next(parser)
-                        assert event == 'string'
-                        self.weights[k] = np.frombuffer(base64.b85decode(value), np.float64).copy()
-                    return
-
-            except ImportError:
-                pass
-
-        # older Python, or ijson not available - fall back to standard json parser
-        with gzip.open(filename, 'rb') as f:
-            model = json.loads(f.read().decode())
-            vocabulary, self.lexicon, self.brown_clusters, self.word_to_vec, self.target_mapping, self.target_size, features, weights = model
-            self.vocabulary = set(vocabulary)
-            self.weights = {f: np.frombuffer(base64.b85decode(w), np.float64).copy() for f, w in zip(features, weights)}
+    def save(self, filename, dtype=np.float64, threshold=0.0, min_nonzero=1):
+        """Save the model in the binary format (cf. model_io). The
+        weights are stored as a single contiguous matrix of type
+        `dtype` (float64, float32 or, quantised with a scale factor
+        per feature, int16 or int8; cf. model_io.quantize). Features
+        whose weights are all zero are not saved (unless feature
+        hashing is used). Lexicon, Brown clusters and word2vec vectors
+        are stored as indexes that are memory-mapped when the model is
+        loaded (cf. ResourceIndex).
+
+        The model can be pruned: Features whose largest absolute
+        weight is below `threshold` or that have fewer than
+        `min_nonzero` non-zero weights are not saved either. As every
+        update of a feature changes two of its weights, the latter
+        drops features that have been updated only a few times. With
+        feature hashing, the weights of pruned rows are set to zero.
+
+        """
+        weights = self.weights[:len(self.feature_index)]
+        if self.weight_scales is not None:
+            weights = model_io.dequantize(weights, self.weight_scales[:len(self.feature_index)])
+        keep = (np.abs(weights).max(axis=1, initial=0) >= threshold) & (np.count_nonzero(weights, axis=1) >= min_nonzero)
+        dtype = np.dtype(dtype)
+        metadata = {"target_mapping": self.target_mapping,
+                    "target_size": self.target_size,
+                    "hash_bits": self.feature_index.hash_bits}
+        resources = {name: getattr(self, name) for name in self.resource_names if getattr(self, name) is not None}
+
+        def encode(weights):
+            if dtype.kind == "i":
+                return model_io.quantize(weights, dtype)
+            return weights.astype(dtype), None
+
+        if self.feature_index.hash_bits is not None:
+            weights, scales = encode(np.where(keep[:, None], weights, 0))
+            model_io.write_model(filename, metadata, None, weights, self.vocabulary, resources, scales)
+            return
+        kept = np.flatnonzero(keep)
+        features = [self.feature_index.features[i] for i in kept]
+        weights, scales = encode(weights[kept])
+        model_io.write_model(filename, metadata, features, weights, self.vocabulary, resources, scales)
+
+    def load(self, filename, lazy=False):
+        """Load a model. Models in the binary format are memory-mapped;
+        models in the legacy gzipped JSON format are read into memory.
+
+        If `lazy` is True, no in-memory index of the features and no
+        vocabulary set are built; features are looked up in the
+        memory-mapped model file when they are first needed (cf.
+        MappedFeatureIndex). This makes loading almost instantaneous
+        and is meant for short tagging jobs; a lazily loaded model
+        cannot be trained further.
+
+        A tagger with a memory-mapped model is pickled (e.g. when it
+        is sent to worker processes) as a reference to the model file
+        and maps the same file when it is unpickled, i.e. the weights
+        are neither copied nor serialized.
+
+        """
+        self.model_file = None
+        self.lazy = lazy
+        if not model_io.is_binary_model(filename):
+            self.vocabulary, self.lexicon, self.brown_clusters, self.word_to_vec, self.target_mapping, self.target_size, features, weights = model_io.read_legacy_model(filename)
+            self.feature_index = FeatureIndex(features)
+            self.weights = np.array(weights).reshape((len(features), self.target_size))
+            self.weight_scales = None
+            self._init_cache()
+            return
+        metadata, features, weights, scales, self.vocabulary, resources = model_io.read_model(filename, lazy=lazy)
+        for name in self.resource_names:
+            setattr(self, name, resources.get(name))
+        self.target_mapping = metadata["target_mapping"]
+        self.target_size = metadata["target_size"]
+        if metadata.get("hash_bits") is not None:
+            self.feature_index = HashedFeatureIndex(metadata["hash_bits"])
+        elif lazy:
+            self.feature_index = MappedFeatureIndex(features)
+        else:
+            self.feature_index = FeatureIndex(features)
+        self.weights = np.asarray(weights)
+        self.weight_scales = None if scales is None else np.asarray(scales)
+        self.model_file = filename
+        self._init_cache()
 
     def load_prior_model(self, prior):
         """"""
-        with gzip.open(prior, 'rb') as f:
-            model = json.loads(f.read().decode())
-            self.vocabulary = set(model[0])
-            self.target_mapping = model[4]
-            self.target_size = model[5]
-            features = model[6]
-            weights = model[7]
-            self.prior_weights = {f: np.frombuffer(base64.b85decode(w), np.float64).copy() for f, w in zip(features, weights)}
+        hash_bits = None
+        if model_io.is_binary_model(prior):
+            metadata, features, weights, scales, vocabulary, resources = model_io.read_model(prior, mmap=False)
+            if scales is not None:
+                weights = model_io.dequantize(weights, scales)
+            target_mapping, target_size = metadata["target_mapping"], metadata["target_size"]
+            hash_bits = metadata.get("hash_bits")
+            if hash_bits is not None:
+                features = None
+        else:
+            vocabulary, lexicon, brown_clusters, word_to_vec, target_mapping, target_size, features, weights = model_io.read_legacy_model(prior)
+        self.vocabulary = set(vocabulary)
+        self.target_mapping = target_mapping
+        self.target_size = target_size
+        weights = np.array(weights, dtype=np.float64).reshape((-1, target_size))
+        self._set_prior_weights(features, weights, hash_bits)
+        self._init_cache()
 
     def _get_static_features(self, words, lengths):
         """"""
-        lexicon = self.lexicon
-        brown_clusters = self.brown_clusters
-        word_to_vec = self.word_to_vec
-        # <OOV>
-        # vocabulary = self.vocabulary
-        # </OOV>
         features = []
+        for window in self._get_windows(words, lengths):
+            features.append([feat for position, token in window for feat in self._get_partial_features(position, token)])
+        return features
+
+    @staticmethod
+    def _get_windows(words, lengths):
+        """Return the context window of every word, i.e. the word itself
+        and the two preceding and following (lower-cased) tokens, as a
+        tuple of (position, token) pairs.
+
+        """
+        windows = []
         start = 0
         for length in lengths:
             sentence = words[start:start + length]
             start += length
             tokens = ["<START-2>", "<START-1>"] + [w.lower() for w in sentence] + ["<END+1>", "<END+2>"]
             for i, word in enumerate(sentence):
-                j = i + 2
-                local_features = []
-                w = tokens[j]
-                p1 = tokens[j - 1]
-                p2 = tokens[j - 2]
-                n1 = tokens[j + 1]
-                n2 = tokens[j + 2]
-                # constant bias feature acts like a prior
-                local_features.append("bias")
-                # rounded logarithm of word length
-                local_features.append("W_loglength: %d" % round(math.log(len(word))))
-                # current word
-                local_features.append("W_word: %s" % w)
-                # <OOV>
-                # if w in vocabulary:
-                #     local_features.append("W_word: %s" % w)
-                # else:
-                #     local_features.append("W_word: OOV")
-                # </OOV>
-                # next words
-                local_features.append("N1_word: %s" % n1)
-                # <OOV>
-                # if n1 in vocabulary:
-                #     local_features.append("N1_word: %s" % n1)
-                # else:
-                #     local_features.append("N1_word: OOV")
-                # </OOV>
-                local_features.append("N2_word: %s" % n2)
-                # <OOV>
-                # if n2 in vocabulary:
-                #     local_features.append("N2_word: %s" % n2)
-                # else:
-                #     local_features.append("N2_word: OOV")
-                # </OOV>
-                # affixes
-                local_features.append("W_prefix: %s" % w[:3])
-                local_features.append("W_suffix: %s" % w[-3:])
-                if i >= 1:
-                    local_features.append("P1_suffix: %s" % p1[-3:])
-                if length - i > 1:
-                    local_features.append("N1_suffix: %s" % n1[-3:])
-                # word shape
-                local_features.append("W_shape: %s" % self._word_shape(word))
-                # Flags
-                if i >= 2:
-                    local_features.extend(self._word_flags(p2, "P2"))
-                if i >= 1:
-                    local_features.extend(self._word_flags(p1, "P1"))
-                local_features.extend(self._word_flags(w, "W"))
-                if length - i > 1:
-                    local_features.extend(self._word_flags(n1, "N1"))
-                if length - i > 2:
-                    local_features.extend(self._word_flags(n2, "N2"))
-                # Brown clusters
-                if brown_clusters is not None:
-                    # P2, P1, W, N1, N2
-                    if i >= 2:
-                        bc, freq = brown_clusters.get(p2, ("N/A", 0))
-                        local_features.append("P2_brown: %s" % bc)
-                    if i >= 1:
-                        bc, freq = brown_clusters.get(p1, ("N/A", 0))
-                        local_features.append("P1_brown: %s" % bc)
-                    bc, freq = brown_clusters.get(w, ("N/A", 0))
-                    local_features.append("W_brown: %s" % bc)
-                    local_features.append("W_logfreq: %d" % freq)
-                    if length - i > 1:
-                        bc, freq = brown_clusters.get(n1, ("N/A", 0))
-                        local_features.append("N1_brown: %s" % bc)
-                    if length - i > 2:
-                        bc, freq = brown_clusters.get(n2, ("N/A", 0))
-                        local_features.append("N2_brown: %s" % bc)
-                if word_to_vec is not None:
-                    # if w in word_to_vec:
-                    #     for i, d in enumerate(word_to_vec[w]):
-                    #         local_features.append("W_w2v_%d: %d" % (i, round(float(d))))
-                    if w in word_to_vec:
-                        local_features.append("W_w2v: %s" % word_to_vec[w])
-                if lexicon is not None:
-                    if w in lexicon:
-                        for feat in lexicon[w]:
-                            local_features.append("W_lex: %s" % feat)
-                    else:
-                        local_features.append("W_lex: N/A")
-                features.append(local_features)
+                windows.append((("W", word), ("P2", tokens[i]), ("P1", tokens[i + 1]), ("N1", tokens[i + 3]), ("N2", tokens[i + 4])))
+        return windows
+
+    def _get_partial_features(self, position, token):
+        """Return the static features contributed by a single position of
+        a context window. For the current word (position W), `token`
+        is the word as it appears in the input; for the other
+        positions, it is lower-cased or a sentence boundary marker.
+
+        """
+        brown_clusters = self.brown_clusters
+        features = []
+        if position == "W":
+            word = token
+            w = word.lower()
+            # constant bias feature acts like a prior
+            features.append("bias")
+            # rounded logarithm of word length
+            features.append("W_loglength: %d" % round(math.log(len(word))))
+            # current word
+            features.append("W_word: %s" % w)
+            # <OOV>
+            # if w in vocabulary:
+            #     features.append("W_word: %s" % w)
+            # else:
+            #     features.append("W_word: OOV")
+            # </OOV>
+            # affixes
+            features.append("W_prefix: %s" % w[:3])
+            features.append("W_suffix: %s" % w[-3:])
+            # word shape
+            features.append("W_shape: %s" % self._word_shape(word))
+            # Flags
+            features.extend(self._word_flags(w, "W"))
+            # Brown clusters
+            if brown_clusters is not None:
+                bc, freq = brown_clusters.get(w, ("N/A", 0))
+                features.append("W_brown: %s" % bc)
+                features.append("W_logfreq: %d" % freq)
+            if self.word_to_vec is not None:
+                # if w in word_to_vec:
+                #     for i, d in enumerate(word_to_vec[w]):
+                #         features.append("W_w2v_%d: %d" % (i, round(float(d))))
+                if w in self.word_to_vec:
+                    features.append("W_w2v: %s" % self.word_to_vec[w])
+            if self.lexicon is not None:
+                if w in self.lexicon:
+                    for feat in self.lexicon[w]:
+                        features.append("W_lex: %s" % feat)
+                else:
+                    features.append("W_lex: N/A")
+            return features
+        # next words
+        if position in ("N1", "N2"):
+            features.append("%s_word: %s" % (position, token))
+        if token in self.boundary_markers:
+            return features
+        # affixes
+        if position in ("P1", "N1"):
+            features.append("%s_suffix: %s" % (position, token[-3:]))
+        # Flags
+        features.extend(self._word_flags(token, position))
+        # Brown clusters
+        if brown_clusters is not None:
+            bc, freq = brown_clusters.get(token, ("N/A", 0))
+            features.append("%s_brown: %s" % (position, bc))
         return features
 
+    def _compute_partial_weights(self, position, token):
+        """Return the sum of the weights of the static features contributed
+        by a single position of a context window.
+
+        """
+        return self._sum_weights([self.feature_index.lookup(self._get_partial_features(position, token))])[0]
+
+    def _static_weights(self, X):
+        """Return the static weights of the tokens of a sentence. `X`
+        contains the context windows of the tokens (cf. _get_windows).
+        The weights of every (position, token) pair are looked up in
+        the static feature cache.
+
+        """
+        if len(X) == 0:
+            return np.zeros((0, self.target_size))
+        partial_weights = self._partial_weights
+        return np.array([[partial_weights(position, token) for position, token in window] for window in X]).sum(axis=1)
+
+    def _init_cache(self):
+        """Create an empty static feature cache."""
+        self._partial_weights = functools.lru_cache(maxsize=self.cache_size)(self._compute_partial_weights)
+
+    def cache_info(self):
+        """Return hit and miss statistics of the static feature cache
+        (cf. functools.lru_cache).
+
+        """
+        return self._partial_weights.cache_info()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_partial_weights"]
+        if self.model_file is not None:
+            for attribute in self.model_attributes:
+                del state[attribute]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.model_file is not None:
+            self.load(self.model_file, self.lazy)
+        self._init_cache()
+        if self.profiler is not None:
+            # loading the model replaced the feature index
+            self.profiler.instrument(self)
+
+    def _set_latent_words(self, lower_words):
+        """Bind the lower-cased input words to the latent feature
+        function.
+
+        """
+        self.latent_words = lower_words
+        self.latent_features = functools.partial(self._get_latent_features, lower_words)
+
+    def _latent_weight_tensor(self, start, i, cache):
+        """Factorized version of
+        AveragedStructuredPerceptron._latent_weight_tensor: The
+        features produced by _get_latent_features depend either on the
+        previous tag, on the tag before that or on both tags. The
+        latter do not depend on the position and are cached.
+
+        """
+        words = self.latent_words
+        global_i = start + i
+        tag_labels = list(range(self.target_size))
+        p1_tags = tag_labels if i >= 1 else ["<START-1>"]
+        p2_tags = tag_labels if i >= 2 else ["<START-1>" if i == 1 else "<START-2>"]
+        p1_features = []
+        for t1 in p1_tags:
+            features = ["P1_pos: %s" % t1, "P1_pos, W_word: %s, %s" % (t1, words[global_i])]
+            if i >= 1:
+                features.append("P1_word, P1_pos: %s, %s" % (words[global_i - 1], t1))
+            p1_features.append(self.feature_index.lookup(features))
+        p2_features = []
+        for t2 in p2_tags:
+            features = ["P2_pos: %s" % t2]
+            if i >= 2:
+                features.append("P2_word, P2_pos: %s, %s" % (words[global_i - 2], t2))
+            p2_features.append(self.feature_index.lookup(features))
+        pair_key = min(i, 2)
+        if pair_key not in cache:
+            pair_features = [self.feature_index.lookup(["P2_pos, P1_pos: %s, %s" % (t2, t1)]) for t2 in p2_tags for t1 in p1_tags]
+            cache[pair_key] = self._sum_weights(pair_features).reshape((len(p2_tags), len(p1_tags), self.target_size))
+        p1_weights = self._sum_weights(p1_features)
+        p2_weights = self._sum_weights(p2_features)
+        weights = cache[pair_key] + p2_weights[:, None, :]
+        weights += p1_weights[None, :, :]
+        return weights
+
     def _get_latent_features(self, words, start, beam, i):
         """"""
         # <OOV>
@@ -501,40 +713,40 @@ class ASPTagger(AveragedStructuredPerceptron):
                 shape.append(shape_char)
         return "".join(shape)
 
-    @functools.lru_cache(maxsize=10240)
     def _word_flags(self, word, prefix):
-        """"""
-        flags = []
-        if word.isalpha():
-            flags.append("%s_isalpha" % prefix)
-        if word.isnumeric():
-            flags.append("%s_isnumeric" % prefix)
-        if word.islower():
-            flags.append("%s_islower" % prefix)
-        if word.isupper():
-            flags.append("%s_isupper" % prefix)
-        if word.istitle():
-            flags.append("%s_istitle" % prefix)
-        if self.email.search(word):
-            flags.append("%s_isemail" % prefix)
-        if self.xmltag.search(word):
-            flags.append("%s_istag" % prefix)
-        if self.url.search(word):
-            flags.append("%s_isurl" % prefix)
-        if self.mention.search(word):
-            flags.append("%s_ismention" % prefix)
-        if self.hashtag.search(word):
-            flags.append("%s_ishashtag" % prefix)
-        if self.action_word.search(word):
-            flags.append("%s_isactword" % prefix)
-        if self.emoticon.search(word):
-            flags.append("%s_isemoticon" % prefix)
-        if self.emoji.search(word):
-            flags.append("%s_isemoji" % prefix)
-        if self.punctuation.search(word):
-            flags.append("%s_ispunct" % prefix)
-        if self.ordinal.search(word):
-            flags.append("%s_isordinal" % prefix)
-        if self.number.search(word):
-            flags.append("%s_isnumber" % prefix)
-        return flags
+        """Return the flag features of `word` at position `prefix`."""
+        return self._flag_features(self._word_class(word), prefix)
+
+    @functools.lru_cache(maxsize=65536)
+    def _word_class(self, word):
+        """Classify `word` and return a bitmask with bit i set if
+        word_flags[i] applies. Every regular expression is guarded by a
+        cheap test of a necessary condition, i.e. most words are
+        classified without running any of them.
+
+        """
+        if word == "":
+            return 0
+        first = word[0]
+        checks = (word.isalpha(),
+                  word.isnumeric(),
+                  word.islower(),
+                  word.isupper(),
+                  word.istitle(),
+                  ("@" in word or " " in word) and self.email.search(word),
+                  first == "<" and self.xmltag.search(word),
+                  ("." in word or "/" in word) and self.url.search(word),
+                  first == "@" and self.mention.search(word),
+                  first == "#" and self.hashtag.search(word),
+                  first in "*+" and self.action_word.search(word),
+                  first in self.emoticon_initials and self.emoticon.search(word),
+                  max(word) > "\x7f" and self.emoji.search(word),
+                  not first.isalnum() and self.punctuation.search(word),
+                  "." in word and self.ordinal.search(word),
+                  not first.isalpha() and self.number.search(word))
+        return sum(1 << i for i, check in enumerate(checks) if check)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _flag_features(word_class, prefix):
+        return ["%s_%s" % (prefix, flag) for i, flag in enumerate(ASPTagger.word_flags) if word_class >> i & 1]
@@ -6,10 +6,22 @@ import html
 import json
 import logging
 import math
+import os
+import random
+import re
+import stat
 import sys
 import time
 import xml.etree.ElementTree as ET
 
+import numpy as np
+
+# 97.5 percentile points of the t distribution with 1–30 degrees of
+# freedom
+T_975 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
 
 def read_lexicon(filename):
     """Read in the lexicon."""
@@ -60,35 +72,111 @@ def read_word2vec_clusters(fh):
     return word_to_vec
 
 
-def get_sentences(fh, tagged=True, warn_threshold=500):
-    """A generator over the sentence in `filename`."""
-    sentence_counter = 1
-    sentence = []
-    sentence_start = 1
-    for i, line in enumerate(fh, start=1):
-        line = line.strip()
-        if line == "":
-            if tagged:
-                words, tags = zip(*sentence)
-                yield list(words), list(tags)
-            else:
-                yield sentence
-            sentence = []
-            sentence_counter += 1
-            sentence_start = i + 1
+# the characters other than tab and line feed that str.strip()
+# removes; an explicit set is searched much faster than [^\S\t\n]
+OTHER_SPACE = re.compile("[\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]")
+# a line with more than one tab
+MULTIPLE_TABS = re.compile(r"\t[^\n\t]*\t")
+
+
+def read_blocks(fh, block_size=2**16):
+    """Read `fh` in blocks of about `block_size` characters and yield
+    blocks of complete sentences: Stripped lines, each terminated by a
+    newline, the last of which is an empty line. The lines after the
+    last empty line of the file are yielded as a final block, with an
+    empty line appended.
+
+    """
+    lines, rest = [], ""
+    while True:
+        block = fh.read(block_size)
+        if block == "":
+            if rest == "":
+                break
+            # the last line is not terminated by a newline
+            block = rest + "\n"
+        else:
+            block = rest + block
+        cut = block.rfind("\n") + 1
+        block, rest = block[:cut], block[cut:]
+        if block.startswith("\t") or "\t\n" in block or "\n\t" in block or OTHER_SPACE.search(block):
+            block = "\n".join([line.strip() for line in block.split("\n")])
+        # the block starts at the beginning of a line
+        end = block.rfind("\n\n") + 2
+        if end == 1:
+            end = 1 if block.startswith("\n") else 0
+        if end > 0:
+            lines.append(block[:end])
+            yield "".join(lines)
+            lines = [block[end:]]
         else:
-            if tagged:
-                sentence.append(line.split("\t", 2))
+            lines.append(block)
+    final = "".join(lines)
+    if final != "":
+        yield final + "\n"
+
+
+def split_block(block):
+    """Split a block produced by read_blocks into a list of sentences,
+    each a string of newline-separated lines. Every empty line
+    terminates a sentence, i.e. consecutive empty lines produce empty
+    sentences ("").
+
+    """
+    if block.startswith("\n") or "\n\n\n" in block:
+        sentences, sentence = [], []
+        for line in block[:-1].split("\n"):
+            if line == "":
+                sentences.append("\n".join(sentence))
+                sentence = []
             else:
                 sentence.append(line)
-            if len(sentence) == warn_threshold:
-                logging.warn(f"Sentence {sentence_counter} (line {sentence_start}) is extremely long (≥ {warn_threshold}) – Are you sure that the input sentences are delimited by an empty line?")
-    if len(sentence) > 0:
+        return sentences
+    return block[:-2].split("\n\n")
+
+
+def get_raw_sentences(fh, warn_threshold=500):
+    """A generator over the sentences in `fh` as strings of
+    newline-separated, stripped lines ("" for an empty sentence). This
+    is much cheaper than get_sentences, as no lists of lines are
+    created (cf. sentence_lines).
+
+    """
+    sentence_counter = 1
+    sentence_start = 1
+    for block in read_blocks(fh):
+        sentences = split_block(block)
+        if max(sentence.count("\n") for sentence in sentences) + 1 >= warn_threshold:
+            for sentence in sentences:
+                length = len(sentence_lines(sentence))
+                if length >= warn_threshold:
+                    logging.warn(f"Sentence {sentence_counter} (line {sentence_start}) is extremely long (≥ {warn_threshold}) – Are you sure that the input sentences are delimited by an empty line?")
+                sentence_counter += 1
+                sentence_start += length + 1
+        else:
+            sentence_counter += len(sentences)
+            sentence_start += block.count("\n")
+        yield from sentences
+
+
+def sentence_lines(sentence):
+    """Return the lines of a sentence produced by get_raw_sentences."""
+    return sentence.split("\n") if sentence != "" else []
+
+
+def get_sentences(fh, tagged=True, warn_threshold=500):
+    """A generator over the sentence in `filename`."""
+    for sentence in get_raw_sentences(fh, warn_threshold):
         if tagged:
-            words, tags = zip(*sentence)
-            yield list(words), list(tags)
+            fields = sentence.replace("\n", "\t").split("\t")
+            if len(fields) == 2 * (sentence.count("\n") + 1) and MULTIPLE_TABS.search(sentence) is None:
+                # every line has exactly one tab
+                yield fields[0::2], fields[1::2]
+            else:
+                fields = [line.split("\t", 2) for line in sentence_lines(sentence)]
+                yield [f[0] for f in fields], [f[1] for f in fields]
         else:
-            yield sentence
+            yield sentence_lines(sentence)
 
 
 def get_xml_sentences(fh, sentence_tag, warn_threshold=500):
@@ -153,6 +241,99 @@ def iter_corpus(fh, tagged=True):
             yield words, length
 
 
+def shuffle_buffered(iterable, buffer_size):
+    """Yield the items of `iterable` in random order while holding at
+    most `buffer_size` items in memory: Once the buffer is full, every
+    new item replaces a randomly chosen item of the buffer that is
+    yielded.
+
+    """
+    buffer = []
+    for item in iterable:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = random.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    random.shuffle(buffer)
+    yield from buffer
+
+
+def t_975(df):
+    """Return the 97.5 percentile point of the t distribution with `df`
+    degrees of freedom, i.e. the factor for a two-sided 95% confidence
+    interval. Beyond 30 degrees of freedom, an approximation that is
+    accurate to two decimal places is used.
+
+    """
+    if df <= len(T_975):
+        return T_975[df - 1]
+    return 1.96 + 2.4 / df
+
+
+class EncodedCorpus:
+    """A tagged corpus as arrays of word ids, tag ids and sentence
+    lengths plus tables of word and tag types. Saved to a directory,
+    the arrays are memory-mapped when the corpus is loaded, i.e.
+    processes that load the same corpus share its memory. A loaded
+    corpus is pickled as a reference to its directory.
+
+    """
+    def __init__(self, word_types, tag_types, word_ids, tag_ids, lengths, directory=None):
+        self.word_types = word_types
+        self.tag_types = tag_types
+        self.word_ids = word_ids
+        self.tag_ids = tag_ids
+        self.lengths = lengths
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.directory = directory
+
+    def __getstate__(self):
+        if self.directory is not None:
+            return {"directory": self.directory}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if "word_ids" not in state:
+            state = EncodedCorpus.load(state["directory"]).__dict__
+        self.__dict__.update(state)
+
+    @classmethod
+    def encode(cls, words, tags, lengths):
+        """"""
+        word_types, tag_types = {}, {}
+        word_ids = np.fromiter((word_types.setdefault(w, len(word_types)) for w in words), dtype=np.int64, count=len(words))
+        tag_ids = np.fromiter((tag_types.setdefault(t, len(tag_types)) for t in tags), dtype=np.int64, count=len(tags))
+        return cls(list(word_types), list(tag_types), word_ids, tag_ids, np.array(lengths, dtype=np.int64))
+
+    def words(self, start, end):
+        """Return the words of the tokens from `start` to `end`."""
+        word_types = self.word_types
+        return [word_types[i] for i in self.word_ids[start:end].tolist()]
+
+    def tags(self, start, end):
+        """Return the tags of the tokens from `start` to `end`."""
+        tag_types = self.tag_types
+        return [tag_types[i] for i in self.tag_ids[start:end].tolist()]
+
+    def save(self, directory):
+        """"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "types.json"), "w", encoding="utf-8") as fh:
+            json.dump([self.word_types, self.tag_types], fh, ensure_ascii=False)
+        for name in ("word_ids", "tag_ids", "lengths"):
+            np.save(os.path.join(directory, "%s.npy" % name), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory):
+        """"""
+        with open(os.path.join(directory, "types.json"), encoding="utf-8") as fh:
+            word_types, tag_types = json.load(fh)
+        arrays = [np.load(os.path.join(directory, "%s.npy" % name), mmap_mode="r") for name in ("word_ids", "tag_ids", "lengths")]
+        return cls(word_types, tag_types, *arrays, directory=directory)
+
+
 def evaluate(gold, predicted, ignore_tag=None):
     """Evaluate accuracy of predicted against gold."""
     total = len(gold)
@@ -215,10 +396,12 @@ def iter_xml(xml, tagged=True, sentence_tag=None):
     for sentence in getter(xml):
         word_indexes = [i for i, line in enumerate(sentence) if not (line.startswith("<") and line.endswith(">"))]
         if tagged:
-            words, tags = zip(*[sentence[i].split("\t", 2) for i in word_indexes])
+            fields = [sentence[i].split("\t", 2) for i in word_indexes]
+            words, tags = [f[0] for f in fields], [f[1] for f in fields]
         else:
             words = [sentence[i] for i in word_indexes]
-        words = [html.unescape(w) for w in words]
+        # only few words contain character references
+        words = [html.unescape(w) if "&" in w else w for w in words]
         length = len(words)
         if tagged:
             yield words, tags, length
@@ -227,13 +410,12 @@ def iter_xml(xml, tagged=True, sentence_tag=None):
 
 
 def add_pos_to_xml(tagged_sentence, lines, word_indexes):
-    """Add part-of-speech tags to original lines of XML file."""
-    if len(word_indexes) > 0:
-        words, tags = zip(*tagged_sentence)
-    else:
-        tags = []
-    for idx, tag in zip(word_indexes, tags):
-        lines[idx] += "\t%s" % tag
+    """Add part-of-speech tags (and mapped tags) to original lines of
+    XML file.
+
+    """
+    for idx, tagged_word in zip(word_indexes, tagged_sentence):
+        lines[idx] += "\t%s" % "\t".join(tagged_word[1:])
     return lines
 
 
@@ -259,6 +441,31 @@ def int2str(eta):
             return "{:02}:{:02}:{:02}".format(nr_hours, nr_minutes, nr_seconds)
 
 
+def input_size(fh):
+    """Return the size of `fh` in bytes if it is a regular file, else
+    None.
+
+    """
+    try:
+        st = os.fstat(fh.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_size
+
+
+def input_position(fh):
+    """Return the number of bytes of the text file `fh` that have been
+    read so far, or None if it cannot be determined (e.g. for pipes).
+
+    """
+    try:
+        return fh.buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
 class Progress(object):
     """
     Class for showing progress in for-loops
@@ -268,8 +475,14 @@ class Progress(object):
     optional parameters for initialization:
     - length of loop (will calculate approximate ETA)
     - refresh rate (default: every 100 lines)
+    - size of the input in bytes: if the length is unknown, .update
+      can be given the number of bytes read so far; the total number
+      of tokens (and the ETA) is then estimated from the number of
+      tokens per byte seen so far
+    - json_lines: write statistics as JSON lines instead of a status
+      line, at most every `interval` seconds
     """
-    def __init__(self, length=None, rate=100):
+    def __init__(self, length=None, rate=100, size=None, json_lines=False, interval=1.0):
         self.c = 0
         self.rate = rate
         when = time.time()
@@ -280,6 +493,15 @@ class Progress(object):
         self.eta = 0
         self.last = 0
         self.max_msg_length = 0
+        self.size = size
+        self.position = None
+        self.tokens_per_byte = None
+        self.pending = None
+        self.global_speed = 0
+        self.current_speed = 0
+        self.json_lines = json_lines
+        self.interval = interval
+        self.last_json = when
 
     # aliases
     def up(self):
@@ -289,8 +511,47 @@ class Progress(object):
         self.finalize()
 
     # methods
-    def update(self, increment=1):
+    def estimated_length(self):
+        """Return the (estimated) total number of tokens or None."""
+        if self.d is not None:
+            return self.d
+        if self.size and self.tokens_per_byte:
+            return max(self.c, round(self.size * self.tokens_per_byte))
+        return None
+
+    def statistics(self):
+        """Return a dictionary of the current statistics."""
+        elapsed = time.time() - self.start_glob
+        stats = {"elapsed": elapsed, "tokens": self.c, "tokens_per_second": self.c / elapsed if elapsed > 0 else 0}
+        if self.position is not None:
+            stats["bytes"] = self.position
+            stats["bytes_per_second"] = self.position / elapsed if elapsed > 0 else 0
+        if self.size is not None:
+            stats["size"] = self.size
+        length = self.estimated_length()
+        if length is not None:
+            stats["estimated_tokens"] = length
+            stats["eta"] = self.eta
+        if self.pending is not None:
+            stats["pending_chunks"] = self.pending
+        return stats
+
+    def update(self, increment=1, position=None, pending=None):
+        """Add `increment` tokens. `position` is the number of bytes of
+        the input read so far, `pending` the number of chunks of
+        input waiting to be tagged.
+
+        """
+        if position is not None and position != self.position:
+            # the input is read in blocks, i.e. when the position
+            # changes, the tokens so far are about those of the input
+            # up to the previous position
+            if self.position:
+                self.tokens_per_byte = self.c / self.position
+            self.position = position
         self.c += increment
+        if pending is not None:
+            self.pending = pending
 
         if self.c >= self.last + self.rate:
             when = time.time()
@@ -298,34 +559,46 @@ class Progress(object):
             self.current_speed = (self.c - self.last) / (when - self.start_rate)
             self.start_rate = when
             self.last = self.c
-
-            if self.d is not None:
-                self.eta = (self.d - self.c) / self.global_speed
-                msg = "%3d%% (%d/%d). avg: %5d tokens/s. cur: %5d tokens/s. ETA: %s" % (
-                    int(self.c / self.d * 100),
-                    self.c,
-                    self.d,
-                    self.global_speed,
-                    self.current_speed,
-                    int2str(self.eta)
-                )
+            length = self.estimated_length()
+            if length is not None:
+                self.eta = (length - self.c) / self.global_speed
+
+            if self.json_lines:
+                if when - self.last_json >= self.interval:
+                    self.last_json = when
+                    print(json.dumps(self.statistics()), file=sys.stderr)
             else:
-                msg = "%d tokens. average: %5d tokens/s. current: %5d tokens/s." % (
-                    self.c,
-                    self.global_speed,
-                    self.current_speed,
-                )
-            msg_length = len(msg)
-            if msg_length < 79:
-                msg = " " * (79 - msg_length) + msg
-            msg_length = len(msg)
-            if msg_length > self.max_msg_length:
-                self.max_msg_length = msg_length
-            trail = " " * (self.max_msg_length - msg_length)
-            print(msg + trail, end="\r", file=sys.stderr)
+                if length is not None:
+                    msg = "%3d%% (%d/%s%d). avg: %5d tokens/s. cur: %5d tokens/s. ETA: %s" % (
+                        int(self.c / length * 100),
+                        self.c,
+                        "" if self.d is not None else "~",
+                        length,
+                        self.global_speed,
+                        self.current_speed,
+                        int2str(self.eta)
+                    )
+                else:
+                    msg = "%d tokens. average: %5d tokens/s. current: %5d tokens/s." % (
+                        self.c,
+                        self.global_speed,
+                        self.current_speed,
+                    )
+                msg_length = len(msg)
+                if msg_length < 79:
+                    msg = " " * (79 - msg_length) + msg
+                msg_length = len(msg)
+                if msg_length > self.max_msg_length:
+                    self.max_msg_length = msg_length
+                trail = " " * (self.max_msg_length - msg_length)
+                print(msg + trail, end="\r", file=sys.stderr)
 
         if self.c == self.d:
             self.finalize()
 
     def finalize(self):
-        print(" " * self.max_msg_length, end="\r", file=sys.stderr)
+        if self.json_lines:
+            self.eta = 0
+            print(json.dumps(self.statistics()), file=sys.stderr)
+        else:
+            print(" " * self.max_msg_length, end="\r", file=sys.stderr)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""Shared test data: the tagged corpus that comes with SoMeWeTa."""
+
+import itertools
+import os
+import random
+import subprocess
+import sys
+
+from someweta import ASPTagger
+from someweta import utils
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CORPUS = os.path.join(ROOT, "data", "additional_training_german_web_social_media.txt")
+
+
+def read_corpus():
+    """Return words, tags and sentence lengths of the corpus."""
+    with open(CORPUS, encoding="utf-8") as fh:
+        return utils.read_corpus(fh, tagged=True)
+
+
+def sentences(words, lengths):
+    """Split a corpus into a list of sentences."""
+    offsets = itertools.accumulate([0] + list(lengths))
+    return [words[start:start + length] for start, length in zip(offsets, lengths)]
+
+
+def train_tagger(iterations=1, **kwargs):
+    """Return an ASPTagger trained on the corpus (with a fixed seed for
+    shuffling the sentences).
+
+    """
+    random.seed(0)
+    words, tags, lengths = read_corpus()
+    asptagger = ASPTagger(iterations=iterations, **kwargs)
+    asptagger.train(words, tags, lengths)
+    return asptagger
+
+
+def run_script(name, *args, stdin=None, env=None):
+    """Run the command `name` from bin/ with the arguments `args` (and
+    the additional environment variables `env`) and return the
+    completed process (with stdout and stderr as bytes).
+
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, **(env or {}))
+    return subprocess.run([sys.executable, os.path.join(ROOT, "bin", name)] + list(args), input=stdin, capture_output=True, check=True, env=env)
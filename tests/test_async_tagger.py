@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import unittest
+
+from someweta.async_tagger import AsyncTagger
+
+from helpers import read_corpus, sentences, train_tagger
+
+
+class TestAsyncTagger(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asptagger = train_tagger()
+        words, tags, lengths = read_corpus()
+        cls.sentences = sentences(words, lengths)[:20]
+
+    def run_async(self, coroutine):
+        # a call that never returns fails the test instead of blocking it
+        return asyncio.run(asyncio.wait_for(coroutine, timeout=30))
+
+    def test_tag_sentences(self):
+        async def tag():
+            async with AsyncTagger(self.asptagger, max_batch_size=8) as tagger:
+                results = await asyncio.gather(*(tagger.tag_sentence(s) for s in self.sentences))
+                return results, tagger.batches
+        results, batches = self.run_async(tag())
+        self.assertEqual(results, [self.asptagger.tag_sentence(s) for s in self.sentences])
+        self.assertLess(batches, len(self.sentences))
+
+    def test_error(self):
+        def tag_batch(sentences):
+            raise ValueError("tagging failed")
+
+        async def tag():
+            async with AsyncTagger(self.asptagger, max_batch_size=8) as tagger:
+                tag_batch_orig, tagger.tag_batch = tagger.tag_batch, tag_batch
+                results = await asyncio.gather(*(tagger.tag_sentence(s) for s in self.sentences), return_exceptions=True)
+                # the tagger still works after a failed batch
+                tagger.tag_batch = tag_batch_orig
+                return results, await tagger.tag_sentence(self.sentences[0])
+
+        results, tagged = self.run_async(tag())
+        self.assertEqual(len(results), len(self.sentences))
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(tagged, self.asptagger.tag_sentence(self.sentences[0]))
+
+    def test_cancelled_batch(self):
+        release = threading.Event()
+
+        async def tag():
+            tagger = AsyncTagger(self.asptagger)
+            # keep the worker busy so that the batch has to wait in the
+            # queue of the executor
+            tagger.executor.submit(release.wait)
+            call = asyncio.ensure_future(tagger.tag_sentences(self.sentences[:3]))
+            while tagger._running == 0:
+                await asyncio.sleep(0.001)
+            tagger.executor.shutdown(wait=False, cancel_futures=True)
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await call
+            self.assertEqual(tagger._running, 0)
+
+        self.run_async(tag())
+
+    def test_closed(self):
+        async def tag():
+            tagger = AsyncTagger(self.asptagger)
+            await tagger.close()
+            with self.assertRaises(RuntimeError):
+                await tagger.tag_sentences(self.sentences[:3])
+
+        self.run_async(tag())
+
+
+if __name__ == "__main__":
+    unittest.main()
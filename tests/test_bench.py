@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from someweta import bench
+
+from helpers import read_corpus
+
+
+class TestBench(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.model = os.path.join(cls.tmpdir, "bench.model")
+        cls.words, cls.tags, cls.lengths = bench.read_corpus(bench.DEFAULT_CORPUS, 2000)
+        cls.train = bench.bench_train(cls.words, cls.tags, cls.lengths, 1, cls.model)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_read_corpus(self):
+        words, tags, lengths = read_corpus()
+        copies = len(self.words) // len(words)
+        # the minimal number of copies
+        self.assertGreaterEqual(len(self.words), 2000)
+        self.assertLess(len(self.words) - len(words), 2000)
+        self.assertEqual(self.words, words * copies)
+        self.assertEqual(self.tags, tags * copies)
+        self.assertEqual(self.lengths, lengths * copies)
+        # the corpus is never truncated
+        self.assertEqual(bench.read_corpus(bench.DEFAULT_CORPUS, 1)[0], words)
+
+    def test_sentences(self):
+        sentences = bench.sentences(["a", "b", "c", "d"], [1, 3])
+        self.assertEqual(sentences, [["a"], ["b", "c", "d"]])
+        self.assertEqual(sum(len(s) for s in bench.sentences(self.words, self.lengths)), len(self.words))
+
+    def test_best_of(self):
+        calls = []
+        self.assertGreaterEqual(bench.best_of(3, lambda: calls.append(1)), 0)
+        self.assertEqual(len(calls), 3)
+
+    def test_train(self):
+        self.assertTrue(os.path.isfile(self.model))
+        self.assertEqual(self.train["iterations"], 1)
+        self.assertGreater(self.train["tokens_per_second"], 0)
+
+    def test_read(self):
+        read = bench.bench_read(self.words, self.tags, self.lengths, 1)
+        self.assertEqual(sorted(read), ["plain", "tagged"])
+        self.assertGreater(read["tagged"]["tokens_per_second"], 0)
+        self.assertGreater(read["plain"]["mb_per_second"], 0)
+
+    def test_tagging(self):
+        features = bench.bench_features(self.words, self.lengths, 1)
+        self.assertGreater(features["tokens_per_second"], 0)
+        beam = bench.bench_beam(self.words, self.lengths, self.model, [1, 3], 1)
+        self.assertEqual(sorted(beam), ["1", "3"])
+        parallel = bench.bench_parallel(self.words, self.lengths, self.model, [1, 2], 1)
+        if parallel is not None:
+            self.assertEqual(sorted(parallel), ["1", "2"])
+            self.assertEqual(parallel["1"]["speedup"], 1.0)
+
+    def test_load(self):
+        load = bench.bench_load(self.model, 1)
+        self.assertGreater(load["model_size_mb"], 0)
+        self.assertGreater(load["eager"]["seconds"], 0)
+        self.assertGreater(load["lazy"]["seconds"], 0)
+
+    def test_main(self):
+        output = os.path.join(self.tmpdir, "report.json")
+        argv = ["somewe-bench", "--tokens", "1000", "--model", self.model, "--only", "read,features,beam", "--beam-sizes", "2", "--repeat", "1", "-o", output]
+        with unittest.mock.patch.object(sys, "argv", argv):
+            bench.main()
+        with open(output, encoding="utf-8") as fh:
+            report = json.load(fh)
+        self.assertEqual(report["model"], self.model)
+        self.assertGreaterEqual(report["corpus"]["tokens"], 1000)
+        self.assertEqual(sorted(report["results"]), ["beam", "features", "read"])
+        self.assertEqual(sorted(report["results"]["beam"]), ["2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
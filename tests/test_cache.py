@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from someweta import ASPTagger
+
+from helpers import read_corpus, run_script, sentences, train_tagger
+
+
+class TestPartialWeightCache(unittest.TestCase):
+    """The partial weights of (position, token) pairs are cached when
+    tagging; the cache does not change the output.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.model = os.path.join(cls.tmpdir, "cache.model")
+        train_tagger().save(cls.model)
+        words, tags, lengths = read_corpus()
+        cls.sentences = sentences(words, lengths)
+        cls.plain = os.path.join(cls.tmpdir, "plain.txt")
+        with open(cls.plain, mode="w", encoding="utf-8") as fh:
+            fh.write("".join("\n".join(sentence) + "\n\n" for sentence in cls.sentences))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def tagger(self, cache_size):
+        asptagger = ASPTagger(cache_size=cache_size)
+        asptagger.load(self.model)
+        return asptagger
+
+    def test_hits_and_misses(self):
+        asptagger = self.tagger(65536)
+        self.assertEqual(asptagger.cache_info()[:2], (0, 0))
+        sentence = self.sentences[0]
+        tagged = asptagger.tag_sentence(sentence)
+        hits, misses, maxsize, currsize = asptagger.cache_info()
+        # five positions per context window
+        self.assertEqual(hits + misses, 5 * len(sentence))
+        self.assertEqual(currsize, misses)
+        # the second time, every lookup is a hit
+        self.assertEqual(asptagger.tag_sentence(sentence), tagged)
+        self.assertEqual(asptagger.cache_info()[:2], (hits + 5 * len(sentence), misses))
+        # loading a model empties the cache
+        asptagger.load(self.model)
+        self.assertEqual(asptagger.cache_info()[:2], (0, 0))
+
+    def test_cache_size(self):
+        expected = list(self.tagger(None).tag_many(self.sentences))
+        for cache_size in (0, 16):
+            with self.subTest(cache_size=cache_size):
+                asptagger = self.tagger(cache_size)
+                self.assertEqual(list(asptagger.tag_many(self.sentences)), expected)
+                hits, misses, maxsize, currsize = asptagger.cache_info()
+                self.assertLessEqual(currsize, cache_size)
+                if cache_size == 0:
+                    self.assertEqual(hits, 0)
+
+    def test_cli(self):
+        cached = run_script("somewe-tagger", "--tag", self.model, self.plain)
+        uncached = run_script("somewe-tagger", "--tag", self.model, "--cache-size", "0", self.plain)
+        self.assertEqual(cached.stdout.count(b"\n\n"), len(self.sentences))
+        self.assertEqual(uncached.stdout, cached.stdout)
+        self.assertIn(b"Static feature cache: 0 hits", uncached.stderr)
+        self.assertNotIn(b"Static feature cache: 0 hits", cached.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
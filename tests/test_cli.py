@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import sys
+import unittest
+import unittest.mock
+
+from someweta import cli
+
+from helpers import CORPUS
+
+
+def parse(*argv):
+    with unittest.mock.patch.object(sys, "argv", ["somewe-tagger"] + list(argv)):
+        args = cli.arguments()
+    args.CORPUS.close()
+    return args
+
+
+class TestArguments(unittest.TestCase):
+    def assert_error(self, *argv):
+        stderr = io.StringIO()
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(stderr):
+            parse(*argv)
+        return stderr.getvalue()
+
+    def test_stream(self):
+        self.assertTrue(parse("--train", "model", "--stream", CORPUS).stream)
+        self.assertIn("--train-parallel", self.assert_error("--train", "model", "--stream", "--train-parallel", "2", CORPUS))
+        self.assertIn("--feature-cache", self.assert_error("--train", "model", "--stream", "--feature-cache", "cache", CORPUS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import pickle
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from someweta import cli
+from someweta import utils
+
+from helpers import read_corpus
+
+# beam size, iterations, lexicon, mapping, Brown clusters, word2vec
+# vectors, ignore tag, NFKC, hash bits, decoder, cache size
+TAGGER_ARGS = (5, 10, None, None, None, None, None, False, None, "beam", 65536)
+
+
+def corpus_in_worker(args):
+    tagger_args, prior, corpus, static_features = cli.crossvalidation
+    return type(corpus.word_ids).__name__, len(corpus.word_ids)
+
+
+class TestCrossvalidation(unittest.TestCase):
+    def setUp(self):
+        words, tags, lengths = read_corpus()
+        self.corpus = utils.EncodedCorpus.encode(words, tags, lengths)
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "requires the fork start method")
+    def test_shared_corpus(self):
+        # forked workers inherit the corpus, i.e. it is never pickled
+        with unittest.mock.patch.object(utils.EncodedCorpus, "__getstate__", side_effect=AssertionError("corpus pickled")):
+            with unittest.mock.patch.object(cli, "evaluate_fold", corpus_in_worker):
+                results = cli.crossvalidate(TAGGER_ARGS, None, self.corpus, 3, 2)
+        self.assertEqual(results, [("memmap", len(self.corpus.word_ids))] * 3)
+        self.assertIsNone(cli.crossvalidation)
+
+    def test_folds(self):
+        results = cli.crossvalidate(TAGGER_ARGS, None, self.corpus, 3, 2)
+        self.assertEqual(len(results), 3)
+        for accuracy, accuracy_iv, accuracy_oov, coarse_accuracy, coarse_accuracy_iv, coarse_accuracy_oov in results:
+            # the corpus is small, i.e. the accuracy on held-out folds is
+            # low (0.4-0.7)
+            self.assertGreater(accuracy, 0.3)
+            self.assertLessEqual(accuracy, 1)
+            self.assertIsNone(coarse_accuracy)
+
+    def test_pickled_corpus(self):
+        # without fork, the corpus is sent as a reference to its directory
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.corpus.save(tmpdir)
+            corpus = utils.EncodedCorpus.load(tmpdir)
+            self.assertEqual(corpus.__getstate__(), {"directory": tmpdir})
+            loaded = pickle.loads(pickle.dumps(corpus))
+            self.assertIsInstance(loaded.word_ids, np.memmap)
+            self.assertEqual(loaded.words(0, 100), self.corpus.words(0, 100))
+            self.assertEqual(loaded.tags(0, 100), self.corpus.tags(0, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import itertools
+import random
+import unittest
+
+from someweta import ASPTagger
+
+from helpers import read_corpus, sentences, train_tagger
+
+
+class TestBatchBeamSearch(unittest.TestCase):
+    """The batched beam search has to produce the same tags as the beam
+    search over single sentences, including the handling of ties.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.asptagger = train_tagger(iterations=2)
+        words, tags, lengths = read_corpus()
+        cls.sentences = sentences(words, lengths)
+
+    def test_same_tags(self):
+        for beam_size in (1, 2, 5, 20):
+            with self.subTest(beam_size=beam_size):
+                self.asptagger.beam_size = beam_size
+                # a batch with a single sentence is decoded by _beam_search
+                expected = [self.asptagger.tag_sentence(s) for s in self.sentences]
+                self.assertEqual(list(self.asptagger.tag_many(self.sentences, len(self.sentences))), expected)
+        self.asptagger.beam_size = 5
+
+    def test_untrained_weights(self):
+        # all weights are zero, i.e. every decision is a tie
+        asptagger = ASPTagger(iterations=0)
+        words, tags, lengths = read_corpus()
+        asptagger.train(words, tags, lengths)
+        expected = [asptagger.tag_sentence(s) for s in self.sentences]
+        self.assertEqual(list(asptagger.tag_many(self.sentences, len(self.sentences))), expected)
+
+    def test_sentence_lengths(self):
+        # sentences of different lengths leave the batch at different
+        # positions; the batch also contains empty sentences
+        batch = [self.sentences[0][:n] for n in (3, 1, 0, 7, 2)] + self.sentences[:3]
+        expected = [self.asptagger.tag_sentence(s) if len(s) > 0 else [] for s in batch]
+        self.assertEqual(list(self.asptagger.tag_many(batch, len(batch))), expected)
+
+
+class TestViterbiSearch(unittest.TestCase):
+    """The Viterbi decoder has to find the tag sequence with the highest
+    score. With a coarse tagset, this can be checked by scoring all
+    tag sequences of short sentences.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        random.seed(0)
+        words, tags, lengths = read_corpus()
+        # 13 tags: the first letters of the STTS tags
+        cls.asptagger = ASPTagger(iterations=2, decoder="viterbi")
+        cls.asptagger.train(words, [t[0] for t in tags], lengths)
+        cls.sentences = sentences(words, lengths)
+
+    def score(self, static_weights, tags, latent_weights):
+        """Return the score of a tag sequence. The latent weights are
+        computed from the complete prefix of every tag, i.e. without
+        assuming that they only depend on the last two tags.
+
+        """
+        score = 0.0
+        for i, tag in enumerate(tags):
+            prefix = tuple(tags[:i])
+            if prefix not in latent_weights:
+                ids = self.asptagger.feature_index.lookup(self.asptagger.latent_features(0, list(prefix), i))
+                latent_weights[prefix] = self.asptagger._sum_weights([ids])[0]
+            score += static_weights[i][tag] + latent_weights[prefix][tag]
+        return score
+
+    def test_optimal(self):
+        asptagger = self.asptagger
+        for sentence in self.sentences[:20]:
+            for length in (1, 2, 3, 4):
+                if len(sentence) < length:
+                    continue
+                words = sentence[:length]
+                asptagger._set_latent_words([w.lower() for w in words])
+                X = asptagger._get_windows(words, [length])
+                static_weights = asptagger._static_weights(X[:length])
+                latent_weights = {}
+                best = max(self.score(static_weights, tags, latent_weights) for tags in itertools.product(range(asptagger.target_size), repeat=length))
+                viterbi = asptagger._viterbi_search(static_weights, 0, {})
+                self.assertEqual(len(viterbi), length)
+                self.assertAlmostEqual(self.score(static_weights, viterbi, latent_weights), best, places=9, msg=words)
+                # beam search never finds a better sequence
+                beam, features = asptagger._beam_search(None, 0, static_weights=static_weights)
+                self.assertLessEqual(self.score(static_weights, beam, latent_weights), best + 1e-9)
+
+    def test_tag(self):
+        # the batch and single-sentence paths use the same decoder
+        expected = [self.asptagger.tag_sentence(s) for s in self.sentences]
+        self.assertEqual(list(self.asptagger.tag_many(self.sentences, len(self.sentences))), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
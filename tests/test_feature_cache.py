@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from someweta import ASPTagger
+
+from helpers import CORPUS, read_corpus, run_script
+
+
+class TestFeatureCache(unittest.TestCase):
+    """Static features are extracted once per corpus and set of
+    resources and reused from the cache directory afterwards.
+
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.words, self.tags, self.lengths = read_corpus()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_static_features(self, asptagger, words=None):
+        """Return the static features of the corpus (or of `words`) and
+        the number of times they have been extracted.
+
+        """
+        words = self.words if words is None else words
+        with unittest.mock.patch.object(asptagger, "_get_static_features", wraps=asptagger._get_static_features) as extract:
+            static_features = asptagger.get_static_features(words, self.lengths, self.cache_dir)
+        return static_features, extract.call_count
+
+    def test_reuse(self):
+        asptagger = ASPTagger()
+        static_features, extracted = self.get_static_features(asptagger)
+        self.assertEqual(extracted, 1)
+        # another tagger with the same resources uses the cached features
+        cached, extracted = self.get_static_features(ASPTagger())
+        self.assertEqual(extracted, 0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertEqual(cached.features, static_features.features)
+        np.testing.assert_array_equal(cached.ids, static_features.ids)
+        np.testing.assert_array_equal(cached.offsets, static_features.offsets)
+        # the cached features are those of the tokens
+        expected = asptagger._get_static_features(self.words, self.lengths)
+        self.assertEqual(len(cached), len(self.words))
+        for i in (0, 1, len(self.words) - 1):
+            self.assertEqual([cached.features[j] for j in cached.ids[cached.offsets[i]:cached.offsets[i + 1]]], expected[i])
+
+    def test_training(self):
+        # training on cached features gives the same model
+        taggers = []
+        for static_features in (None, self.get_static_features(ASPTagger())[0]):
+            random.seed(0)
+            asptagger = ASPTagger(iterations=2)
+            asptagger.train(self.words, self.tags, self.lengths, static_features)
+            taggers.append(asptagger)
+        expected, cached = taggers
+        self.assertEqual(cached.feature_index.ids, expected.feature_index.ids)
+        np.testing.assert_array_equal(cached.weights, expected.weights)
+
+    def test_invalidation(self):
+        self.get_static_features(ASPTagger())
+        # new entries for another lexicon, another version of the
+        # lexicon, NFKC and another corpus
+        lexicon = {"ich": ["PPER"]}
+        for asptagger, words in [(ASPTagger(lexicon=lexicon), None),
+                                 (ASPTagger(lexicon={"ich": ["PPER", "NN"]}), None),
+                                 (ASPTagger(use_nfkc=True), None),
+                                 (ASPTagger(), ["x"] + self.words[1:])]:
+            with self.subTest(lexicon=asptagger.lexicon, use_nfkc=asptagger.use_nfkc, words=words is not None):
+                self.assertEqual(self.get_static_features(asptagger, words)[1], 1)
+                self.assertEqual(self.get_static_features(asptagger, words)[1], 0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 5)
+        # the lexicon is part of the features
+        cached, extracted = self.get_static_features(ASPTagger(lexicon=lexicon))
+        self.assertEqual(extracted, 0)
+        self.assertIn("W_lex: PPER", cached.features)
+
+    def test_cli(self):
+        # the sentences are shuffled after every iteration, i.e.
+        # training for one iteration is deterministic
+        models, logs = [], []
+        for i, args in enumerate([[], ["--feature-cache", self.cache_dir], ["--feature-cache", self.cache_dir]]):
+            models.append(os.path.join(self.cache_dir, "model%d" % i))
+            logs.append(run_script("somewe-tagger", "--train", models[-1], "-i", "1", *args, CORPUS).stderr)
+        self.assertIn(b"Saving static features", logs[1])
+        self.assertIn(b"Loading static features", logs[2])
+        self.assertNotIn(b"Saving static features", logs[2])
+        contents = []
+        for model in models:
+            with open(model, mode="rb") as fh:
+                contents.append(fh.read())
+        self.assertEqual(contents[1], contents[0])
+        self.assertEqual(contents[2], contents[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from someweta import ASPTagger
+from someweta import model_io
+
+from helpers import read_corpus, train_tagger
+
+
+def train(**kwargs):
+    words, tags, lengths = read_corpus()
+    lexicon = collections.defaultdict(set)
+    for word, tag in zip(words[::7], tags[::7]):
+        lexicon[word.lower()].add(tag)
+    return train_tagger(iterations=2, lexicon={word: sorted(tags) for word, tags in lexicon.items()}, **kwargs)
+
+
+class TestQuantize(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        weights = rng.normal(size=(100, 7))
+        weights[3] = 0
+        for dtype in ("int16", "int8"):
+            quantized, scales = model_io.quantize(weights, dtype)
+            self.assertEqual(quantized.dtype, np.dtype(dtype))
+            self.assertEqual(scales.dtype, np.float32)
+            self.assertEqual(scales[3], 1)
+            # the largest absolute weight of every row is representable
+            np.testing.assert_array_equal(np.abs(quantized[[0, 1, 2]]).max(axis=1), np.iinfo(dtype).max)
+            restored = model_io.dequantize(quantized, scales)
+            self.assertEqual(restored.dtype, np.float64)
+            # the error is at most half a quantisation step
+            self.assertTrue(np.all(np.abs(restored - weights) <= scales[:, None] * 0.5 + 1e-9))
+
+
+class TestModelIO(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.asptagger = train()
+        cls.hashed = train(hash_bits=12)
+        cls.words, cls.tags, cls.lengths = read_corpus()
+        cls.asptagger.save(os.path.join(cls.tmpdir, "float64.model"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def tag(self, asptagger):
+        return asptagger.evaluate(self.words, self.tags, self.lengths)[0]
+
+    def load(self, filename, lazy=False):
+        asptagger = ASPTagger()
+        asptagger.load(filename, lazy=lazy)
+        return asptagger
+
+    def test_float64(self):
+        original = self.asptagger
+        for lazy in (False, True):
+            loaded = self.load(self.path("float64.model"), lazy=lazy)
+            self.assertEqual(loaded.target_mapping, original.target_mapping)
+            self.assertEqual(loaded.target_size, original.target_size)
+            self.assertEqual(loaded.weights.dtype, np.float64)
+            self.assertIsNone(loaded.weight_scales)
+            self.assertEqual(len(loaded.lexicon), len(original.lexicon))
+            for word in self.words[:100]:
+                self.assertIn(word, loaded.vocabulary)
+            # features whose weights are all zero are not saved
+            for feature, row in original.feature_index.ids.items():
+                ids = loaded.feature_index.lookup([feature])
+                if np.any(original.weights[row] != 0):
+                    np.testing.assert_array_equal(loaded.weights[ids[0]], original.weights[row])
+                else:
+                    self.assertEqual(ids, [])
+            self.assertEqual(self.tag(loaded), self.tag(original))
+
+    def test_dtypes(self):
+        accuracy = self.tag(self.asptagger)
+        for dtype in model_io.WEIGHT_DTYPES[1:]:
+            filename = self.path("%s.model" % dtype)
+            self.asptagger.save(filename, dtype=np.dtype(dtype))
+            loaded = self.load(filename)
+            self.assertEqual(loaded.weights.dtype, np.dtype(dtype))
+            self.assertEqual(loaded.weight_scales is not None, np.dtype(dtype).kind == "i")
+            self.assertAlmostEqual(self.tag(loaded), accuracy, delta=0.01)
+            self.assertLess(os.path.getsize(filename), os.path.getsize(self.path("float64.model")))
+
+    def test_prune(self):
+        self.asptagger.save(self.path("pruned.model"), dtype=np.int8, threshold=0.5, min_nonzero=3)
+        unpruned = self.load(self.path("float64.model"))
+        pruned = self.load(self.path("pruned.model"))
+        self.assertLess(len(pruned.feature_index), len(unpruned.feature_index))
+        weights = model_io.dequantize(np.asarray(pruned.weights, dtype=np.float64), pruned.weight_scales)
+        self.assertTrue(np.all(np.abs(weights).max(axis=1) >= 0.5 * (1 - 1 / 127)))
+        self.assertTrue(np.all(np.count_nonzero(unpruned.weights[unpruned.feature_index.lookup(pruned.feature_index.features)], axis=1) >= 3))
+        self.assertGreater(self.tag(pruned), 0.5)
+        # pruned and quantised models can be converted again
+        pruned.save(self.path("pruned_again.model"))
+        self.assertEqual(self.tag(self.load(self.path("pruned_again.model"))), self.tag(pruned))
+
+    def test_hashed(self):
+        self.hashed.save(self.path("hashed.model"), dtype=np.int16, threshold=0.1)
+        loaded = self.load(self.path("hashed.model"))
+        self.assertEqual(loaded.feature_index.hash_bits, 12)
+        self.assertEqual(loaded.weights.shape, (2**12, self.hashed.target_size))
+        self.assertAlmostEqual(self.tag(loaded), self.tag(self.hashed), delta=0.01)
+
+    def test_version(self):
+        with open(self.path("float64.model"), "rb") as fh:
+            header, data_start = model_io.read_header(fh)
+        self.assertEqual(header["format_version"], model_io.FORMAT_VERSION)
+        # models of another format version are rejected
+        with open(self.path("float64.model"), "rb") as fh:
+            data = fh.read()
+        length, = struct.unpack("<Q", data[8:16])
+        header["format_version"] = model_io.FORMAT_VERSION + 1
+        encoded = json.dumps(header, ensure_ascii=False).encode()
+        encoded += b" " * (length - len(encoded))
+        self.assertEqual(len(encoded), length)
+        with open(self.path("version2.model"), "wb") as fh:
+            fh.write(data[:16] + encoded + data[16 + length:])
+        with self.assertRaises(ValueError):
+            self.load(self.path("version2.model"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from someweta import cli
+from someweta import multifile
+from someweta import ASPTagger
+
+from helpers import read_corpus, run_script, sentences, train_tagger
+
+
+class TestMultifile(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.model = os.path.join(cls.tmpdir, "multifile.model")
+        train_tagger().save(cls.model)
+        cls.asptagger = ASPTagger()
+        cls.asptagger.load(cls.model)
+        words, tags, lengths = read_corpus()
+        sents = sentences(words, lengths)
+        # texts of different sizes
+        cls.texts = []
+        for i, n in enumerate((5, 40, 1)):
+            filename = os.path.join(cls.tmpdir, "text%d.txt" % i)
+            with open(filename, mode="w", encoding="utf-8") as fh:
+                fh.write("".join("\n".join(sentence) + "\n\n" for sentence in sents[:n]))
+            cls.texts.append(filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(dir=self.tmpdir)
+        self.prefix = self.output_dir + os.sep
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def expected(self, filename):
+        return run_script("somewe-tagger", "--tag", self.model, filename).stdout
+
+    def read(self, filename):
+        with open(filename, mode="rb") as fh:
+            return fh.read()
+
+    def test_schedule(self):
+        outnames = [multifile.output_filename(text, self.prefix, ".tagged") for text in self.texts]
+        # largest file first
+        self.assertEqual(multifile.schedule(self.texts, self.prefix, ".tagged"), [(self.texts[i], outnames[i]) for i in (1, 0, 2)])
+        with open(outnames[1], mode="w", encoding="utf-8") as fh:
+            fh.write("done\n")
+        self.assertEqual(multifile.schedule(self.texts, self.prefix, ".tagged", skip_existing=True), [(self.texts[i], outnames[i]) for i in (0, 2)])
+        self.assertEqual(len(multifile.schedule(self.texts, self.prefix, ".tagged")), 3)
+
+    def test_tag_file(self):
+        outname = os.path.join(self.output_dir, "out")
+        n_tokens = multifile.tag_file(self.asptagger, self.texts[0], outname)
+        self.assertEqual(self.read(outname), self.expected(self.texts[0]))
+        self.assertEqual(n_tokens, self.read(outname).count(b"\t"))
+        # no temporary file is left behind
+        self.assertEqual(os.listdir(self.output_dir), ["out"])
+
+    def test_atomic_output(self):
+        outname = os.path.join(self.output_dir, "out")
+        with open(outname, mode="w", encoding="utf-8") as fh:
+            fh.write("previous\n")
+
+        def fail(*args, **kwargs):
+            yield b"partial\n", 1
+            raise RuntimeError("tagging failed")
+
+        # an interrupted run neither replaces nor creates output files
+        with unittest.mock.patch.object(cli, "tag_chunks", fail):
+            with self.assertRaises(RuntimeError):
+                multifile.tag_file(self.asptagger, self.texts[0], outname)
+            with self.assertRaises(RuntimeError):
+                multifile.tag_file(self.asptagger, self.texts[0], outname + "2")
+        self.assertEqual(os.listdir(self.output_dir), ["out"])
+        self.assertEqual(self.read(outname), b"previous\n")
+
+    def test_cli(self):
+        for parallel in ("1", "2"):
+            with self.subTest(parallel=parallel):
+                run_script("somewe-tagger-multifile", "--tag", self.model, "--parallel", parallel, "--output-prefix", self.prefix, *self.texts)
+                for text in self.texts:
+                    self.assertEqual(self.read(multifile.output_filename(text, self.prefix, ".tagged")), self.expected(text))
+                self.assertEqual(len(os.listdir(self.output_dir)), 3)
+
+    def test_skip_existing(self):
+        outnames = [multifile.output_filename(text, self.prefix, ".tagged") for text in self.texts]
+        with open(outnames[0], mode="w", encoding="utf-8") as fh:
+            fh.write("previous\n")
+        log = run_script("somewe-tagger-multifile", "--tag", self.model, "--skip-existing", "--output-prefix", self.prefix, *self.texts).stderr
+        self.assertIn(("Skipping %s" % self.texts[0]).encode(), log)
+        self.assertEqual(self.read(outnames[0]), b"previous\n")
+        for text, outname in zip(self.texts[1:], outnames[1:]):
+            self.assertEqual(self.read(outname), self.expected(text))
+        # without --skip-existing, all texts are tagged
+        run_script("somewe-tagger-multifile", "--tag", self.model, "--output-prefix", self.prefix, *self.texts)
+        self.assertEqual(self.read(outnames[0]), self.expected(self.texts[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from someweta import cli
+from someweta import utils
+
+from helpers import read_corpus, run_script, sentences, train_tagger
+
+XML = "<doc>\n<s>\nDas\nist\n<b>\ngut\n</b>\n</s>\n<s>\n&amp;\n</s>\n</doc>\n"
+
+
+def print_output(asptagger, text, xml=False, sentence_tag=None):
+    """The previous output of somewe-tagger --tag, printed sentence by
+    sentence.
+
+    """
+    out = io.StringIO()
+    if xml:
+        for words, length, lines, word_indexes in utils.iter_xml(io.StringIO(text), tagged=False, sentence_tag=sentence_tag):
+            sentence = next(asptagger.tag_many([words]))
+            print("\n".join(utils.add_pos_to_xml(sentence, lines, word_indexes)), file=out)
+            if sentence_tag is None:
+                print(file=out)
+    else:
+        for words, length in utils.iter_corpus(io.StringIO(text), tagged=False):
+            sentence = next(asptagger.tag_many([words]))
+            print("\n".join(["\t".join(t) for t in sentence]), "\n", sep="", file=out)
+    return out.getvalue()
+
+
+class TestOutput(unittest.TestCase):
+    """The tagger output is formatted and encoded chunk by chunk (cf.
+    cli.tag_chunks) and has to be identical to the output of the
+    previous print loop.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        words, tags, lengths = read_corpus()
+        cls.asptagger = train_tagger()
+        cls.mapped = train_tagger(mapping={tag: tag[:2] for tag in tags})
+        sents = sentences(words, lengths)
+        # with an empty sentence
+        sents[2:2] = [[]]
+        cls.text = "".join("\n".join(sentence) + "\n\n" for sentence in sents)
+
+    def output(self, asptagger, text, xml=False, sentence_tag=None, chunk_size=64, encoding="utf-8", errors="strict"):
+        chunks = cli.single_core_tagging(io.StringIO(text), asptagger, xml, sentence_tag, chunk_size, encoding, errors)
+        return b"".join(data for data, n_tokens, position, pending in chunks)
+
+    def test_plain(self):
+        for asptagger in (self.asptagger, self.mapped):
+            expected = print_output(asptagger, self.text).encode()
+            for chunk_size in (1, 7, 64):
+                with self.subTest(mapping=asptagger.mapping is not None, chunk_size=chunk_size):
+                    self.assertEqual(self.output(asptagger, self.text, chunk_size=chunk_size), expected)
+
+    def test_xml(self):
+        for text, sentence_tag in [(XML, "s"), (XML.replace("</s>\n", "</s>\n\n"), None)]:
+            with self.subTest(sentence_tag=sentence_tag):
+                expected = print_output(self.asptagger, text, True, sentence_tag).encode()
+                self.assertEqual(self.output(self.asptagger, text, True, sentence_tag), expected)
+
+    def test_token_counts(self):
+        words, tags, lengths = read_corpus()
+        chunks = list(cli.single_core_tagging(io.StringIO(self.text), self.asptagger, chunk_size=7))
+        self.assertEqual(sum(n_tokens for data, n_tokens, position, pending in chunks), len(words))
+        for data, n_tokens, position, pending in chunks:
+            self.assertEqual(data.count(b"\t"), n_tokens)
+
+    def test_encoding(self):
+        text = "Schöne\nGrüße\n\n"
+        self.assertEqual(self.output(self.asptagger, text, encoding="latin-1"), print_output(self.asptagger, text).encode("latin-1"))
+        self.assertIn(b"\n?\t", self.output(self.asptagger, text + "€\n", encoding="latin-1", errors="replace"))
+        with self.assertRaises(UnicodeEncodeError):
+            self.output(self.asptagger, text + "€\n", encoding="latin-1")
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "requires the fork start method")
+    def test_parallel(self):
+        context = multiprocessing.get_context("fork")
+        chunks = cli.parallel_tagging(io.StringIO(self.text), self.mapped, 2, chunk_size=5, context=context)
+        self.assertEqual(b"".join(data for data, n_tokens, position, pending in chunks), print_output(self.mapped, self.text).encode())
+
+    def test_cli(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            model = os.path.join(tmpdir, "output.model")
+            self.asptagger.save(model)
+            plain = os.path.join(tmpdir, "plain.txt")
+            with open(plain, mode="w", encoding="utf-8") as fh:
+                fh.write(self.text + "€\n")
+            expected = print_output(self.asptagger, self.text + "€\n")
+            # the output is encoded like sys.stdout
+            for encoding in ("utf-8", "latin-1:replace"):
+                with self.subTest(encoding=encoding):
+                    output = run_script("somewe-tagger", "--tag", model, plain, env={"PYTHONIOENCODING": encoding}).stdout
+                    self.assertEqual(output, expected.encode(*encoding.split(":")))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import collections
+import copy
+import itertools
+import multiprocessing
+import random
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from someweta import ASPTagger
+from someweta.averaged_structured_perceptron import SparseAccumulator
+
+from helpers import read_corpus
+
+
+class TestMixShards(unittest.TestCase):
+    """The workers of parallel training intern their new features
+    independently; _mix_shards has to map the ids of their averaging
+    sums to the features of the parent.
+
+    """
+    def setUp(self):
+        random.seed(0)
+        words, tags, lengths = read_corpus()
+        self.tagger = ASPTagger(iterations=1)
+        self.tagger._set_latent_words([w.lower() for w in words])
+        static_features = self.tagger._get_static_features(words, lengths)
+        # the static features are known before training starts
+        self.X = [np.array(self.tagger.feature_index.intern(features), dtype=np.intp) for features in static_features]
+        self.tagger._set_targets(collections.Counter(tags))
+        self.y = [self.tagger.target_mapping[t] for t in tags]
+        self.tagger._reserve(len(self.tagger.feature_index))
+        self.tagger.weights_c = SparseAccumulator(self.tagger.target_size)
+        ranges = list(zip((a - b for a, b in zip(itertools.accumulate(lengths), lengths)), lengths))
+        self.shards = [ranges[i::3] for i in range(3)]
+
+    def test_averaging_sums(self):
+        results, workers = [], []
+        for shard in self.shards:
+            worker = copy.deepcopy(self.tagger)
+            results.append((list(shard),) + worker._train_shard(self.X, self.y, list(shard), 0))
+            workers.append(worker)
+        expected = collections.Counter()
+        for worker in workers:
+            for row, col, value in zip(*worker.weights_c.entries()):
+                expected[worker.feature_index.features[row], col] += value / len(workers)
+        # every worker has features that the others do not know
+        self.assertTrue(all(len(worker.feature_index) > len(self.tagger.feature_index) for worker in workers))
+        self.tagger._mix_shards(results, self.shards)
+        mixed = {(self.tagger.feature_index.features[row], col): value for row, col, value in zip(*self.tagger.weights_c.entries())}
+        expected = {key: value for key, value in expected.items() if value != 0}
+        self.assertEqual(set(mixed), set(expected))
+        for key, value in expected.items():
+            self.assertAlmostEqual(mixed[key], value, msg=key)
+
+    def test_weights(self):
+        results, workers = [], []
+        for shard in self.shards:
+            worker = copy.deepcopy(self.tagger)
+            results.append((list(shard),) + worker._train_shard(self.X, self.y, list(shard), 0))
+            workers.append(worker)
+        self.tagger._mix_shards(results, self.shards)
+        # the initial weights are zero, i.e. the mixed weights are the
+        # means of the weights of the workers
+        for feature, row in self.tagger.feature_index.ids.items():
+            expected = sum(w.weights[w.feature_index.ids[feature]] for w in workers if feature in w.feature_index) / len(workers)
+            np.testing.assert_allclose(self.tagger.weights[row], expected, atol=1e-12, err_msg=feature)
+
+
+class TestParallelTraining(unittest.TestCase):
+    def test_train_parallel(self):
+        random.seed(0)
+        words, tags, lengths = read_corpus()
+        tagger = ASPTagger(iterations=10, train_parallel=3)
+        tagger.train(words, tags, lengths)
+        # mixing the shards uniformly converges more slowly than
+        # sequential training (about 0.93 after 10 iterations)
+        accuracy = tagger.evaluate(words, tags, lengths)[0]
+        self.assertGreater(accuracy, 0.75)
+
+    def shard_permutations(self):
+        """Train two iterations on two shards and return how the workers
+        have shuffled their shards.
+
+        """
+        random.seed(0)
+        words, tags, lengths = read_corpus()
+        n = sum(lengths[:40])
+        tagger = ASPTagger(iterations=2, train_parallel=2)
+        permutations = []
+        mix_shards = tagger._mix_shards
+
+        def record(results, shards):
+            for shard, result in zip(shards, results):
+                # the positions of the sentences of the shard before
+                # training in the reshuffled shard
+                permutations.append(tuple(result[0].index(r) for r in shard))
+            return mix_shards(results, shards)
+
+        with unittest.mock.patch.object(tagger, "_mix_shards", record):
+            tagger.train(words[:n], tags[:n], lengths[:40])
+        return permutations
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "requires the fork start method")
+    def test_shuffling(self):
+        # every worker shuffles its shard with its own seed, i.e. the
+        # permutations differ between shards and between iterations
+        # but are reproducible
+        permutations = self.shard_permutations()
+        self.assertEqual(len(permutations), 4)
+        self.assertEqual(len(set(permutations)), 4)
+        self.assertEqual(self.shard_permutations(), permutations)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from someweta import ASPTagger
+
+from helpers import read_corpus, train_tagger
+
+
+class TestPrior(unittest.TestCase):
+    """Training with a prior model folds the prior weights into the
+    weights, i.e. a trained tagger scores the same in memory and after
+    saving and loading it.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.prior = os.path.join(cls.tmpdir, "prior.model")
+        train_tagger(iterations=2).save(cls.prior)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def train_with_prior(self, prior):
+        words, tags, lengths = read_corpus()
+        random.seed(1)
+        asptagger = ASPTagger(iterations=1)
+        asptagger.load_prior_model(prior)
+        # the prior has been trained on the whole corpus
+        n = sum(lengths[:40])
+        asptagger.train(words[:n], tags[:n], lengths[:40])
+        return asptagger
+
+    def assert_same_evaluation(self, asptagger):
+        self.assertIsNone(asptagger.prior_weights)
+        words, tags, lengths = read_corpus()
+        n = sum(lengths[:40])
+        # held-out sentences, where the prior matters most
+        held_out = words[n:], tags[n:], lengths[40:]
+        filename = os.path.join(self.tmpdir, "model")
+        asptagger.save(filename)
+        loaded = ASPTagger()
+        loaded.load(filename)
+        self.assertEqual(asptagger.evaluate(*held_out), loaded.evaluate(*held_out))
+        sentence = words[n:n + lengths[40]]
+        self.assertEqual(asptagger.tag_sentence(sentence), loaded.tag_sentence(sentence))
+
+    def test_prior(self):
+        self.assert_same_evaluation(self.train_with_prior(self.prior))
+
+    def test_hashed_prior(self):
+        prior = os.path.join(self.tmpdir, "hashed_prior.model")
+        train_tagger(iterations=2, hash_bits=14).save(prior)
+        self.assert_same_evaluation(self.train_with_prior(prior))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from someweta import cli
+from someweta import profiling
+from someweta import ASPTagger
+
+from helpers import read_corpus, run_script, sentences, train_tagger
+
+
+class TestProfiler(unittest.TestCase):
+    def test_exclusive_time(self):
+        profiler = profiling.Profiler()
+        with profiler.stage("outer"):
+            time.sleep(0.02)
+            with profiler.stage("inner"):
+                time.sleep(0.1)
+        outer, inner = profiler.stages["outer"], profiler.stages["inner"]
+        self.assertEqual((outer[0], inner[0]), (1, 1))
+        self.assertGreaterEqual(inner[1], 0.1)
+        # the time of the inner stage is not part of the outer one
+        self.assertGreaterEqual(outer[1], 0.02)
+        self.assertLess(outer[1], 0.1)
+
+    def test_merge(self):
+        profiler = profiling.Profiler()
+        profiler.stages = {"decoding": [2, 1.0]}
+        profiler.counters = {"beam size": [10, 2]}
+        profiler.merge({"stages": {"decoding": [1, 0.5], "scoring": [3, 0.25]}, "counters": {"beam size": [5, 1]}, "caches": {"word shape": [4, 1]}})
+        report = profiler.report()
+        self.assertEqual(report["seconds"], 1.75)
+        self.assertEqual(list(report["stages"]), ["decoding", "scoring"])
+        self.assertEqual(report["stages"]["decoding"]["calls"], 3)
+        self.assertEqual(report["averages"]["beam size"], 5)
+        self.assertEqual(report["caches"]["word shape"]["hit_rate"], 0.8)
+
+
+class TestProfiledTagging(unittest.TestCase):
+    """Profiling does not change the output; with worker processes, the
+    statistics of the workers are merged into those of the parent.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.model = os.path.join(cls.tmpdir, "profiling.model")
+        train_tagger().save(cls.model)
+        words, tags, lengths = read_corpus()
+        cls.n_tokens = len(words)
+        cls.n_sentences = len(lengths)
+        cls.text = "".join("\n".join(sentence) + "\n\n" for sentence in sentences(words, lengths))
+        cls.plain = os.path.join(cls.tmpdir, "plain.txt")
+        with open(cls.plain, mode="w", encoding="utf-8") as fh:
+            fh.write(cls.text)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def tagger(self, profiled=True):
+        asptagger = ASPTagger()
+        asptagger.load(self.model)
+        if profiled:
+            profiling.Profiler().instrument(asptagger)
+        return asptagger
+
+    def tag(self, asptagger, parallel=None):
+        if parallel is None:
+            chunks = cli.single_core_tagging(io.StringIO(self.text), asptagger, chunk_size=8)
+        else:
+            chunks = cli.parallel_tagging(io.StringIO(self.text), asptagger, parallel, chunk_size=8, context=multiprocessing.get_context("fork"))
+        return b"".join(data for data, n_tokens, position, pending in chunks)
+
+    def assert_complete(self, report):
+        # one step of the tag generator per sentence and one lookup
+        # per position of the context window of every token
+        self.assertEqual(report["stages"]["tagging"]["calls"], self.n_sentences)
+        static_weights = report["caches"]["static weights"]
+        self.assertEqual(static_weights["hits"] + static_weights["misses"], 5 * self.n_tokens)
+        for stage in ("decoding", "scoring", "context windows", "reading", "formatting"):
+            self.assertIn(stage, report["stages"])
+
+    def test_single_core(self):
+        asptagger = self.tagger()
+        self.assertEqual(self.tag(asptagger), self.tag(self.tagger(profiled=False)))
+        self.assert_complete(asptagger.profiler.report(asptagger))
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "requires the fork start method")
+    def test_parallel(self):
+        asptagger = self.tagger()
+        # statistics of the parent are not counted twice
+        self.tag(asptagger)
+        asptagger.profiler.reset(asptagger)
+        self.assertEqual(self.tag(asptagger, 2), self.tag(self.tagger(profiled=False)))
+        self.assert_complete(asptagger.profiler.report(asptagger))
+
+    def test_cli(self):
+        profile = os.path.join(self.tmpdir, "profile.json")
+        stderr = run_script("somewe-tagger", "--tag", self.model, "--parallel", "2", "--profile-json", profile, self.plain).stderr
+        self.assertIn(b"static weights cache:", stderr)
+        with open(profile, encoding="utf-8") as fh:
+            report = json.load(fh)
+        static_weights = report["caches"]["static weights"]
+        self.assertEqual(static_weights["hits"] + static_weights["misses"], 5 * self.n_tokens)
+        self.assertIn("decoding", report["stages"])
+        self.assertIn("writing", report["stages"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from someweta import cli
+from someweta import utils
+
+from helpers import read_corpus, run_script, sentences, train_tagger
+
+
+class TestProgress(unittest.TestCase):
+    """The progress of tagging is estimated from the number of bytes of
+    the input that have been read.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        words, tags, lengths = read_corpus()
+        cls.asptagger = train_tagger()
+        cls.model = os.path.join(cls.tmpdir, "progress.model")
+        cls.asptagger.save(cls.model)
+        # larger than one block of utils.read_blocks
+        cls.n_tokens = 40 * len(words)
+        cls.plain = os.path.join(cls.tmpdir, "plain.txt")
+        with open(cls.plain, mode="w", encoding="utf-8") as fh:
+            fh.write("".join("\n".join(sentence) + "\n\n" for sentence in sentences(words, lengths)) * 40)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_input_size(self):
+        with open(self.plain, encoding="utf-8") as fh:
+            self.assertEqual(utils.input_size(fh), os.path.getsize(self.plain))
+            self.assertEqual(utils.input_position(fh), 0)
+            fh.read(10)
+            position = utils.input_position(fh)
+            self.assertGreaterEqual(position, 10)
+            self.assertLessEqual(position, os.path.getsize(self.plain))
+        self.assertIsNone(utils.input_size(io.StringIO("a\n")))
+        self.assertIsNone(utils.input_position(io.StringIO("a\n")))
+        read, write = os.pipe()
+        os.close(write)
+        with open(read, encoding="utf-8") as pipe:
+            self.assertIsNone(utils.input_size(pipe))
+
+    def test_positions(self):
+        # the positions increase up to the end of the file
+        with open(self.plain, encoding="utf-8") as fh:
+            chunks = list(cli.single_core_tagging(fh, self.asptagger))
+        positions = [position for data, n_tokens, position, pending in chunks]
+        self.assertEqual(positions, sorted(positions))
+        self.assertGreater(len(set(positions)), 1)
+        self.assertEqual(positions[-1], os.path.getsize(self.plain))
+        self.assertEqual(sum(n_tokens for data, n_tokens, position, pending in chunks), self.n_tokens)
+
+    def test_estimate(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            progress = utils.Progress(rate=1, size=1000)
+            progress.update(10, position=100)
+            # the tokens of the first block are not known before the
+            # next block has been read
+            self.assertIsNone(progress.estimated_length())
+            progress.update(10, position=200)
+            self.assertEqual(progress.estimated_length(), 100)
+            progress.update(30, position=200)
+            self.assertEqual(progress.estimated_length(), 100)
+            progress.update(10, position=300)
+            self.assertEqual(progress.estimated_length(), 250)
+            # never less than the number of tokens so far
+            progress.update(500, position=400)
+            self.assertEqual(progress.estimated_length(), 560)
+        self.assertIn("(560/~560)", stderr.getvalue())
+
+    def test_json_lines(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            progress = utils.Progress(rate=1, size=1000, json_lines=True, interval=0)
+            progress.update(10, position=100, pending=3)
+            progress.update(10, position=200, pending=2)
+            progress.finalize()
+        lines = [json.loads(line) for line in stderr.getvalue().splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0]["pending_chunks"], 3)
+        self.assertNotIn("estimated_tokens", lines[0])
+        self.assertEqual(lines[1]["estimated_tokens"], 100)
+        self.assertEqual(lines[2]["eta"], 0)
+        self.assertEqual((lines[2]["tokens"], lines[2]["bytes"], lines[2]["size"]), (20, 200, 1000))
+
+    def test_cli(self):
+        stderr = run_script("somewe-tagger", "--tag", self.model, "--progress-json", self.plain).stderr.decode()
+        lines = [json.loads(line) for line in stderr.splitlines() if line.startswith("{")]
+        self.assertGreater(len(lines), 0)
+        final = lines[-1]
+        self.assertEqual(final["tokens"], self.n_tokens)
+        self.assertEqual(final["size"], os.path.getsize(self.plain))
+        self.assertEqual(final["bytes"], final["size"])
+        self.assertGreaterEqual(final["estimated_tokens"], self.n_tokens)
+        # the input is piped, i.e. its size is unknown
+        with open(self.plain, mode="rb") as fh:
+            stderr = run_script("somewe-tagger", "--tag", self.model, "--progress-json", "-", stdin=fh.read()).stderr.decode()
+        self.assertIn("Input is not a regular file", stderr)
+        final = [json.loads(line) for line in stderr.splitlines() if line.startswith("{")][-1]
+        self.assertEqual(final["tokens"], self.n_tokens)
+        self.assertNotIn("size", final)
+
+
+if __name__ == "__main__":
+    unittest.main()
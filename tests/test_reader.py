@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import html
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from someweta import utils
+
+from helpers import CORPUS
+
+
+def line_by_line(fh, tagged=True):
+    """The previous implementation of utils.get_sentences, which strips
+    and collects one line at a time (without the warning about long
+    sentences). It used zip(*sentence) to separate words and tags,
+    which failed if every line of a sentence had more than two
+    fields.
+
+    """
+    sentence = []
+    for line in fh:
+        line = line.strip()
+        if line == "":
+            if tagged:
+                yield [f[0] for f in sentence], [f[1] for f in sentence]
+            else:
+                yield sentence
+            sentence = []
+        else:
+            if tagged:
+                sentence.append(line.split("\t", 2))
+            else:
+                sentence.append(line)
+    if len(sentence) > 0:
+        if tagged:
+            yield [f[0] for f in sentence], [f[1] for f in sentence]
+        else:
+            yield sentence
+
+
+def line_by_line_xml(fh, tagged=True):
+    """The previous implementation of utils.iter_xml without a
+    sentence tag.
+
+    """
+    for sentence in line_by_line(fh, tagged=False):
+        word_indexes = [i for i, line in enumerate(sentence) if not (line.startswith("<") and line.endswith(">"))]
+        if tagged:
+            fields = [sentence[i].split("\t", 2) for i in word_indexes]
+            words, tags = [f[0] for f in fields], [f[1] for f in fields]
+        else:
+            words = [sentence[i] for i in word_indexes]
+        words = [html.unescape(w) for w in words]
+        if tagged:
+            yield words, tags, len(words)
+        else:
+            yield words, len(words), sentence, word_indexes
+
+
+def block_sentences(text, block_size):
+    """Split `text` with read_blocks and split_block."""
+    blocks = utils.read_blocks(io.StringIO(text), block_size)
+    return [utils.sentence_lines(sentence) for block in blocks for sentence in utils.split_block(block)]
+
+
+class TestReader(unittest.TestCase):
+    """The block reader (read_blocks, split_block, get_raw_sentences)
+    returns the same sentences as the previous line-by-line reader.
+
+    """
+    def assert_same_sentences(self, text, tagged=False):
+        expected = list(line_by_line(io.StringIO(text), tagged))
+        self.assertEqual(list(utils.get_sentences(io.StringIO(text), tagged)), expected)
+        if not tagged:
+            # sentences that span block boundaries
+            for block_size in range(1, 12):
+                self.assertEqual(block_sentences(text, block_size), expected, block_size)
+
+    def test_empty_lines(self):
+        for text in ["", "\n", "\n\n\n", "a\n\n\nb\n", "\na\nb\n\n", "a\n \n\t\nb\n\n", "a\n\n \n\nb"]:
+            with self.subTest(text=text):
+                self.assert_same_sentences(text)
+
+    def test_whitespace(self):
+        for text in ["a\r\nb\r\n\r\nc\r\n", " a \n\tb\t\n\n", "a　\n\xa0b\n\x85\nc\x0b\x0c\n", "a\x1c\n \nb \n"]:
+            with self.subTest(text=text):
+                self.assert_same_sentences(text)
+
+    def test_no_trailing_newline(self):
+        for text in ["a", "a\nb", "a\n\nb", "a\tA\nb\tB\n\nc\tC"]:
+            with self.subTest(text=text):
+                self.assert_same_sentences(text)
+        self.assert_same_sentences("a\tA\nb\tB\n\nc\tC", tagged=True)
+
+    def test_tabs(self):
+        text = "a\tA\tx\nb\tB\n\nc\tC\t\t\nd\t D \t\n\n\te\tE\tx\ty\n"
+        self.assert_same_sentences(text)
+        self.assert_same_sentences(text, tagged=True)
+
+    def test_random(self):
+        random.seed(0)
+        lines = ["a", "bb", "c\tC", "d\tD\tx", " e\tE ", "", "", " ", "\t", "\r", "　f", "g\xa0", "\x85"]
+        for _ in range(200):
+            text = "\n".join(random.choice(lines) for _ in range(random.randrange(30)))
+            if random.random() < 0.5:
+                text += "\n"
+            with self.subTest(text=text):
+                self.assert_same_sentences(text)
+        for _ in range(50):
+            sentences = [[random.choice(["a\tA", " b\tB ", "c\tC\tx", "\td\tD"]) for _ in range(random.randrange(1, 5))] for _ in range(random.randrange(5))]
+            text = "".join("\n".join(sentence) + random.choice(["\n\n", "\n \n", "\n\t\n"]) for sentence in sentences)
+            with self.subTest(text=text):
+                self.assert_same_sentences(text, tagged=True)
+
+    def test_file(self):
+        # a file that is larger than one block, with universal newlines
+        with open(CORPUS, encoding="utf-8") as fh:
+            text = fh.read() * 20
+        self.assertGreater(len(text), 2**17)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "corpus.txt")
+            with open(filename, mode="w", encoding="utf-8", newline="\r\n") as fh:
+                fh.write(text)
+            for tagged in (True, False):
+                with open(filename, encoding="utf-8") as fh:
+                    expected = list(line_by_line(fh, tagged))
+                with open(filename, encoding="utf-8") as fh:
+                    self.assertEqual(list(utils.get_sentences(fh, tagged)), expected)
+
+    def test_xml(self):
+        text = "<doc>\n<s>\nDas\tART\nist\tVAFIN\n &amp; \tKON\n</s>\n\n<s>\n<b>\ngut\tADJD\n</b>\n</s>\n</doc>\n"
+        untagged = "\n".join(line.split("\t")[0] for line in text.split("\n"))
+        self.assertEqual(list(utils.iter_xml(io.StringIO(text))), list(line_by_line_xml(io.StringIO(text))))
+        self.assertEqual(list(utils.iter_xml(io.StringIO(untagged), tagged=False)), list(line_by_line_xml(io.StringIO(untagged), tagged=False)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from someweta.server import Batcher, make_server
+
+from helpers import read_corpus, sentences, train_tagger
+
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asptagger = train_tagger()
+        words, tags, lengths = read_corpus()
+        cls.sentences = sentences(words, lengths)[:5]
+        cls.batcher = Batcher(cls.asptagger)
+        cls.server = make_server(cls.batcher, port=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=30)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read().decode("utf-8")
+        finally:
+            connection.close()
+
+    def test_tag_json(self):
+        status, body = self.request("POST", "/tag", json.dumps({"sentences": self.sentences}), {"Content-Type": "application/json"})
+        self.assertEqual(status, 200)
+        expected = [[list(t) for t in self.asptagger.tag_sentence(s)] for s in self.sentences]
+        self.assertEqual(json.loads(body), {"sentences": expected})
+
+    def test_tag_text(self):
+        text = "".join("\n".join(s) + "\n\n" for s in self.sentences)
+        status, body = self.request("POST", "/tag", text.encode("utf-8"))
+        self.assertEqual(status, 200)
+        expected = "".join("\n".join("\t".join(t) for t in self.asptagger.tag_sentence(s)) + "\n\n" for s in self.sentences)
+        self.assertEqual(body, expected)
+
+    def test_stats(self):
+        status, body = self.request("GET", "/stats")
+        self.assertEqual(status, 200)
+        self.assertIn("requests", json.loads(body))
+
+    def test_not_found(self):
+        self.assertEqual(self.request("GET", "/tag")[0], 404)
+        self.assertEqual(self.request("POST", "/other", b"Ein\nSatz\n")[0], 404)
+
+    def test_bad_request(self):
+        json_headers = {"Content-Type": "application/json"}
+        for body, headers in [(b"{", json_headers),
+                              (b"[]", json_headers),
+                              (b'{"sentences": [[1, 2]]}', json_headers),
+                              (b"Ein\n\xff\n", {}),
+                              (b"Ein\n", {"Content-Length": "abc"}),
+                              (b"Ein\n", {"Content-Length": "-1"})]:
+            with self.subTest(body=body, headers=headers):
+                status, text = self.request("POST", "/tag", body, headers)
+                self.assertEqual(status, 400)
+        # the server is still working
+        self.assertEqual(self.request("POST", "/tag", b"Ein\nSatz\n")[0], 200)
+
+
+class TestBatcher(unittest.TestCase):
+    def test_error(self):
+        class FailingTagger:
+            def tag_many(self, sentences, batch_size):
+                raise RuntimeError("tagging failed")
+
+        batcher = Batcher(FailingTagger())
+        with self.assertRaises(RuntimeError):
+            batcher.tag([["Ein", "Satz"]])
+        # the worker thread survives the error
+        with self.assertRaises(RuntimeError):
+            batcher.tag([["Noch", "einer"]])
+
+    def test_max_batch_size(self):
+        class RecordingTagger:
+            def __init__(self):
+                self.calls = []
+                self.started = threading.Event()
+                self.release = threading.Event()
+
+            def tag_many(self, sentences, batch_size):
+                # block the first batch until the other requests are
+                # queued
+                self.started.set()
+                self.release.wait()
+                self.calls.append((len(sentences), batch_size))
+                return [[(word, "X") for word in sentence] for sentence in sentences]
+
+        tagger = RecordingTagger()
+        batcher = Batcher(tagger, max_batch_size=4)
+        requests = [[["a"]], [["b"]] * 3, [["c"]] * 3, [["d"]] * 5]
+        results = [None] * len(requests)
+
+        def tag(i):
+            results[i] = batcher.tag(requests[i])
+
+        threads = [threading.Thread(target=tag, args=(i,)) for i in range(len(requests))]
+        threads[0].start()
+        tagger.started.wait(30)
+        for i, thread in enumerate(threads[1:], 1):
+            thread.start()
+            while batcher.requests.qsize() < i:
+                time.sleep(0.001)
+        tagger.release.set()
+        for thread in threads:
+            thread.join(30)
+        # the second and the third request together would exceed the
+        # limit; the fourth exceeds it on its own and is decoded in
+        # chunks of the maximal batch size
+        self.assertEqual(tagger.calls, [(1, 4), (3, 4), (3, 4), (5, 4)])
+        self.assertEqual(results, [[[(s[0], "X")] for s in r] for r in requests])
+
+
+class TestUnixSocket(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "someweta.sock")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(self.path)
+        stale.close()
+        server = make_server(None, unix_socket=self.path)
+        server.server_close()
+
+    def test_other_file(self):
+        with open(self.path, "w") as fh:
+            fh.write("keep me")
+        with self.assertRaises(FileExistsError):
+            make_server(None, unix_socket=self.path)
+        with open(self.path) as fh:
+            self.assertEqual(fh.read(), "keep me")
+
+
+if __name__ == "__main__":
+    unittest.main()
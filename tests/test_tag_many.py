@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from helpers import read_corpus, sentences, train_tagger
+
+
+class TestTagMany(unittest.TestCase):
+    """tag_many and tag_documents have to produce the same output as
+    tag_sentence, for every chunk size.
+
+    """
+    @classmethod
+    def setUpClass(cls):
+        words, tags, lengths = read_corpus()
+        mapping = {tag: tag[:2] for tag in tags}
+        cls.asptagger = train_tagger(iterations=2)
+        cls.mapped = train_tagger(iterations=2, mapping=mapping, use_nfkc=True)
+        # with empty sentences in between
+        cls.sentences = sentences(words, lengths)
+        cls.sentences[3:3] = [[], []]
+        cls.sentences.append([])
+
+    def expected(self, asptagger, sentences):
+        return [asptagger.tag_sentence(s) if len(s) > 0 else [] for s in sentences]
+
+    def test_chunk_sizes(self):
+        for asptagger in (self.asptagger, self.mapped):
+            expected = self.expected(asptagger, self.sentences)
+            for chunk_size in (1, 2, 7, 256):
+                with self.subTest(mapping=asptagger.mapping is not None, chunk_size=chunk_size):
+                    self.assertEqual(list(asptagger.tag_many(iter(self.sentences), chunk_size)), expected)
+        # the mapped tags are added
+        self.assertEqual(len(next(self.mapped.tag_many(self.sentences))[0]), 3)
+
+    def test_lazy(self):
+        # the sentences are read chunk by chunk
+        read = []
+
+        def generate():
+            for sentence in self.sentences:
+                read.append(sentence)
+                yield sentence
+
+        tagged = self.asptagger.tag_many(generate(), 4)
+        self.assertEqual(next(tagged), self.expected(self.asptagger, self.sentences[:1])[0])
+        self.assertEqual(len(read), 4)
+        self.assertEqual(len(list(tagged)), len(self.sentences) - 1)
+
+    def test_tag_documents(self):
+        # documents of different sizes, including empty documents;
+        # sentences and documents can be iterators
+        sizes = [3, 0, 1, 12, 2, 0, 5, len(self.sentences)]
+        documents, start = [], 0
+        for size in sizes:
+            documents.append(self.sentences[start:start + size])
+            start = (start + size) % len(self.sentences)
+        expected = [self.expected(self.asptagger, document) for document in documents]
+        for chunk_size in (1, 4, 10, 1000):
+            with self.subTest(chunk_size=chunk_size):
+                tagged = self.asptagger.tag_documents((iter(document) for document in documents), chunk_size)
+                self.assertEqual(list(tagged), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
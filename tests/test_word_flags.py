@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from someweta import ASPTagger
+
+from helpers import read_corpus
+
+WORDS = ["", "a", "Haus", "HAUS", "haus", "Haus-Tür", "42", "٣", "½",
+         "3.", "12.3.", "1.000", "1,5", "-3", "+1", "−2", "1e10", "3,14e-2", ".5",
+         "foo@example.com", "foo [at] example [dot] com", "foo at example dot org",
+         "<s>", "</p>", "<br/>", "<",
+         "http://example.com", "www.example.de", "example.de", "bild.jpg", "/r/de", "u/name",
+         "@user", "@", "#hashtag", "#", "*lach*", "+freu*", "*",
+         ":)", ":-)", ";-)", ":D", ":PP", "8)", "8-)", "xD", "XDD", ":(", ": (", "^^", "^3",
+         "D:", "oO", ":smile:", "<3", "¯\\_(ツ)_/¯", "ಠ_ಠ", "( ͡° ͜ʖ ͡°)", "Ä", "Ö", "Ü", "Äpfel",
+         "😀", "👍🏽", "❤️", "🇩🇪", "☀", "é",
+         ".", "...", "…", "!?", "„", "“", "-", "–", "/", "(", "]", "«",
+         "08:30:00", "z.B.", "u.s.w.", "D-Zug", "o", "x", "8", "^"]
+
+ALPHABET = "aAzZäÄöÖüÜ0189.,:;-+−*#@/<>()[]^_'\"xXDPpoO8 …😀❤️"
+
+
+def reference_flags(asptagger, word):
+    """Return the flag bitmask of `word` by running every check
+    unconditionally, as the flags were computed before they were
+    guarded by cheap tests.
+
+    """
+    checks = (word.isalpha(),
+              word.isnumeric(),
+              word.islower(),
+              word.isupper(),
+              word.istitle(),
+              asptagger.email.search(word),
+              asptagger.xmltag.search(word),
+              asptagger.url.search(word),
+              asptagger.mention.search(word),
+              asptagger.hashtag.search(word),
+              asptagger.action_word.search(word),
+              asptagger.emoticon.search(word),
+              asptagger.emoji.search(word),
+              asptagger.punctuation.search(word),
+              asptagger.ordinal.search(word),
+              asptagger.number.search(word))
+    return sum(1 << i for i, check in enumerate(checks) if check)
+
+
+class TestWordFlags(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.asptagger = ASPTagger()
+
+    def assert_same_flags(self, words):
+        for word in words:
+            self.assertEqual(self.asptagger._word_class(word), reference_flags(self.asptagger, word), msg=repr(word))
+
+    def test_examples(self):
+        self.assert_same_flags(WORDS)
+
+    def test_corpus(self):
+        words, tags, lengths = read_corpus()
+        self.assert_same_flags(set(words))
+
+    def test_random_strings(self):
+        rng = random.Random(0)
+        self.assert_same_flags("".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 6))) for _ in range(20000))
+
+    def test_features(self):
+        # the flags are added in the order of ASPTagger.word_flags
+        self.assertEqual(self.asptagger._word_flags("#hashtag", "W"), ["W_islower", "W_ishashtag"])
+        self.assertEqual(self.asptagger._word_flags("Haus", "N1"), ["N1_isalpha", "N1_istitle"])
+        self.assertEqual(self.asptagger._word_flags("3.", "P2"), ["P2_isordinal"])
+        # overlapping categories are all reported
+        self.assertEqual(self.asptagger._word_flags(":-)", "P1"), ["P1_isemoticon", "P1_ispunct"])
+
+
+if __name__ == "__main__":
+    unittest.main()